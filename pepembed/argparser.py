@@ -1,13 +1,23 @@
 import logging
 import os
-from typing import Optional
+from typing import List, Optional
 
 import typer
 from dotenv import load_dotenv
 
 from ._version import __version__ as pepembed_version
 from .const import (
+    DEFAULT_AUTOTUNE_SAMPLE_SIZE,
     DEFAULT_BATCH_SIZE,
+    DEFAULT_BENCHMARK_SAMPLE_SIZE,
+    DEFAULT_BENCHMARK_TOP_K,
+    DEFAULT_CHUNK_MAX_TOKENS,
+    DEFAULT_CHUNK_MODE,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_PROFILE_DIR,
+    DEFAULT_SINK,
+    DEFAULT_SOURCE,
+    DEFAULT_TRACKING_FILE,
     DENSE_ENCODER_MODEL,
     PKG_NAME,
     QDRANT_DEFAULT_COLLECTION,
@@ -41,8 +51,44 @@ def version_callback(value: bool):
         raise typer.Exit()
 
 
-@app.command()
+def _resolve_collection(qdrant_collection: Optional[str]) -> str:
+    return qdrant_collection or os.environ.get(
+        "QDRANT_COLLECTION", QDRANT_DEFAULT_COLLECTION
+    )
+
+
+def _resolve_sink(sink: Optional[str]) -> str:
+    return sink or os.environ.get("VECTOR_SINK", DEFAULT_SINK)
+
+
+def _resolve_source(source: Optional[str]) -> str:
+    return source or os.environ.get("PROJECT_SOURCE", DEFAULT_SOURCE)
+
+
+def _resolve_dense_model(dense_model: Optional[str]) -> str:
+    return dense_model or os.environ.get("HF_MODEL_DENSE", DENSE_ENCODER_MODEL)
+
+
+def _resolve_extra_dense_models(extra_dense_model: Optional[List[str]]) -> List[str]:
+    if extra_dense_model:
+        return extra_dense_model
+    extra = os.environ.get("HF_MODEL_DENSE_EXTRA", "")
+    return [m.strip() for m in extra.split(",") if m.strip()]
+
+
+def _resolve_sparse_model(sparse_model: Optional[str]) -> str:
+    return sparse_model or os.environ.get("HF_MODEL_SPARSE", SPARSE_ENCODER_MODEL)
+
+
+def _resolve_topology(topology_file: Optional[str], **overrides: Optional[int]):
+    from .topology import load_topology
+
+    return load_topology(topology_file, **overrides)
+
+
+@app.callback(invoke_without_command=True)
 def main(
+    ctx: typer.Context,
     qdrant_collection: Optional[str] = typer.Option(
         None,
         help="Qdrant collection name",
@@ -53,7 +99,7 @@ def main(
     ),
     batch_size: int = typer.Option(
         DEFAULT_BATCH_SIZE,
-        help="Batch size for embedding",
+        help="Maximum batch size for embedding",
     ),
     dense_model: Optional[str] = typer.Option(
         None,
@@ -63,47 +109,828 @@ def main(
         None,
         help="HuggingFace sparse encoder model",
     ),
+    extra_dense_model: Optional[List[str]] = typer.Option(
+        None,
+        help="Additional HuggingFace dense model stored as its own named vector (repeatable)",
+    ),
+    chunking: str = typer.Option(
+        DEFAULT_CHUNK_MODE,
+        help="Chunk long texts: none, pool (mean of chunks) or multivector (also store chunks)",
+    ),
+    chunk_max_tokens: int = typer.Option(
+        DEFAULT_CHUNK_MAX_TOKENS,
+        help="Maximum number of tokens per chunk",
+    ),
+    chunk_overlap: int = typer.Option(
+        DEFAULT_CHUNK_OVERLAP,
+        help="Number of tokens shared by consecutive chunks",
+    ),
+    token_budget: Optional[int] = typer.Option(
+        None,
+        help="Maximum estimated tokens per batch",
+    ),
+    memory_budget_mb: Optional[float] = typer.Option(
+        None,
+        help="RSS budget in MB of the process and its encoder workers, batches shrink when it is exceeded",
+    ),
+    target_batch_seconds: Optional[float] = typer.Option(
+        None,
+        help="Target processing time per batch, batches adapt towards it",
+    ),
+    sparse_top_k: Optional[int] = typer.Option(
+        None,
+        help="Keep only the strongest terms of each uploaded sparse vector",
+    ),
+    sparse_threshold: Optional[float] = typer.Option(
+        None,
+        help="Drop uploaded sparse weights not above this value",
+    ),
+    sparse_float16: bool = typer.Option(
+        False,
+        help="Upload sparse weights at float16 precision and store them as float16",
+    ),
+    detect_changes: bool = typer.Option(
+        True,
+        help="Re-check processed PEPs: re-encode changed texts, only update changed payloads",
+    ),
+    profile: bool = typer.Option(
+        False,
+        help="Profile the run: write a Chrome trace of the stages and a collapsed-stack flamegraph",
+    ),
+    profile_dir: str = typer.Option(
+        DEFAULT_PROFILE_DIR,
+        help="Directory to write the profile of a --profile run into",
+    ),
+    topology: Optional[str] = typer.Option(
+        None,
+        help="JSON file with execution topology settings, e.g. written by autotune",
+    ),
+    dense_workers: Optional[int] = typer.Option(
+        None,
+        help="Processes the dense encoding is spread over, 1 encodes in-process",
+    ),
+    dense_batch_size: Optional[int] = typer.Option(
+        None,
+        help="Batch size of the dense model",
+    ),
+    onnx_threads: Optional[int] = typer.Option(
+        None,
+        help="ONNX Runtime threads of in-process dense encoding, i.e. with 1 dense worker",
+    ),
+    sparse_workers: Optional[int] = typer.Option(
+        None,
+        help="Processes the sparse encoding is spread over, 1 encodes in-process",
+    ),
+    sparse_batch_size: Optional[int] = typer.Option(
+        None,
+        help="Batch size of the sparse model",
+    ),
+    torch_threads: Optional[int] = typer.Option(
+        None,
+        help="Torch threads per sparse encoding process",
+    ),
+    upload_workers: Optional[int] = typer.Option(
+        None,
+        help="Upserts in flight at once against a remote Qdrant",
+    ),
     env_var: Optional[str] = typer.Option(
         None,
         help="Path to .env file, if not set, will not load any .env file",
     ),
+    mined_output: Optional[str] = typer.Option(
+        None,
+        help="Directory to also write the mined texts to as a Parquet dataset",
+    ),
+    encoded_output: Optional[str] = typer.Option(
+        None,
+        help="Directory to also write the embeddings to as a Parquet dataset",
+    ),
+    overwrite: bool = typer.Option(
+        False,
+        help="Replace the datasets already in the output directories",
+    ),
+    sink: Optional[str] = typer.Option(
+        None,
+        help="Where to write points: qdrant, local, file or null",
+    ),
+    sink_path: Optional[str] = typer.Option(
+        None,
+        help="Storage directory for the local sink, or output file for the file sink",
+    ),
+    tracking_file: Optional[str] = typer.Option(
+        None,
+        help="File recording the processed PEPs, defaults to one per collection",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        help="Where projects come from: postgres, directory, jsonl or parquet",
+    ),
+    source_path: Optional[str] = typer.Option(
+        None,
+        help="Directory of PEP configs, or JSONL/Parquet dump for file based sources",
+    ),
     version: bool = typer.Option(
         None, "--version", "-v", callback=version_callback, help="App version"
     ),
 ):
     """Run embedding on PEPs.
 
+    Runs the full pipeline (mine, encode, upload) unless a stage subcommand is given.
+
     Args:
+        ctx: Typer context.
         qdrant_collection: Qdrant collection name.
         recreate_collection: Whether to recreate collection if it exists.
-        batch_size: Batch size for embedding.
+        batch_size: Maximum batch size for embedding.
         dense_model: HuggingFace dense encoder model.
         sparse_model: HuggingFace sparse encoder model.
+        extra_dense_model: Additional HuggingFace dense models.
+        chunking: Chunking mode for long texts: none, pool or multivector.
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+        token_budget: Maximum estimated tokens per batch.
+        memory_budget_mb: RSS budget in MB of the process and its encoder workers.
+        target_batch_seconds: Target processing time per batch.
+        sparse_top_k: Keep only the strongest terms of each uploaded sparse vector.
+        sparse_threshold: Drop uploaded sparse weights not above this value.
+        sparse_float16: Upload sparse weights at float16 precision.
+        detect_changes: Re-check processed PEPs and update the changed ones.
+        profile: Profile the run and write a trace and a collapsed-stack profile.
+        profile_dir: Directory to write the profile into.
+        topology: JSON file with execution topology settings.
+        dense_workers: Processes the dense encoding is spread over.
+        dense_batch_size: Batch size of the dense model.
+        onnx_threads: ONNX Runtime threads of in-process dense encoding.
+        sparse_workers: Processes the sparse encoding is spread over.
+        sparse_batch_size: Batch size of the sparse model.
+        torch_threads: Torch threads per sparse encoding process.
+        upload_workers: Upserts in flight at once against a remote Qdrant.
         env_var: Path to .env file, if not set, will not load any .env file.
+        mined_output: Directory to also write the mined texts to.
+        encoded_output: Directory to also write the embeddings to.
+        overwrite: Replace the datasets already in the output directories.
+        sink: Where to write points: qdrant, local, file or null.
+        sink_path: Storage path for the local and file sinks.
+        tracking_file: File recording the processed PEPs.
+        source: Where projects come from: postgres, directory, jsonl or parquet.
+        source_path: Location of the projects for the file based sources.
         version: Display app version.
     """
+    if ctx.invoked_subcommand is not None:
+        return
+
     # Import here to avoid circular imports
     from .pepembed import pepembed
 
     if env_var:
         load_dotenv(dotenv_path=env_var)
 
-    collection_name = qdrant_collection or os.environ.get(
-        "QDRANT_COLLECTION", QDRANT_DEFAULT_COLLECTION
+    pepembed(
+        batch_size=batch_size,
+        recreate_collection=recreate_collection,
+        collection_name=_resolve_collection(qdrant_collection),
+        hf_model_dense=_resolve_dense_model(dense_model),
+        hf_model_sparse=_resolve_sparse_model(sparse_model),
+        extra_dense_models=_resolve_extra_dense_models(extra_dense_model),
+        chunk_mode=chunking,
+        chunk_max_tokens=chunk_max_tokens,
+        chunk_overlap=chunk_overlap,
+        token_budget=token_budget,
+        memory_budget_mb=memory_budget_mb,
+        target_batch_seconds=target_batch_seconds,
+        sparse_top_k=sparse_top_k,
+        sparse_threshold=sparse_threshold,
+        sparse_float16=sparse_float16,
+        detect_changes=detect_changes,
+        profile_dir=profile_dir if profile else None,
+        mined_output=mined_output,
+        encoded_output=encoded_output,
+        overwrite=overwrite,
+        sink_type=_resolve_sink(sink),
+        sink_path=sink_path,
+        tracking_file=tracking_file,
+        source_type=_resolve_source(source),
+        source_path=source_path,
+        topology=_resolve_topology(
+            topology,
+            dense_workers=dense_workers,
+            dense_batch_size=dense_batch_size,
+            onnx_threads=onnx_threads,
+            sparse_workers=sparse_workers,
+            sparse_batch_size=sparse_batch_size,
+            torch_threads=torch_threads,
+            upload_workers=upload_workers,
+        ),
     )
-    hf_model_dense = dense_model or os.environ.get(
-        "HF_MODEL_DENSE", DENSE_ENCODER_MODEL
+
+
+@app.command()
+def mine(
+    output: str = typer.Option(
+        ...,
+        help="Directory to write the mined Parquet dataset into",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_BATCH_SIZE,
+        help="Number of PEPs per written file",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        help="Where projects come from: postgres, directory, jsonl or parquet",
+    ),
+    source_path: Optional[str] = typer.Option(
+        None,
+        help="Directory of PEP configs, or JSONL/Parquet dump for file based sources",
+    ),
+    skip_processed: bool = typer.Option(
+        False,
+        help="Leave out PEPs already listed in the tracking file",
+    ),
+    tracking_file: str = typer.Option(
+        DEFAULT_TRACKING_FILE,
+        help="Tracking file of the collection the PEPs are mined for",
+    ),
+    overwrite: bool = typer.Option(
+        False,
+        help="Replace the dataset already in the output directory",
+    ),
+    env_var: Optional[str] = typer.Option(
+        None,
+        help="Path to .env file, if not set, will not load any .env file",
+    ),
+):
+    """Mine texts from a project source into a Parquet dataset.
+
+    Args:
+        output: Directory to write the mined Parquet dataset into.
+        batch_size: Number of PEPs per written file.
+        source: Where projects come from: postgres, directory, jsonl or parquet.
+        source_path: Location of the projects for the file based sources.
+        skip_processed: Leave out PEPs already listed in the tracking file.
+        tracking_file: Tracking file of the collection the PEPs are mined for.
+        overwrite: Replace the dataset already in the output directory.
+        env_var: Path to .env file, if not set, will not load any .env file.
+    """
+    from .pepembed import pepembed_mine
+
+    if env_var:
+        load_dotenv(dotenv_path=env_var)
+
+    pepembed_mine(
+        output=output,
+        batch_size=batch_size,
+        source_type=_resolve_source(source),
+        source_path=source_path,
+        skip_processed=skip_processed,
+        tracking_file=tracking_file,
+        overwrite=overwrite,
     )
-    hf_model_sparse = sparse_model or os.environ.get(
-        "HF_MODEL_SPARSE", SPARSE_ENCODER_MODEL
+
+
+@app.command()
+def encode(
+    input_path: str = typer.Option(
+        ...,
+        "--input",
+        help="Directory with the mined Parquet dataset",
+    ),
+    output: str = typer.Option(
+        ...,
+        help="Directory to write the encoded Parquet dataset into",
+    ),
+    overwrite: bool = typer.Option(
+        False,
+        help="Replace the dataset already in the output directory",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_BATCH_SIZE,
+        help="Maximum batch size for embedding",
+    ),
+    dense_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace dense encoder model",
+    ),
+    sparse_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace sparse encoder model",
+    ),
+    extra_dense_model: Optional[List[str]] = typer.Option(
+        None,
+        help="Additional HuggingFace dense model stored as its own named vector (repeatable)",
+    ),
+    chunking: str = typer.Option(
+        DEFAULT_CHUNK_MODE,
+        help="Chunk long texts: none, pool (mean of chunks) or multivector (also store chunks)",
+    ),
+    chunk_max_tokens: int = typer.Option(
+        DEFAULT_CHUNK_MAX_TOKENS,
+        help="Maximum number of tokens per chunk",
+    ),
+    chunk_overlap: int = typer.Option(
+        DEFAULT_CHUNK_OVERLAP,
+        help="Number of tokens shared by consecutive chunks",
+    ),
+    token_budget: Optional[int] = typer.Option(
+        None,
+        help="Maximum estimated tokens per batch",
+    ),
+    memory_budget_mb: Optional[float] = typer.Option(
+        None,
+        help="RSS budget in MB of the process and its encoder workers, batches shrink when it is exceeded",
+    ),
+    target_batch_seconds: Optional[float] = typer.Option(
+        None,
+        help="Target processing time per batch, batches adapt towards it",
+    ),
+    topology: Optional[str] = typer.Option(
+        None,
+        help="JSON file with execution topology settings, e.g. written by autotune",
+    ),
+    dense_workers: Optional[int] = typer.Option(
+        None,
+        help="Processes the dense encoding is spread over, 1 encodes in-process",
+    ),
+    dense_batch_size: Optional[int] = typer.Option(
+        None,
+        help="Batch size of the dense model",
+    ),
+    onnx_threads: Optional[int] = typer.Option(
+        None,
+        help="ONNX Runtime threads of in-process dense encoding, i.e. with 1 dense worker",
+    ),
+    sparse_workers: Optional[int] = typer.Option(
+        None,
+        help="Processes the sparse encoding is spread over, 1 encodes in-process",
+    ),
+    sparse_batch_size: Optional[int] = typer.Option(
+        None,
+        help="Batch size of the sparse model",
+    ),
+    torch_threads: Optional[int] = typer.Option(
+        None,
+        help="Torch threads per sparse encoding process",
+    ),
+    env_var: Optional[str] = typer.Option(
+        None,
+        help="Path to .env file, if not set, will not load any .env file",
+    ),
+):
+    """Encode a mined Parquet dataset into an encoded Parquet dataset.
+
+    Args:
+        input_path: Directory with the mined Parquet dataset.
+        output: Directory to write the encoded Parquet dataset into.
+        overwrite: Replace the dataset already in the output directory.
+        batch_size: Maximum batch size for embedding.
+        dense_model: HuggingFace dense encoder model.
+        sparse_model: HuggingFace sparse encoder model.
+        extra_dense_model: Additional HuggingFace dense models.
+        chunking: Chunking mode for long texts: none, pool or multivector.
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+        token_budget: Maximum estimated tokens per batch.
+        memory_budget_mb: RSS budget in MB of the process and its encoder workers.
+        target_batch_seconds: Target processing time per batch.
+        topology: JSON file with execution topology settings.
+        dense_workers: Processes the dense encoding is spread over.
+        dense_batch_size: Batch size of the dense model.
+        onnx_threads: ONNX Runtime threads of in-process dense encoding.
+        sparse_workers: Processes the sparse encoding is spread over.
+        sparse_batch_size: Batch size of the sparse model.
+        torch_threads: Torch threads per sparse encoding process.
+        env_var: Path to .env file, if not set, will not load any .env file.
+    """
+    from .pepembed import pepembed_encode
+
+    if env_var:
+        load_dotenv(dotenv_path=env_var)
+
+    pepembed_encode(
+        input_path=input_path,
+        output=output,
+        overwrite=overwrite,
+        batch_size=batch_size,
+        hf_model_dense=_resolve_dense_model(dense_model),
+        hf_model_sparse=_resolve_sparse_model(sparse_model),
+        extra_dense_models=_resolve_extra_dense_models(extra_dense_model),
+        chunk_mode=chunking,
+        chunk_max_tokens=chunk_max_tokens,
+        chunk_overlap=chunk_overlap,
+        token_budget=token_budget,
+        memory_budget_mb=memory_budget_mb,
+        target_batch_seconds=target_batch_seconds,
+        topology=_resolve_topology(
+            topology,
+            dense_workers=dense_workers,
+            dense_batch_size=dense_batch_size,
+            onnx_threads=onnx_threads,
+            sparse_workers=sparse_workers,
+            sparse_batch_size=sparse_batch_size,
+            torch_threads=torch_threads,
+        ),
     )
 
-    pepembed(
+
+@app.command()
+def upload(
+    input_path: str = typer.Option(
+        ...,
+        "--input",
+        help="Directory with the encoded Parquet dataset",
+    ),
+    qdrant_collection: Optional[str] = typer.Option(
+        None,
+        help="Qdrant collection name",
+    ),
+    recreate_collection: bool = typer.Option(
+        True,
+        help="Recreate collection if it exists",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_BATCH_SIZE,
+        help="Number of points per upsert",
+    ),
+    sink: Optional[str] = typer.Option(
+        None,
+        help="Where to write points: qdrant, local, file or null",
+    ),
+    sink_path: Optional[str] = typer.Option(
+        None,
+        help="Storage directory for the local sink, or output file for the file sink",
+    ),
+    tracking_file: Optional[str] = typer.Option(
+        None,
+        help="File recording the processed PEPs, defaults to one per collection",
+    ),
+    sparse_top_k: Optional[int] = typer.Option(
+        None,
+        help="Keep only the strongest terms of each uploaded sparse vector",
+    ),
+    sparse_threshold: Optional[float] = typer.Option(
+        None,
+        help="Drop uploaded sparse weights not above this value",
+    ),
+    sparse_float16: bool = typer.Option(
+        False,
+        help="Upload sparse weights at float16 precision and store them as float16",
+    ),
+    topology: Optional[str] = typer.Option(
+        None,
+        help="JSON file with execution topology settings, e.g. written by autotune",
+    ),
+    upload_workers: Optional[int] = typer.Option(
+        None,
+        help="Upserts in flight at once against a remote Qdrant",
+    ),
+    env_var: Optional[str] = typer.Option(
+        None,
+        help="Path to .env file, if not set, will not load any .env file",
+    ),
+):
+    """Upload an encoded Parquet dataset into Qdrant.
+
+    Args:
+        input_path: Directory with the encoded Parquet dataset.
+        qdrant_collection: Qdrant collection name.
+        recreate_collection: Whether to recreate collection if it exists.
+        batch_size: Number of points per upsert.
+        sink: Where to write points: qdrant, local, file or null.
+        sink_path: Storage path for the local and file sinks.
+        tracking_file: File recording the processed PEPs.
+        sparse_top_k: Keep only the strongest terms of each uploaded sparse vector.
+        sparse_threshold: Drop uploaded sparse weights not above this value.
+        sparse_float16: Upload sparse weights at float16 precision.
+        topology: JSON file with execution topology settings.
+        upload_workers: Upserts in flight at once against a remote Qdrant.
+        env_var: Path to .env file, if not set, will not load any .env file.
+    """
+    from .pepembed import pepembed_upload
+
+    if env_var:
+        load_dotenv(dotenv_path=env_var)
+
+    pepembed_upload(
+        input_path=input_path,
         batch_size=batch_size,
         recreate_collection=recreate_collection,
-        collection_name=collection_name,
-        hf_model_dense=hf_model_dense,
-        hf_model_sparse=hf_model_sparse,
+        collection_name=_resolve_collection(qdrant_collection),
+        sink_type=_resolve_sink(sink),
+        sink_path=sink_path,
+        tracking_file=tracking_file,
+        sparse_top_k=sparse_top_k,
+        sparse_threshold=sparse_threshold,
+        sparse_float16=sparse_float16,
+        upload_workers=_resolve_topology(
+            topology, upload_workers=upload_workers
+        ).upload_workers,
+    )
+
+
+@app.command()
+def audit(
+    qdrant_collection: Optional[str] = typer.Option(
+        None,
+        help="Qdrant collection name",
+    ),
+    sink: Optional[str] = typer.Option(
+        None,
+        help="Collection to audit: qdrant or local",
+    ),
+    sink_path: Optional[str] = typer.Option(
+        None,
+        help="Storage directory for the local sink",
+    ),
+    tracking_file: Optional[str] = typer.Option(
+        None,
+        help="File recording the processed PEPs of the collection, defaults to its own",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        help="Where projects come from: postgres, directory, jsonl or parquet",
+    ),
+    source_path: Optional[str] = typer.Option(
+        None,
+        help="Directory of PEP configs, or JSONL/Parquet dump for file based sources",
+    ),
+    repair: bool = typer.Option(
+        False,
+        help="Fix the differences: overwrite stale payloads, delete orphans, upsert missing PEPs",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_BATCH_SIZE,
+        help="Number of points per scroll and per repair request",
+    ),
+    output: Optional[str] = typer.Option(
+        None,
+        help="JSONL file listing every difference",
+    ),
+    dense_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace dense encoder model, used to upsert missing PEPs",
+    ),
+    sparse_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace sparse encoder model, used to upsert missing PEPs",
+    ),
+    extra_dense_model: Optional[List[str]] = typer.Option(
+        None,
+        help="Additional HuggingFace dense model stored as its own named vector (repeatable)",
+    ),
+    chunking: str = typer.Option(
+        DEFAULT_CHUNK_MODE,
+        help="Chunk long texts: none, pool (mean of chunks) or multivector (also store chunks)",
+    ),
+    chunk_max_tokens: int = typer.Option(
+        DEFAULT_CHUNK_MAX_TOKENS,
+        help="Maximum number of tokens per chunk",
+    ),
+    chunk_overlap: int = typer.Option(
+        DEFAULT_CHUNK_OVERLAP,
+        help="Number of tokens shared by consecutive chunks",
+    ),
+    sparse_top_k: Optional[int] = typer.Option(
+        None,
+        help="Keep only the strongest terms of each uploaded sparse vector",
+    ),
+    sparse_threshold: Optional[float] = typer.Option(
+        None,
+        help="Drop uploaded sparse weights not above this value",
+    ),
+    sparse_float16: bool = typer.Option(
+        False,
+        help="Upload sparse weights at float16 precision",
+    ),
+    topology: Optional[str] = typer.Option(
+        None,
+        help="JSON file with execution topology settings, e.g. written by autotune",
+    ),
+    env_var: Optional[str] = typer.Option(
+        None,
+        help="Path to .env file, if not set, will not load any .env file",
+    ),
+):
+    """Compare the collection with the project source and the processed ids.
+
+    Args:
+        qdrant_collection: Qdrant collection name.
+        sink: Collection to audit: qdrant or local.
+        sink_path: Storage directory for the local sink.
+        tracking_file: File recording the processed PEPs of the collection.
+        source: Where projects come from: postgres, directory, jsonl or parquet.
+        source_path: Location of the projects for the file based sources.
+        repair: Fix the differences instead of only reporting them.
+        batch_size: Number of points per scroll and per repair request.
+        output: JSONL file listing every difference.
+        dense_model: HuggingFace dense encoder model.
+        sparse_model: HuggingFace sparse encoder model.
+        extra_dense_model: Additional dense models, each stored as its own named vector.
+        chunking: Chunking mode: none, pool or multivector.
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+        sparse_top_k: Keep only the strongest terms of each uploaded sparse vector.
+        sparse_threshold: Drop uploaded sparse weights not above this value.
+        sparse_float16: Upload sparse weights at float16 precision.
+        topology: JSON file with execution topology settings.
+        env_var: Path to .env file, if not set, will not load any .env file.
+    """
+    from .audit import pepembed_audit
+
+    if env_var:
+        load_dotenv(dotenv_path=env_var)
+
+    pepembed_audit(
+        collection_name=_resolve_collection(qdrant_collection),
+        sink_type=_resolve_sink(sink),
+        sink_path=sink_path,
+        tracking_file=tracking_file,
+        source_type=_resolve_source(source),
+        source_path=source_path,
+        repair=repair,
+        batch_size=batch_size,
+        output=output,
+        hf_model_dense=_resolve_dense_model(dense_model),
+        hf_model_sparse=_resolve_sparse_model(sparse_model),
+        extra_dense_models=_resolve_extra_dense_models(extra_dense_model),
+        chunk_mode=chunking,
+        chunk_max_tokens=chunk_max_tokens,
+        chunk_overlap=chunk_overlap,
+        sparse_top_k=sparse_top_k,
+        sparse_threshold=sparse_threshold,
+        sparse_float16=sparse_float16,
+        topology=_resolve_topology(topology),
+    )
+
+
+@app.command()
+def benchmark(
+    input_path: str = typer.Option(
+        ...,
+        "--input",
+        help="Directory with the mined Parquet dataset",
+    ),
+    model: List[str] = typer.Option(
+        ...,
+        help="HuggingFace dense model to compare (repeatable)",
+    ),
+    sample_size: int = typer.Option(
+        DEFAULT_BENCHMARK_SAMPLE_SIZE,
+        help="Number of mined records used as documents",
+    ),
+    queries: Optional[str] = typer.Option(
+        None,
+        help="JSONL file of {query, relevant} judgments, defaults to project descriptions"
+        " as known-item queries against the config metadata",
+    ),
+    top_k: int = typer.Option(
+        DEFAULT_BENCHMARK_TOP_K,
+        help="Cutoff for recall",
+    ),
+    output: Optional[str] = typer.Option(
+        None,
+        help="Path to write the results to as JSON",
+    ),
+):
+    """Compare retrieval quality and latency of dense models offline.
+
+    Args:
+        input_path: Directory with the mined Parquet dataset.
+        model: HuggingFace dense models to compare.
+        sample_size: Number of mined records used as documents.
+        queries: JSONL file of judged queries.
+        top_k: Cutoff for recall.
+        output: Path to write the results to as JSON.
+    """
+    from .benchmark import benchmark_models
+
+    benchmark_models(
+        input_path=input_path,
+        model_names=model,
+        sample_size=sample_size,
+        queries_path=queries,
+        top_k=top_k,
+        output=output,
+    )
+
+
+@app.command()
+def benchmark_sparse(
+    input_path: str = typer.Option(
+        ...,
+        "--input",
+        help="Directory with the encoded Parquet dataset",
+    ),
+    sparse_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace sparse encoder model the dataset was encoded with",
+    ),
+    prune_top_k: Optional[List[int]] = typer.Option(
+        None,
+        help="Top-k pruning setting to evaluate (repeatable)",
+    ),
+    prune_threshold: Optional[List[float]] = typer.Option(
+        None,
+        help="Threshold pruning setting to evaluate (repeatable)",
+    ),
+    float16: bool = typer.Option(
+        False,
+        help="Also round the weights to float16 in every pruned setting",
+    ),
+    queries: str = typer.Option(
+        ...,
+        help="JSONL file of {query, relevant} judgments. Required, as the sparse vectors"
+        " hold the descriptions that known-item queries would be built from",
+    ),
+    sample_size: int = typer.Option(
+        DEFAULT_BENCHMARK_SAMPLE_SIZE,
+        help="Number of encoded records used as documents",
+    ),
+    top_k: int = typer.Option(
+        DEFAULT_BENCHMARK_TOP_K,
+        help="Cutoff for recall",
+    ),
+    output: Optional[str] = typer.Option(
+        None,
+        help="Path to write the results to as JSON",
+    ),
+):
+    """Measure size reduction and retrieval quality of sparse pruning settings.
+
+    Args:
+        input_path: Directory with the encoded Parquet dataset.
+        sparse_model: HuggingFace sparse encoder model.
+        prune_top_k: Top-k pruning settings to evaluate.
+        prune_threshold: Threshold pruning settings to evaluate.
+        float16: Also round the weights to float16 in every pruned setting.
+        queries: JSONL file of judged queries.
+        sample_size: Number of encoded records used as documents.
+        top_k: Cutoff for recall.
+        output: Path to write the results to as JSON.
+    """
+    from .benchmark import benchmark_sparse_pruning
+
+    configs = [{"top_k": k} for k in prune_top_k or []]
+    configs += [{"threshold": t} for t in prune_threshold or []]
+    if float16:
+        configs = [{**config, "float16": True} for config in configs or [{}]]
+
+    benchmark_sparse_pruning(
+        input_path=input_path,
+        sparse_model_name=_resolve_sparse_model(sparse_model),
+        configs=configs,
+        queries_path=queries,
+        sample_size=sample_size,
+        top_k=top_k,
+        output=output,
+    )
+
+
+@app.command()
+def autotune(
+    input_path: str = typer.Option(
+        ...,
+        "--input",
+        help="Directory with a mined Parquet dataset to sample rows from",
+    ),
+    output: str = typer.Option(
+        "topology.json",
+        help="JSON file to write the fastest topology to",
+    ),
+    dense_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace dense encoder model",
+    ),
+    sparse_model: Optional[str] = typer.Option(
+        None,
+        help="HuggingFace sparse encoder model",
+    ),
+    sample_size: int = typer.Option(
+        DEFAULT_AUTOTUNE_SAMPLE_SIZE,
+        help="Number of mined rows encoded per setting",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_BATCH_SIZE,
+        help="Pipeline batch size the rows are encoded in",
+    ),
+):
+    """Benchmark encoder workers, threads and batch sizes and save the fastest.
+
+    Args:
+        input_path: Directory with a mined Parquet dataset to sample rows from.
+        output: JSON file to write the fastest topology to.
+        dense_model: HuggingFace dense encoder model.
+        sparse_model: HuggingFace sparse encoder model.
+        sample_size: Number of mined rows encoded per setting.
+        batch_size: Pipeline batch size the rows are encoded in.
+    """
+    from .topology import autotune as autotune_topology
+
+    autotune_topology(
+        input_path=input_path,
+        output=output,
+        hf_model_dense=_resolve_dense_model(dense_model),
+        hf_model_sparse=_resolve_sparse_model(sparse_model),
+        sample_size=sample_size,
+        batch_size=batch_size,
     )
 
 
@@ -0,0 +1,538 @@
+"""Consistency audit between a project source and the Qdrant collection.
+
+Both sides are streamed as (id, payload digests) pairs in ascending id order and
+merge-joined, so memory is bounded by the sort chunk, the repair batches and the
+ids of the projects to encode, not by the size of the collection. Only the
+payload fields of the projects are read; configs are loaded for the missing
+projects alone, when they are repaired. Differences found:
+
+- missing: projects in the source without a point
+- orphaned: points whose project is gone from the source
+- stale: points whose payload no longer matches the project, e.g. after a
+  rename or a privacy flip
+- never_landed: ids in the tracking file of the collection without a point
+
+With repair enabled, stale points whose name and description still match are
+overwritten in place without re-encoding. Stale points whose name or
+description changed are encoded and upserted again, as both are part of the
+texts their vectors are built from, and so are missing projects. Orphans are
+deleted, and ids that never landed or were deleted as orphans are dropped from
+the tracking file. Repaired and upserted ids are recorded with their digests,
+so the pipeline does not send them again.
+"""
+
+import heapq
+import json
+import pickle
+import tempfile
+from functools import partial
+from itertools import groupby
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from .connections import CollectionSink, get_sink, get_sparse_model
+from .const import (
+    AUDIT_STATUSES,
+    DEFAULT_AUDIT_SAMPLE_SIZE,
+    DEFAULT_AUDIT_SORT_CHUNK_SIZE,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CHUNK_MAX_TOKENS,
+    DEFAULT_CHUNK_MODE,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_SINK,
+    DEFAULT_SOURCE,
+    DENSE_ENCODER_MODEL,
+    PKG_NAME,
+    QDRANT_DEFAULT_COLLECTION,
+    SPARSE_ENCODER_MODEL,
+)
+from .id_tracker import IDTracker
+from .pepembed import (
+    _check_env,
+    _sink_env_vars,
+    _source_env_vars,
+    build_payload,
+    chunk_vectors,
+    encode_records,
+    get_chunker,
+    get_compactor,
+    get_id_tracker,
+    load_dense_encoders,
+    mine_projects,
+    upsert_records,
+)
+from .sources import ProjectSource, get_source
+from .topology import DEFAULT_TOPOLOGY, Topology, apply_topology
+from .utils import iter_batches, payload_digest, payload_text_digest
+
+_LOGGER = getLogger(PKG_NAME)
+
+
+def _spill(entries: List[Tuple[int, Any]], directory: str, index: int) -> Path:
+    path = Path(directory) / f"chunk-{index:05d}.pkl"
+    with open(path, "wb") as f:
+        for entry in sorted(entries, key=lambda e: e[0]):
+            pickle.dump(entry, f)
+    return path
+
+
+def _read_spilled(path: Path) -> Iterator[Tuple[int, Any]]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def external_sort(
+    entries: Iterable[Tuple[int, Any]],
+    chunk_size: int = DEFAULT_AUDIT_SORT_CHUNK_SIZE,
+) -> Iterator[Tuple[int, Any]]:
+    """Sort a stream of (id, item) pairs by id in bounded memory.
+
+    Chunks of the stream are sorted in memory and spilled to temporary files,
+    which are then merged.
+
+    Args:
+        entries: Stream of (id, item) pairs in any order.
+        chunk_size: Number of pairs sorted in memory at a time.
+
+    Yields:
+        The pairs in ascending id order.
+    """
+    with tempfile.TemporaryDirectory(prefix=f"{PKG_NAME}-audit-") as directory:
+        paths, chunk = [], []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                paths.append(_spill(chunk, directory, len(paths)))
+                chunk = []
+        if not paths:
+            # everything fit in memory
+            yield from sorted(chunk, key=lambda e: e[0])
+            return
+        if chunk:
+            paths.append(_spill(chunk, directory, len(paths)))
+        yield from heapq.merge(*map(_read_spilled, paths), key=lambda e: e[0])
+
+
+def _tag(stream: Iterable[Tuple[int, Any]], index: int) -> Iterator[Tuple]:
+    for key, item in stream:
+        yield key, index, item
+
+
+def merge_join(
+    *streams: Iterable[Tuple[int, Any]]
+) -> Iterator[Tuple[int, List[Optional[Any]]]]:
+    """Full outer join of streams of (id, item) pairs sorted by id.
+
+    Args:
+        streams: Streams sorted by id, each id appearing at most once per stream.
+
+    Yields:
+        Each id with the item of every stream, None where a stream lacks the id.
+    """
+    merged = heapq.merge(
+        *(_tag(stream, i) for i, stream in enumerate(streams)),
+        key=lambda t: (t[0], t[1]),
+    )
+    for key, group in groupby(merged, key=lambda t: t[0]):
+        items = [None] * len(streams)
+        for _, index, item in group:
+            items[index] = item
+        yield key, items
+
+
+def iter_source_entries(
+    source: ProjectSource, chunk_size: int = DEFAULT_AUDIT_SORT_CHUNK_SIZE
+) -> Iterator[Tuple[int, Tuple[str, str, Dict[str, Any]]]]:
+    """Stream the projects of a source with their expected payload, sorted by id.
+
+    Args:
+        source: Source of the projects.
+        chunk_size: Number of rows sorted in memory at a time for unordered sources.
+
+    Yields:
+        Pairs of id and (payload digest, text digest, payload).
+    """
+
+    def entries():
+        for p in source.iter_without_config():
+            try:
+                payload = build_payload(p)
+            except Exception as e:
+                _LOGGER.error(
+                    f"Error processing PEP {p.namespace}/{p.name}:{p.tag}: {e}"
+                )
+                continue
+            yield p.id, (payload_digest(payload), payload_text_digest(payload), payload)
+
+    if source.sorted_by_id:
+        return entries()
+    return external_sort(entries(), chunk_size)
+
+
+def iter_collection_entries(
+    sink: CollectionSink, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[Tuple[int, Tuple[str, str]]]:
+    """Stream the points of the collection with their payload digests, sorted by id.
+
+    Args:
+        sink: The sink of the collection.
+        batch_size: Number of points fetched per scroll request.
+
+    Yields:
+        Pairs of id and (payload digest, text digest).
+    """
+    for point_id, payload in sink.iter_payloads(batch_size):
+        yield point_id, (payload_digest(payload), payload_text_digest(payload))
+
+
+class AuditReport:
+    """Counts the differences found, keeping a few sample ids of each kind."""
+
+    def __init__(
+        self,
+        output: Optional[str] = None,
+        sample_size: int = DEFAULT_AUDIT_SAMPLE_SIZE,
+    ):
+        """
+        Initialize the audit report.
+
+        Args:
+            output: Optional JSON lines file listing every difference
+            sample_size: Number of sample ids kept per kind of difference
+        """
+        self.sample_size = sample_size
+        self.counts = {status: 0 for status in AUDIT_STATUSES}
+        self.samples: Dict[str, List[int]] = {status: [] for status in AUDIT_STATUSES}
+        self.checked = 0
+        self._file = open(output, "w") if output else None
+
+    def add(self, status: str, point_id: int) -> None:
+        """
+        Record a difference.
+
+        Args:
+            status: One of "missing", "orphaned", "stale" or "never_landed"
+            point_id: Id of the project or point
+        """
+        self.counts[status] += 1
+        if len(self.samples[status]) < self.sample_size:
+            self.samples[status].append(point_id)
+        if self._file:
+            self._file.write(json.dumps({"id": point_id, "status": status}) + "\n")
+
+    def close(self) -> None:
+        """Close the output file, if any."""
+        if self._file:
+            self._file.close()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the audit.
+
+        Returns:
+            Dictionary with the number of checked ids, and the count and sample ids
+            of each kind of difference
+        """
+        return {"checked": self.checked, **self.counts, "samples": self.samples}
+
+
+class AuditRepair:
+    """Fixes the differences found by the audit with batched sink operations."""
+
+    def __init__(
+        self,
+        sink: CollectionSink,
+        id_tracker: IDTracker,
+        source: ProjectSource,
+        load_encoder: Callable[[], Callable[[List[Any]], List[Dict[str, Any]]]],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        compactor=None,
+    ):
+        """
+        Initialize the audit repair.
+
+        Args:
+            sink: The sink of the audited collection
+            id_tracker: Tracker of the processed project ids
+            source: Source the missing projects are loaded from
+            load_encoder: Returns a function encoding project rows into encoded records.
+                Only called once a missing project has to be encoded
+            batch_size: Number of operations sent per request
+            compactor: Optional compactor applied to the sparse vectors before upload
+        """
+        self.sink = sink
+        self.id_tracker = id_tracker
+        self.source = source
+        self.load_encoder = load_encoder
+        self.batch_size = batch_size
+        self.compactor = compactor
+        self.payloads: Dict[int, Dict[str, Any]] = {}
+        self.digests: Dict[int, Tuple[str, str]] = {}
+        self.orphans: List[int] = []
+        self.missing: Set[int] = set()
+        self.untracked: List[int] = []
+        self.repaired = {"payloads": 0, "deleted": 0, "upserted": 0, "untracked": 0}
+
+    def overwrite_payload(
+        self, point_id: int, payload: Dict[str, Any], digest: str
+    ) -> None:
+        """Queue a stale payload to be overwritten."""
+        self.payloads[point_id] = payload
+        known = self.id_tracker.get_digests(point_id)
+        if known is not None:
+            # the vectors are untouched, so their digest still holds
+            self.digests[point_id] = (known[0], digest)
+        if len(self.payloads) >= self.batch_size:
+            self._flush_payloads()
+
+    def delete(self, point_id: int) -> None:
+        """Queue an orphaned point to be deleted."""
+        self.orphans.append(point_id)
+        if len(self.orphans) >= self.batch_size:
+            self._flush_orphans()
+
+    def upsert(self, point_id: int) -> None:
+        """Queue a missing or re-worded project to be encoded and upserted."""
+        self.missing.add(point_id)
+
+    def untrack(self, point_id: int) -> None:
+        """Queue an id to be dropped from the tracking file."""
+        self.untracked.append(point_id)
+
+    def _flush_payloads(self) -> None:
+        if self.payloads:
+            self.sink.overwrite_payloads(self.payloads)
+            self.id_tracker.mark_batch_processed(list(self.digests), self.digests)
+            self.repaired["payloads"] += len(self.payloads)
+            self.payloads, self.digests = {}, {}
+
+    def _flush_orphans(self) -> None:
+        if self.orphans:
+            self.sink.delete(self.orphans)
+            self.repaired["deleted"] += len(self.orphans)
+            self.orphans = []
+
+    def _flush_missing(self) -> None:
+        if not self.missing:
+            return
+        # one pass over the source loads the configs of all missing projects
+        encode = self.load_encoder()
+        projects = self.source.iter_by_ids(self.missing)
+        for i, batch in enumerate(iter_batches(projects, self.batch_size)):
+            encoded = encode(batch)
+            upsert_records(
+                self.sink, encoded, i, self.compactor, partial(self._upserted, encoded)
+            )
+        self.missing = set()
+
+    def _upserted(self, encoded: List[Dict[str, Any]]) -> None:
+        self.id_tracker.mark_batch_processed(
+            [r["id"] for r in encoded],
+            {
+                r["id"]: (r["vector_digest"], payload_digest(r["payload"]))
+                for r in encoded
+            },
+        )
+        self.repaired["upserted"] += len(encoded)
+
+    def flush(self) -> None:
+        """Send all queued operations."""
+        self._flush_payloads()
+        self._flush_orphans()
+        self._flush_missing()
+        if self.untracked:
+            self.id_tracker.unmark_batch(self.untracked)
+            self.repaired["untracked"] += len(self.untracked)
+            self.untracked = []
+
+
+def audit_collection(
+    source: ProjectSource,
+    sink: CollectionSink,
+    id_tracker: IDTracker,
+    report: AuditReport,
+    repair: Optional[AuditRepair] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    sort_chunk_size: int = DEFAULT_AUDIT_SORT_CHUNK_SIZE,
+) -> None:
+    """Diff a source against a collection and the tracking file, optionally repairing.
+
+    Args:
+        source: Source of the projects.
+        sink: The sink of the collection.
+        id_tracker: Tracker of the processed project ids.
+        report: Report the differences are recorded in.
+        repair: If given, the differences are repaired.
+        batch_size: Number of points fetched per scroll request.
+        sort_chunk_size: Number of rows sorted in memory at a time for unordered sources.
+
+    Raises:
+        ValueError: If the sink has no collection to scroll.
+    """
+    if not isinstance(sink, CollectionSink):
+        raise ValueError(f"{type(sink).__name__} has no collection to audit.")
+    tracked = ((point_id, True) for point_id in sorted(id_tracker.processed_ids))
+    joined = merge_join(
+        iter_source_entries(source, sort_chunk_size),
+        iter_collection_entries(sink, batch_size),
+        tracked,
+    )
+    for point_id, (expected, digest, is_tracked) in tqdm(joined, unit="id"):
+        report.checked += 1
+        if digest is None and is_tracked:
+            report.add("never_landed", point_id)
+            if repair and expected is None:
+                repair.untrack(point_id)
+        if expected is not None and digest is None:
+            report.add("missing", point_id)
+            if repair:
+                repair.upsert(point_id)
+        elif expected is None and digest is not None:
+            report.add("orphaned", point_id)
+            if repair:
+                repair.delete(point_id)
+                if is_tracked:
+                    # once deleted, its id would be reported as never landed
+                    repair.untrack(point_id)
+        elif expected is not None and expected[0] != digest[0]:
+            report.add("stale", point_id)
+            if repair and expected[1] != digest[1]:
+                # the vectors were encoded from the old name or description
+                repair.upsert(point_id)
+            elif repair:
+                repair.overwrite_payload(point_id, expected[2], expected[0])
+    if repair:
+        repair.flush()
+
+
+def pepembed_audit(
+    collection_name: str = QDRANT_DEFAULT_COLLECTION,
+    sink_type: str = DEFAULT_SINK,
+    sink_path: Optional[str] = None,
+    tracking_file: Optional[str] = None,
+    source_type: str = DEFAULT_SOURCE,
+    source_path: Optional[str] = None,
+    repair: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    output: Optional[str] = None,
+    hf_model_dense: str = DENSE_ENCODER_MODEL,
+    hf_model_sparse: str = SPARSE_ENCODER_MODEL,
+    extra_dense_models: Optional[List[str]] = None,
+    chunk_mode: str = DEFAULT_CHUNK_MODE,
+    chunk_max_tokens: int = DEFAULT_CHUNK_MAX_TOKENS,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    sparse_top_k: Optional[int] = None,
+    sparse_threshold: Optional[float] = None,
+    sparse_float16: bool = False,
+    topology: Optional[Topology] = None,
+) -> Dict[str, Any]:
+    """Check that a collection matches its project source, optionally repairing it.
+
+    The encoding options are only used to upsert missing projects on repair, and
+    should match the ones the collection was built with.
+
+    Args:
+        collection_name: The name of the Qdrant collection.
+        sink_type: "qdrant" (remote server) or "local" (Qdrant on-disk mode).
+        sink_path: Storage path for the "local" sink.
+        tracking_file: File recording the processed projects. Defaults to the file
+            of the audited collection, so ids indexed into other collections are
+            neither reported nor untracked.
+        source_type: Where projects come from: "postgres", "directory", "jsonl" or "parquet".
+        source_path: Location of the projects for the file based sources.
+        repair: Fix the differences instead of only reporting them.
+        batch_size: Number of points per scroll request and per repair request.
+        output: Optional JSON lines file listing every difference.
+        hf_model_dense: The HuggingFace model to use for dense embeddings.
+        hf_model_sparse: The HuggingFace model to use for sparse embeddings.
+        extra_dense_models: Additional dense models, each stored as its own named vector.
+        chunk_mode: "none", "pool" or "multivector".
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+        sparse_top_k: Keep only the strongest terms of each uploaded sparse vector.
+        sparse_threshold: Drop uploaded sparse weights not above this value.
+        sparse_float16: Upload sparse weights at float16 precision.
+        topology: Execution topology used to encode missing projects.
+
+    Returns:
+        Summary of the audit.
+    """
+    if sink_type not in ("qdrant", "local"):
+        raise ValueError(f"Sink type '{sink_type}' cannot be audited.")
+
+    load_dotenv()
+
+    _check_env(_source_env_vars(source_type) + _sink_env_vars(sink_type))
+
+    source = get_source(source_type, source_path)
+    sink = get_sink(
+        sink_type=sink_type,
+        collection_name=collection_name,
+        recreate_collection=False,
+        path=sink_path,
+    )
+    id_tracker = get_id_tracker(
+        sink, sink_type, collection_name, sink_path, tracking_file
+    )
+
+    topology = topology or DEFAULT_TOPOLOGY
+
+    def load_encoder() -> Callable[[List[Any]], List[Dict[str, Any]]]:
+        apply_topology(topology)
+        dense_encoders, embedding_dimensions = load_dense_encoders(
+            hf_model_dense, extra_dense_models, topology
+        )
+        sparse_encoder = get_sparse_model(hf_model_sparse)
+        chunker = get_chunker(
+            chunk_mode, hf_model_dense, chunk_max_tokens, chunk_overlap
+        )
+        _, multivectors = chunk_vectors(embedding_dimensions, chunk_mode)
+        return lambda projects: encode_records(
+            mine_projects(projects),
+            dense_encoders,
+            sparse_encoder,
+            chunker,
+            bool(multivectors),
+            topology,
+        )
+
+    report = AuditReport(output)
+    repairer = (
+        AuditRepair(
+            sink,
+            id_tracker,
+            source,
+            load_encoder,
+            batch_size=batch_size,
+            compactor=get_compactor(sparse_top_k, sparse_threshold, sparse_float16),
+        )
+        if repair
+        else None
+    )
+    try:
+        audit_collection(source, sink, id_tracker, report, repairer, batch_size)
+    finally:
+        report.close()
+        sink.close()
+    id_tracker.compact()
+
+    summary = report.summary()
+    _LOGGER.info(
+        f"Audited {summary['checked']} ids: "
+        + ", ".join(f"{status}={summary[status]}" for status in AUDIT_STATUSES)
+    )
+    for status, point_ids in summary["samples"].items():
+        if point_ids:
+            _LOGGER.info(f"Sample {status} ids: {point_ids}")
+    if repairer:
+        summary["repaired"] = repairer.repaired
+        _LOGGER.info(f"Repaired: {repairer.repaired}")
+    return summary
@@ -0,0 +1,239 @@
+"""Adaptive batch sizing driven by a token and memory budget.
+
+A fixed row count is a poor batch size: a batch of huge GEO configs can blow
+up the encoder activations, while a batch of tiny rows leaves the encoders
+idle. The batcher closes a batch at whichever comes first, the row limit or
+the estimated token limit, and scales both limits after every batch based on
+the observed RSS of the process and its workers and the batch latency.
+"""
+
+import os
+import resource
+import sys
+from logging import getLogger
+from typing import Any, Dict, Generator, Iterable, List, Optional
+
+from .const import (
+    CHARS_PER_TOKEN,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MIN_BATCH_SIZE,
+    PKG_NAME,
+)
+
+_LOGGER = getLogger(PKG_NAME)
+
+# limits shrink multiplicatively under pressure and grow slowly when there is headroom
+SHRINK_FACTOR = 0.5
+GROW_FACTOR = 1.25
+MEMORY_HEADROOM = 0.8
+
+
+def _statm_rss_mb(pid: str) -> float:
+    with open(f"/proc/{pid}/statm", "r") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def _descendant_pids(pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat", "r") as f:
+                # the command name in parentheses may itself contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+    descendants, queue = [], [pid]
+    while queue:
+        for child in children.get(queue.pop(), []):
+            descendants.append(child)
+            queue.append(child)
+    return descendants
+
+
+def current_rss_mb() -> float:
+    """Resident set size of the current process and its child processes, in MB.
+
+    Children are counted because the encoder workers of a topology, e.g. the
+    sparse encoder processes, hold the activations of the batches they encode.
+    Pages shared with a child are counted twice, so the figure errs high.
+    Falls back to the peak RSS of the current process where /proc is not available.
+
+    Returns:
+        The RSS in MB.
+    """
+    try:
+        rss_mb = _statm_rss_mb("self")
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+    for pid in _descendant_pids(os.getpid()):
+        try:
+            rss_mb += _statm_rss_mb(str(pid))
+        except (OSError, ValueError, IndexError):
+            # the child exited in the meantime
+            continue
+    return rss_mb
+
+
+def estimate_tokens(record: Dict[str, Any]) -> int:
+    """Estimate the number of tokens the encoders will see for a mined record.
+
+    Args:
+        record: Mined record with dense_text and sparse_text.
+
+    Returns:
+        Estimated token count.
+    """
+    chars = len(record.get("dense_text") or "") + len(record.get("sparse_text") or "")
+    return chars // CHARS_PER_TOKEN + 1
+
+
+class AdaptiveBatcher:
+    """Groups mined records into batches sized by a token and memory budget."""
+
+    def __init__(
+        self,
+        max_rows: int = DEFAULT_BATCH_SIZE,
+        token_budget: Optional[int] = None,
+        memory_budget_mb: Optional[float] = None,
+        target_latency_s: Optional[float] = None,
+        min_rows: int = DEFAULT_MIN_BATCH_SIZE,
+    ):
+        """
+        Initialize the adaptive batcher.
+
+        Args:
+            max_rows: Maximum number of records per batch
+            token_budget: Maximum estimated number of tokens per batch
+            memory_budget_mb: RSS the process and its children should stay under; limits
+                shrink when exceeded
+            target_latency_s: Desired processing time per batch; limits adapt towards it
+            min_rows: Batches are never limited below this many records
+        """
+        self.max_rows = max_rows
+        self.token_budget = token_budget
+        self.memory_budget_mb = memory_budget_mb
+        self.target_latency_s = target_latency_s
+        self.min_rows = min(min_rows, max_rows)
+        self.scale = 1.0
+        self.history: List[Dict[str, float]] = []
+
+    @property
+    def adaptive(self) -> bool:
+        """Whether batch limits react to observations at all."""
+        return bool(self.memory_budget_mb or self.target_latency_s)
+
+    @property
+    def row_limit(self) -> int:
+        """Current maximum number of records per batch."""
+        return max(self.min_rows, int(self.max_rows * self.scale))
+
+    @property
+    def token_limit(self) -> Optional[int]:
+        """Current maximum estimated number of tokens per batch."""
+        if self.token_budget is None:
+            return None
+        return max(1, int(self.token_budget * self.scale))
+
+    def batches(
+        self, records: Iterable[Dict[str, Any]]
+    ) -> Generator[List[Dict[str, Any]], None, None]:
+        """
+        Group a stream of mined records into batches under the current limits.
+
+        Args:
+            records: Stream of mined records
+
+        Yields:
+            Batches of records. A single record over the token limit forms its own batch
+        """
+        batch, tokens = [], 0
+        for record in records:
+            record_tokens = estimate_tokens(record)
+            token_limit = self.token_limit
+            if (
+                batch
+                and token_limit is not None
+                and tokens + record_tokens > token_limit
+            ):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(record)
+            tokens += record_tokens
+            if len(batch) >= self.row_limit:
+                yield batch
+                batch, tokens = [], 0
+        if batch:
+            yield batch
+
+    def observe(self, batch: List[Dict[str, Any]], latency_s: float) -> None:
+        """
+        Record how a batch went and adjust the limits for the next ones.
+
+        Args:
+            batch: The batch that was processed
+            latency_s: Time spent processing the batch, in seconds
+        """
+        rss_mb = current_rss_mb()
+        tokens = sum(estimate_tokens(r) for r in batch)
+        self.history.append(
+            {
+                "rows": len(batch),
+                "tokens": tokens,
+                "seconds": latency_s,
+                "rss_mb": rss_mb,
+            }
+        )
+
+        if self.adaptive:
+            over_memory = bool(self.memory_budget_mb) and rss_mb > self.memory_budget_mb
+            over_latency = (
+                bool(self.target_latency_s) and latency_s > 1.5 * self.target_latency_s
+            )
+            memory_headroom = (
+                not self.memory_budget_mb
+                or rss_mb < MEMORY_HEADROOM * self.memory_budget_mb
+            )
+            latency_headroom = (
+                not self.target_latency_s or latency_s < 0.5 * self.target_latency_s
+            )
+            if over_memory:
+                self.scale *= SHRINK_FACTOR
+            elif over_latency:
+                self.scale *= max(SHRINK_FACTOR, self.target_latency_s / latency_s)
+            elif memory_headroom and latency_headroom:
+                self.scale = min(1.0, self.scale * GROW_FACTOR)
+            self.scale = max(self.scale, self.min_rows / self.max_rows)
+
+        _LOGGER.info(
+            f"Batch {len(self.history) - 1}: {len(batch)} rows, ~{tokens} tokens,"
+            f" {latency_s:.2f}s, RSS {rss_mb:.0f} MB."
+            f" Next batch limit: {self.row_limit} rows, {self.token_limit or '-'} tokens."
+        )
+
+    def report(self) -> Dict[str, float]:
+        """
+        Summarize the chosen batch sizes.
+
+        Returns:
+            Dictionary with statistics
+        """
+        if not self.history:
+            return {"batches": 0}
+        rows = [h["rows"] for h in self.history]
+        tokens = [h["tokens"] for h in self.history]
+        return {
+            "batches": len(self.history),
+            "rows_min": min(rows),
+            "rows_mean": sum(rows) / len(rows),
+            "rows_max": max(rows),
+            "tokens_mean": sum(tokens) / len(tokens),
+            "tokens_max": max(tokens),
+            "seconds_mean": sum(h["seconds"] for h in self.history) / len(rows),
+            "rss_mb_peak": max(h["rss_mb"] for h in self.history),
+        }
@@ -0,0 +1,391 @@
+"""Offline retrieval-quality and latency benchmarks.
+
+Dense models are compared on a sample of a mined dataset, and sparse pruning
+settings on a sample of an encoded dataset. Each query has a set of
+relevant project ids; documents are the mined dense texts, exactly as they are
+indexed. Without a queries file, dense models are compared on known-item
+queries built from the project descriptions: the query is the description and
+the only relevant document is the project it came from. As the dense texts
+contain the descriptions verbatim, the documents are then reduced to their
+config metadata. Sparse vectors are encoded from the name and description
+alone, so the sparse benchmark needs a queries file.
+"""
+
+import json
+import time
+from logging import getLogger
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .connections import get_dense_model, get_sparse_model
+from .const import (
+    DEFAULT_BENCHMARK_SAMPLE_SIZE,
+    DEFAULT_BENCHMARK_TOP_K,
+    MIN_DESCRIPTION_LENGTH,
+    PKG_NAME,
+)
+from .datasets import read_dataset, read_ids
+from .sparse import SparseCompactor, sparse_tensor_to_lists
+
+_LOGGER = getLogger(PKG_NAME)
+
+# number of queries encoded one at a time to measure single query latency
+LATENCY_QUERIES = 100
+
+
+def load_sample(
+    path: str, sample_size: int, relevant_ids: Optional[Iterable[int]] = None
+) -> List[Dict[str, Any]]:
+    """Read the relevant records of a dataset, filled up with its first other records.
+
+    Judged queries can only be answered if their relevant documents are in the
+    sample, which the first rows of a large dataset rarely hold.
+
+    Args:
+        path: Directory with the mined or encoded Parquet dataset.
+        sample_size: Number of records to read, unless there are more relevant ones.
+        relevant_ids: Ids of records that are always read.
+
+    Returns:
+        List of records, the relevant ones first.
+    """
+    relevant_ids = set(relevant_ids or [])
+    sample = read_ids(path, relevant_ids) if relevant_ids else []
+    not_found = relevant_ids - {r["id"] for r in sample}
+    if not_found:
+        _LOGGER.warning(
+            f"{len(not_found)} relevant ids are not in the dataset,"
+            f" e.g. {sorted(not_found)[:5]}."
+        )
+    if len(sample) >= sample_size:
+        return sample
+    for batch in read_dataset(path, batch_size=min(sample_size, 10_000)):
+        distractors = [r for r in batch if r["id"] not in relevant_ids]
+        sample.extend(distractors[: sample_size - len(sample)])
+        if len(sample) >= sample_size:
+            break
+    return sample
+
+
+def _description(record: Dict[str, Any]) -> str:
+    # the sparse text is "<name>. <description>"
+    prefix = f"{record['payload']['name']}. "
+    sparse_text = record["sparse_text"]
+    return sparse_text[len(prefix) :] if sparse_text.startswith(prefix) else ""
+
+
+def metadata_text(record: Dict[str, Any]) -> str:
+    """The config metadata part of the dense text of a mined record.
+
+    Args:
+        record: Mined record.
+
+    Returns:
+        The dense text without the project name and description.
+    """
+    prefix = (
+        f"Name: {record['payload']['name']}."
+        f" Description: {_description(record)}. Metadata: "
+    )
+    dense_text = record["dense_text"]
+    # texts of projects without a description are the metadata alone
+    return dense_text[len(prefix) :] if dense_text.startswith(prefix) else dense_text
+
+
+def known_item_queries(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build known-item queries from the project descriptions.
+
+    Only projects with config metadata get a query, as their documents are
+    reduced to it, see `known_item_documents`.
+
+    Args:
+        records: Mined records.
+
+    Returns:
+        Queries with the query text and the list of relevant ids.
+    """
+    queries = []
+    for r in records:
+        description = _description(r).strip()
+        if len(description.split()) >= MIN_DESCRIPTION_LENGTH and metadata_text(r):
+            queries.append({"query": description, "relevant": [r["id"]]})
+    return queries
+
+
+def known_item_documents(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reduce the dense texts of mined records to their config metadata.
+
+    The dense texts contain the descriptions verbatim, which would make every
+    known-item query a substring of its document.
+
+    Args:
+        records: Mined records.
+
+    Returns:
+        Copies of the records with metadata-only dense texts.
+    """
+    return [{**r, "dense_text": metadata_text(r)} for r in records]
+
+
+def read_queries(path: str) -> List[Dict[str, Any]]:
+    """Read judged queries from a JSON lines file.
+
+    Args:
+        path: File with one {"query": str, "relevant": [id, ...]} object per line.
+
+    Returns:
+        List of queries. Queries without relevant ids are left out, as their
+        recall is undefined.
+    """
+    with open(path, "r") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    judged = [q for q in queries if q.get("relevant")]
+    if len(judged) < len(queries):
+        _LOGGER.warning(
+            f"Skipping {len(queries) - len(judged)} queries without relevant ids."
+        )
+    return judged
+
+
+def relevant_ids(queries: List[Dict[str, Any]]) -> List[int]:
+    """Ids of the documents relevant to any of the queries.
+
+    Args:
+        queries: Queries with the list of relevant ids.
+
+    Returns:
+        The ids, sorted.
+    """
+    return sorted({pid for q in queries for pid in q["relevant"]})
+
+
+def _embed(encoder, texts: List[str]) -> np.ndarray:
+    vectors = np.array(list(encoder.embed(texts)), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def rank_metrics(
+    scores: np.ndarray,
+    ids: np.ndarray,
+    queries: List[Dict[str, Any]],
+    top_k: int = DEFAULT_BENCHMARK_TOP_K,
+) -> Dict[str, float]:
+    """Compute retrieval quality from a query by document score matrix.
+
+    Args:
+        scores: Scores of shape (n_queries, n_documents).
+        ids: Document ids.
+        queries: Queries with the list of relevant ids.
+        top_k: Cutoff for recall.
+
+    Returns:
+        Metrics: recall@1, recall@k and mean reciprocal rank.
+    """
+    ranking = ids[np.argsort(-scores, axis=1)]
+
+    recall_1, recall_k, reciprocal_ranks = [], [], []
+    for q, ranked_ids in zip(queries, ranking):
+        relevant = set(q["relevant"])
+        hits = np.flatnonzero(np.isin(ranked_ids, list(relevant)))
+        recall_1.append(len(relevant & set(ranked_ids[:1].tolist())) / len(relevant))
+        recall_k.append(
+            len(relevant & set(ranked_ids[:top_k].tolist())) / len(relevant)
+        )
+        reciprocal_ranks.append(1.0 / (hits[0] + 1) if len(hits) else 0.0)
+
+    return {
+        "recall@1": float(np.mean(recall_1)),
+        f"recall@{top_k}": float(np.mean(recall_k)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+    }
+
+
+def evaluate_dense_model(
+    encoder,
+    records: List[Dict[str, Any]],
+    queries: List[Dict[str, Any]],
+    top_k: int = DEFAULT_BENCHMARK_TOP_K,
+) -> Dict[str, float]:
+    """Measure retrieval quality and latency of one dense model.
+
+    Args:
+        encoder: Dense text embedding model.
+        records: Mined records used as the document collection.
+        queries: Queries with the list of relevant ids.
+        top_k: Cutoff for recall.
+
+    Returns:
+        Metrics: document throughput, median single query latency, recall@1,
+        recall@k and mean reciprocal rank.
+    """
+    ids = np.array([r["id"] for r in records])
+
+    start = time.perf_counter()
+    documents = _embed(encoder, [r["dense_text"] for r in records])
+    encode_seconds = time.perf_counter() - start
+
+    latencies = []
+    for q in queries[:LATENCY_QUERIES]:
+        start = time.perf_counter()
+        query_vector = _embed(encoder, [q["query"]])
+        np.argsort(-(documents @ query_vector[0]))[:top_k]
+        latencies.append(time.perf_counter() - start)
+
+    query_vectors = _embed(encoder, [q["query"] for q in queries])
+    scores = query_vectors @ documents.T
+
+    return {
+        "documents_per_second": len(records) / encode_seconds,
+        "query_latency_ms": float(np.median(latencies) * 1000) if latencies else 0.0,
+        **rank_metrics(scores, ids, queries, top_k=top_k),
+    }
+
+
+def benchmark_models(
+    input_path: str,
+    model_names: List[str],
+    sample_size: int = DEFAULT_BENCHMARK_SAMPLE_SIZE,
+    queries_path: Optional[str] = None,
+    top_k: int = DEFAULT_BENCHMARK_TOP_K,
+    output: Optional[str] = None,
+) -> Dict[str, Dict[str, float]]:
+    """Compare dense models side by side on a mined dataset.
+
+    Args:
+        input_path: Directory with the mined Parquet dataset.
+        model_names: HuggingFace dense models to compare.
+        sample_size: Number of records used as the document collection. The
+            records relevant to judged queries are always included.
+        queries_path: Optional JSON lines file with judged queries. Defaults to
+            known-item queries against the config metadata of the records.
+        top_k: Cutoff for recall.
+        output: Optional path to write the results to as JSON.
+
+    Returns:
+        Metrics keyed by model name.
+    """
+    if queries_path:
+        queries = read_queries(queries_path)
+        records = load_sample(input_path, sample_size, relevant_ids(queries))
+    else:
+        records = load_sample(input_path, sample_size)
+        queries = known_item_queries(records)
+        records = known_item_documents(records)
+    _LOGGER.info(
+        f"Benchmarking on {len(records)} documents and {len(queries)} queries."
+    )
+    if not records or not queries:
+        _LOGGER.error("Nothing to benchmark.")
+        return {}
+
+    results = {}
+    for model_name in model_names:
+        metrics = evaluate_dense_model(
+            get_dense_model(model_name), records, queries, top_k=top_k
+        )
+        results[model_name] = metrics
+        _LOGGER.info(
+            f"{model_name}: "
+            + ", ".join(f"{metric}={value:.4f}" for metric, value in metrics.items())
+        )
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        _LOGGER.info(f"Benchmark results written to {output}.")
+    return results
+
+
+def _sparse_matrix(vectors: List[Any], vocab_size: int) -> csr_matrix:
+    indptr, indices, values = [0], [], []
+    for vector_indices, vector_values in vectors:
+        indices.extend(vector_indices)
+        values.extend(vector_values)
+        indptr.append(len(indices))
+    return csr_matrix(
+        (np.array(values, dtype=np.float32), np.array(indices), np.array(indptr)),
+        shape=(len(vectors), vocab_size),
+    )
+
+
+def benchmark_sparse_pruning(
+    input_path: str,
+    sparse_model_name: str,
+    configs: List[Dict[str, Any]],
+    queries_path: str,
+    sample_size: int = DEFAULT_BENCHMARK_SAMPLE_SIZE,
+    top_k: int = DEFAULT_BENCHMARK_TOP_K,
+    output: Optional[str] = None,
+) -> Dict[str, Dict[str, float]]:
+    """Compare sparse pruning settings on an encoded dataset.
+
+    Documents are pruned from the stored vectors, so only the queries are encoded.
+    The sparse vectors are encoded from the project name and description alone,
+    so known-item queries built from the descriptions would match their documents
+    verbatim; judged queries are required.
+
+    Args:
+        input_path: Directory with the encoded Parquet dataset.
+        sparse_model_name: HuggingFace sparse model the dataset was encoded with.
+        configs: Pruning settings, each with optional top_k, threshold and float16 keys.
+            The unpruned vectors are always evaluated as the baseline.
+        queries_path: JSON lines file with judged queries.
+        sample_size: Number of records used as the document collection. The
+            records relevant to the queries are always included.
+        top_k: Cutoff for recall.
+        output: Optional path to write the results to as JSON.
+
+    Returns:
+        Size and quality metrics keyed by pruning setting.
+    """
+    queries = read_queries(queries_path)
+    records = load_sample(input_path, sample_size, relevant_ids(queries))
+    _LOGGER.info(
+        f"Benchmarking on {len(records)} documents and {len(queries)} queries."
+    )
+    if not records or not queries:
+        _LOGGER.error("Nothing to benchmark.")
+        return {}
+
+    sparse_encoder = get_sparse_model(sparse_model_name)
+    query_vectors = [
+        sparse_tensor_to_lists(tensor)
+        for tensor in sparse_encoder.encode(
+            [q["query"] for q in queries], convert_to_tensor=False
+        )
+    ]
+    vocab_size = 1 + max(
+        max(indices, default=0)
+        for indices, _ in query_vectors + [(r["sparse_indices"], None) for r in records]
+    )
+    query_matrix = _sparse_matrix(query_vectors, vocab_size)
+    ids = np.array([r["id"] for r in records])
+
+    results = {}
+    for config in [{}] + configs:
+        name = ", ".join(f"{k}={v}" for k, v in config.items()) or "baseline"
+        compactor = SparseCompactor(**config)
+        documents = compactor.compact_records(records)
+        document_matrix = _sparse_matrix(
+            [(r["sparse_indices"], r["sparse_values"]) for r in documents], vocab_size
+        )
+        scores = (query_matrix @ document_matrix.T).toarray()
+        results[name] = {
+            **compactor.report(),
+            **rank_metrics(scores, ids, queries, top_k=top_k),
+        }
+        _LOGGER.info(
+            f"{name}: "
+            + ", ".join(
+                f"{metric}={value:.4f}" for metric, value in results[name].items()
+            )
+        )
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        _LOGGER.info(f"Benchmark results written to {output}.")
+    return results
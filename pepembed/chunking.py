@@ -0,0 +1,105 @@
+"""Token-bounded chunking of long mined texts.
+
+Dense models silently truncate their input (256 tokens for all-MiniLM-L6-v2),
+so most of the metadata mined from large projects never reaches the embedding.
+The chunker tokenizes the long texts of a batch in one call and cuts each into
+overlapping windows that fit the model, so every window is embedded in full.
+
+The windows are passed to the dense model as text, which tokenizes them again:
+fastembed only accepts strings, and feeding it the chunker's token ids would
+need its private ONNX internals. A long text is therefore tokenized about twice
+when chunking is on. Texts with no more characters than the window size cannot
+exceed it in tokens, so they skip the chunker's pass.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+from .const import DEFAULT_CHUNK_MAX_TOKENS, DEFAULT_CHUNK_OVERLAP
+
+
+class TextChunker:
+    """Splits texts into windows of at most `max_tokens` tokens."""
+
+    def __init__(
+        self,
+        tokenizer,
+        max_tokens: int = DEFAULT_CHUNK_MAX_TOKENS,
+        overlap: int = DEFAULT_CHUNK_OVERLAP,
+    ):
+        """
+        Initialize the text chunker.
+
+        Args:
+            tokenizer: Fast HuggingFace tokenizer of the dense model
+            max_tokens: Maximum number of tokens per window, excluding special tokens
+            overlap: Number of tokens shared by consecutive windows
+        """
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("Chunk overlap must be smaller than the chunk size.")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    def chunk_batch(self, texts: List[str]) -> List[List[str]]:
+        """
+        Split a batch of texts into token-bounded windows.
+
+        Args:
+            texts: Texts to split
+
+        Returns:
+            One list of windows per text. Short texts are kept as a single window
+        """
+        chunks = [[text] for text in texts]
+        # every token spans at least one character, so only longer texts can overflow
+        long = [i for i, text in enumerate(texts) if len(text) > self.max_tokens]
+        if not long:
+            return chunks
+        encodings = self.tokenizer(
+            [texts[i] for i in long],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+        )
+        step = self.max_tokens - self.overlap
+        for i, offsets in zip(long, encodings["offset_mapping"]):
+            if len(offsets) <= self.max_tokens:
+                continue
+            windows = []
+            for start in range(0, len(offsets) - self.overlap, step):
+                end = min(start + self.max_tokens, len(offsets))
+                windows.append(texts[i][offsets[start][0] : offsets[end - 1][1]])
+            chunks[i] = windows
+        return chunks
+
+
+def flatten_chunks(chunks: List[List[str]]) -> Tuple[List[str], List[int]]:
+    """Flatten per-text windows so they can be encoded in one call.
+
+    Args:
+        chunks: One list of windows per text.
+
+    Returns:
+        The flat list of windows and the offset of each text's first window.
+    """
+    flat, offsets = [], []
+    for windows in chunks:
+        offsets.append(len(flat))
+        flat.extend(windows)
+    offsets.append(len(flat))
+    return flat, offsets
+
+
+def mean_pool(vectors: np.ndarray) -> np.ndarray:
+    """Average chunk embeddings into one unit length vector.
+
+    Args:
+        vectors: Chunk embeddings of one text, shape (n_chunks, dim).
+
+    Returns:
+        The pooled embedding.
+    """
+    pooled = vectors.mean(axis=0)
+    return pooled / max(float(np.linalg.norm(pooled)), 1e-12)
@@ -1,18 +1,28 @@
 import logging
 import os
-from typing import Union
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from fastembed import TextEmbedding
 from pepdbagent import PEPDatabaseAgent
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
+from qdrant_client.http.models import PointStruct
 from sentence_transformers import SparseEncoder
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
 
 from .const import (
+    DEFAULT_SINK,
+    DENSE_VECTOR_NAME,
     PKG_NAME,
     QDRANT_DEFAULT_COLLECTION,
     QDRANT_DEFAULT_HOST,
     QDRANT_DEFAULT_PORT,
+    SINK_TYPES,
+    SPARSE_VECTOR_NAME,
 )
 
 _LOGGER = logging.getLogger(PKG_NAME)
@@ -22,6 +32,9 @@ def get_qdrant(
     collection_name=QDRANT_DEFAULT_COLLECTION,
     recreate_collection: bool = False,
     embedding_dim: Union[None, int] = None,
+    path: Optional[str] = None,
+    extra_vectors: Optional[Dict[str, models.VectorParams]] = None,
+    sparse_float16: bool = False,
 ) -> QdrantClient:
     """Get a Qdrant client.
 
@@ -29,22 +42,90 @@ def get_qdrant(
         collection_name: Name of the Qdrant collection.
         recreate_collection: Whether to recreate the collection if it does not exist.
         embedding_dim: The embedding dimension to use for recreation of the collection.
+        path: Directory for Qdrant's local on-disk mode. If not set, connects to the
+            remote Qdrant server configured by the QDRANT_* environment variables.
+        extra_vectors: Additional named vectors of the collection, e.g. for other dense models.
+        sparse_float16: Store sparse vector weights as float16 when creating the collection.
 
     Returns:
         The Qdrant client instance.
     """
-    _LOGGER.info("Connecting to Qdrant.")
+    if path:
+        _LOGGER.info(f"Opening local Qdrant storage at {path}.")
+        qdrant = QdrantClient(path=path)
+    else:
+        _LOGGER.info("Connecting to Qdrant.")
 
-    q_host = os.environ.get("QDRANT_HOST", QDRANT_DEFAULT_HOST)
-    q_port = os.environ.get("QDRANT_PORT", QDRANT_DEFAULT_PORT)
-    q_api_key = os.environ.get("QDRANT_API_KEY", None)
+        q_host = os.environ.get("QDRANT_HOST", QDRANT_DEFAULT_HOST)
+        q_port = os.environ.get("QDRANT_PORT", QDRANT_DEFAULT_PORT)
+        q_api_key = os.environ.get("QDRANT_API_KEY", None)
 
-    qdrant = QdrantClient(
-        url=q_host,
-        port=q_port,
-        api_key=q_api_key,
+        qdrant = QdrantClient(
+            url=q_host,
+            port=q_port,
+            api_key=q_api_key,
+        )
+
+    ensure_collection(
+        qdrant,
+        collection_name=collection_name,
+        recreate_collection=recreate_collection,
+        embedding_dim=embedding_dim,
+        extra_vectors=extra_vectors,
+        sparse_float16=sparse_float16,
+    )
+    return qdrant
+
+
+def dense_vector_params(embedding_dim: int) -> models.VectorParams:
+    """Collection parameters of a dense vector.
+
+    Args:
+        embedding_dim: The embedding dimension.
+
+    Returns:
+        The vector parameters.
+    """
+    return models.VectorParams(size=embedding_dim, distance=models.Distance.COSINE)
+
+
+def multivector_params(embedding_dim: int) -> models.VectorParams:
+    """Collection parameters of a dense multivector scored with MaxSim.
+
+    Args:
+        embedding_dim: The embedding dimension of each sub-vector.
+
+    Returns:
+        The vector parameters.
+    """
+    return models.VectorParams(
+        size=embedding_dim,
+        distance=models.Distance.COSINE,
+        multivector_config=models.MultiVectorConfig(
+            comparator=models.MultiVectorComparator.MAX_SIM
+        ),
     )
 
+
+def ensure_collection(
+    qdrant: QdrantClient,
+    collection_name: str = QDRANT_DEFAULT_COLLECTION,
+    recreate_collection: bool = False,
+    embedding_dim: Union[None, int] = None,
+    extra_vectors: Optional[Dict[str, models.VectorParams]] = None,
+    sparse_float16: bool = False,
+) -> None:
+    """Make sure the collection exists, creating it if allowed.
+
+    Args:
+        qdrant: The Qdrant client instance.
+        collection_name: Name of the Qdrant collection.
+        recreate_collection: Whether to recreate the collection if it does not exist.
+        embedding_dim: The embedding dimension to use for recreation of the collection.
+        extra_vectors: Additional named vectors of the collection, e.g. for other dense models.
+        sparse_float16: Store sparse vector weights as float16 when creating the collection.
+    """
+    extra_vectors = extra_vectors or {}
     collection_exist = qdrant.collection_exists(collection_name=collection_name)
 
     if not collection_exist and not recreate_collection:
@@ -61,14 +142,14 @@ def get_qdrant(
         qdrant.create_collection(
             collection_name=collection_name,
             vectors_config={
-                "dense": models.VectorParams(
-                    size=embedding_dim, distance=models.Distance.COSINE
-                ),
+                DENSE_VECTOR_NAME: dense_vector_params(embedding_dim),
+                **extra_vectors,
             },
             sparse_vectors_config={
-                "sparse": models.SparseVectorParams(
+                SPARSE_VECTOR_NAME: models.SparseVectorParams(
                     index=models.SparseIndexParams(
                         on_disk=False,
+                        datatype=models.Datatype.FLOAT16 if sparse_float16 else None,
                     )
                 )
             },
@@ -81,6 +162,18 @@ def get_qdrant(
             ),
             on_disk_payload=True,
         )
+    elif extra_vectors:
+        existing_vectors = qdrant.get_collection(
+            collection_name=collection_name
+        ).config.params.vectors
+        missing_vectors = set(extra_vectors) - set(existing_vectors or {})
+        if missing_vectors:
+            _LOGGER.error(
+                f"Collection {collection_name} has no vectors named {sorted(missing_vectors)}."
+                f" Named vectors cannot be added to an existing collection, use a new"
+                f" collection. Its processed ids are tracked in a file of its own."
+            )
+            exit(1)
     qdrant.create_payload_index(
         collection_name=collection_name,
         field_name="name",
@@ -90,7 +183,324 @@ def get_qdrant(
     collection_info = qdrant.get_collection(collection_name=collection_name)
 
     _LOGGER.info(f"Collection status: {collection_info.status}")
-    return qdrant
+
+
+class VectorSink(ABC):
+    """Destination for encoded points.
+
+    Attributes:
+        tracks_ids: Whether the points written here are recorded in the tracking
+            file. Sinks that do not index into a collection leave it untouched, so
+            they do not hide projects from later runs against a real collection.
+    """
+
+    tracks_ids = False
+
+    @abstractmethod
+    def upsert(
+        self,
+        points: List[PointStruct],
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Write a batch of points.
+
+        Args:
+            points: The points to write
+            on_written: Called once the points are written, e.g. to record their ids.
+                Not called if writing them fails
+        """
+
+    @abstractmethod
+    def close(self) -> None:
+        """Flush and release any resources held by the sink."""
+
+
+class CollectionSink(VectorSink):
+    """Sink backed by a collection, whose points can be read and changed once written.
+
+    Payload overwrites, deletes, lookups and scrolls are only available on these
+    sinks, callers check for this class before using them.
+    """
+
+    tracks_ids = True
+
+    @abstractmethod
+    def overwrite_payloads(self, payloads: Dict[int, Dict[str, Any]]) -> None:
+        """
+        Replace the payloads of existing points, leaving their vectors untouched.
+
+        Args:
+            payloads: New payloads keyed by point id
+        """
+
+    @abstractmethod
+    def delete(self, point_ids: List[int]) -> None:
+        """
+        Delete points.
+
+        Args:
+            point_ids: Ids of the points to delete
+        """
+
+    @abstractmethod
+    def get_payloads(
+        self, point_ids: List[int], fields: Optional[List[str]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Look up the payloads of points.
+
+        Args:
+            point_ids: Ids of the points to look up
+            fields: Payload fields to fetch, all if not set
+
+        Returns:
+            The payloads of the points that exist, keyed by point id
+        """
+
+    @abstractmethod
+    def iter_payloads(
+        self, batch_size: int = 1000
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Stream the ids and payloads of all points, in ascending id order.
+
+        Args:
+            batch_size: Number of points fetched per scroll request
+
+        Yields:
+            Tuples of point id and payload
+        """
+
+
+class QdrantSink(CollectionSink):
+    """Upserts points into a Qdrant collection, remote or local."""
+
+    def __init__(
+        self, client: QdrantClient, collection_name: str, upload_workers: int = 1
+    ):
+        """
+        Initialize the Qdrant sink.
+
+        Args:
+            client: The Qdrant client instance
+            collection_name: Name of the Qdrant collection
+            upload_workers: Number of upserts in flight at once. With more than one,
+                `upsert` returns before the request is sent, errors surface on a
+                later call, and `on_written` callbacks run in order once their
+                request succeeded
+        """
+        self.client = client
+        self.collection_name = collection_name
+        self.upload_workers = upload_workers
+        self._executor = (
+            ThreadPoolExecutor(upload_workers, thread_name_prefix="qdrant-upload")
+            if upload_workers > 1
+            else None
+        )
+        self._in_flight = deque()
+
+    def _upsert(self, points: List[PointStruct]) -> None:
+        operation_info = self.client.upsert(
+            collection_name=self.collection_name,
+            points=points,
+            wait=False,
+        )
+        _LOGGER.info(f"Qdrant operation: {operation_info}")
+
+    def upsert(
+        self,
+        points: List[PointStruct],
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        if self._executor is None:
+            self._upsert(points)
+            if on_written:
+                on_written()
+            return
+        # bound the requests in flight, and with them the points held in memory
+        while len(self._in_flight) >= self.upload_workers:
+            self._complete_oldest()
+        self._in_flight.append(
+            (self._executor.submit(self._upsert, points), on_written)
+        )
+
+    def _complete_oldest(self) -> None:
+        future, on_written = self._in_flight.popleft()
+        # raises the error of a failed request, its callback is dropped
+        future.result()
+        # callbacks run in the calling thread, in the order of the upserts
+        if on_written:
+            on_written()
+
+    def _drain(self) -> None:
+        while self._in_flight:
+            self._complete_oldest()
+
+    def overwrite_payloads(self, payloads: Dict[int, Dict[str, Any]]) -> None:
+        # keep the order of operations on a point: its upsert lands before its payload update
+        self._drain()
+        # one request for the whole batch instead of a set_payload call per point
+        operation_info = self.client.batch_update_points(
+            collection_name=self.collection_name,
+            update_operations=[
+                models.OverwritePayloadOperation(
+                    overwrite_payload=models.SetPayload(
+                        payload=payload, points=[point_id]
+                    )
+                )
+                for point_id, payload in payloads.items()
+            ],
+            wait=False,
+        )
+        _LOGGER.info(f"Qdrant operation: {operation_info}")
+
+    def delete(self, point_ids: List[int]) -> None:
+        self._drain()
+        operation_info = self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=point_ids),
+            wait=False,
+        )
+        _LOGGER.info(f"Qdrant operation: {operation_info}")
+
+    def get_payloads(
+        self, point_ids: List[int], fields: Optional[List[str]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        self._drain()
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=point_ids,
+            with_payload=fields or True,
+            with_vectors=False,
+        )
+        return {point.id: point.payload or {} for point in points}
+
+    def iter_payloads(
+        self, batch_size: int = 1000
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for point in points:
+                yield point.id, point.payload or {}
+            if offset is None:
+                return
+
+    def close(self) -> None:
+        try:
+            self._drain()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self.client.close()
+
+
+class FileSink(VectorSink):
+    """Appends points to a JSON lines file."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the file sink.
+
+        Args:
+            path: Path to the JSON lines file to append to
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a")
+
+    def upsert(
+        self,
+        points: List[PointStruct],
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        for point in points:
+            self._file.write(point.model_dump_json() + "\n")
+        if on_written:
+            on_written()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class NullSink(VectorSink):
+    """Discards points, only counting them. Useful for measuring throughput."""
+
+    def __init__(self):
+        self.points_received = 0
+
+    def upsert(
+        self,
+        points: List[PointStruct],
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.points_received += len(points)
+        if on_written:
+            on_written()
+
+    def close(self) -> None:
+        _LOGGER.info(f"Null sink discarded {self.points_received} points.")
+
+
+def get_sink(
+    sink_type: str = DEFAULT_SINK,
+    collection_name: str = QDRANT_DEFAULT_COLLECTION,
+    recreate_collection: bool = False,
+    embedding_dim: Union[None, int] = None,
+    path: Optional[str] = None,
+    extra_vectors: Optional[Dict[str, models.VectorParams]] = None,
+    sparse_float16: bool = False,
+    upload_workers: int = 1,
+) -> VectorSink:
+    """Get the destination for encoded points.
+
+    Args:
+        sink_type: One of "qdrant" (remote server), "local" (Qdrant on-disk mode),
+            "file" (JSON lines) or "null" (discard).
+        collection_name: Name of the Qdrant collection.
+        recreate_collection: Whether to recreate the collection if it does not exist.
+        embedding_dim: The embedding dimension to use for recreation of the collection.
+        path: Storage directory for the "local" sink, or output file for the "file" sink.
+        extra_vectors: Additional named vectors of the collection, e.g. for other dense models.
+        sparse_float16: Store sparse vector weights as float16 when creating the collection.
+        upload_workers: Number of upserts in flight at once against a remote Qdrant.
+            The local on-disk mode always upserts one batch at a time.
+
+    Returns:
+        The vector sink instance.
+    """
+    if sink_type not in SINK_TYPES:
+        raise ValueError(
+            f"Unknown sink type '{sink_type}', expected one of: {', '.join(SINK_TYPES)}"
+        )
+    if sink_type in ("local", "file") and not path:
+        raise ValueError(f"Sink type '{sink_type}' requires a path.")
+
+    if sink_type == "null":
+        return NullSink()
+    if sink_type == "file":
+        return FileSink(path)
+
+    client = get_qdrant(
+        collection_name=collection_name,
+        recreate_collection=recreate_collection,
+        embedding_dim=embedding_dim,
+        path=path if sink_type == "local" else None,
+        extra_vectors=extra_vectors,
+        sparse_float16=sparse_float16,
+    )
+    return QdrantSink(
+        client,
+        collection_name,
+        upload_workers=upload_workers if sink_type == "qdrant" else 1,
+    )
 
 
 def get_db_agent() -> PEPDatabaseAgent:
@@ -128,14 +538,31 @@ def get_sparse_model(sparse_model: str) -> Union[None, SparseEncoder]:
     return sparse_model
 
 
-def get_dense_model(dense_model: str) -> Union[None, TextEmbedding]:
+def get_dense_model(
+    dense_model: str, threads: Optional[int] = None
+) -> Union[None, TextEmbedding]:
     """Get a dense encoder model.
 
     Args:
         dense_model: Name of the dense encoder model.
+        threads: ONNX Runtime threads of in-process encoding, None lets ONNX Runtime
+            decide.
 
     Returns:
         Text embedding instance.
     """
     _LOGGER.info(f"Initializing dense model: {dense_model}")
-    return TextEmbedding(dense_model)
+    return TextEmbedding(dense_model, threads=threads)
+
+
+def get_tokenizer(model_name: str) -> PreTrainedTokenizerFast:
+    """Get the tokenizer of a dense encoder model.
+
+    Args:
+        model_name: Name of the dense encoder model.
+
+    Returns:
+        Fast tokenizer instance.
+    """
+    _LOGGER.info(f"Initializing tokenizer: {model_name}")
+    return AutoTokenizer.from_pretrained(model_name, use_fast=True)
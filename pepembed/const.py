@@ -10,6 +10,18 @@ QDRANT_DEFAULT_HOST = "localhost"
 QDRANT_DEFAULT_PORT = 6333
 QDRANT_DEFAULT_COLLECTION = "pephub"
 
+SOURCE_TYPES = ["postgres", "directory", "jsonl", "parquet"]
+DEFAULT_SOURCE = "postgres"
+DEFAULT_SOURCE_CHUNK_SIZE = 1000
+DEFAULT_TAG = "default"
+
+SINK_TYPES = ["qdrant", "local", "file", "null"]
+DEFAULT_SINK = "qdrant"
+# processed ids of the default remote collection, other collections get their own file
+DEFAULT_TRACKING_FILE = "processed.txt"
+# superseded lines of a tracking file, relative to its ids, that trigger a rewrite
+TRACKING_COMPACT_RATIO = 0.25
+
 VERSIONS = {
     "python_version": python_version(),
 }
@@ -27,17 +39,62 @@ DEFAULT_KEYWORDS = [
 
 DENSE_ENCODER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 SPARSE_ENCODER_MODEL = "prithivida/Splade_PP_en_v2"
+DENSE_VECTOR_NAME = "dense"
+# payload fields the dense and sparse texts are built from, changing them needs re-encoding
+TEXT_PAYLOAD_FIELDS = ["name", "description"]
+SPARSE_VECTOR_NAME = "sparse"
+CHUNK_VECTOR_SUFFIX = "_chunks"
+
+CHUNK_MODES = ["none", "pool", "multivector"]
+DEFAULT_CHUNK_MODE = "none"
+# all-MiniLM-L6-v2 truncates at 256 tokens, including [CLS] and [SEP]
+DEFAULT_CHUNK_MAX_TOKENS = 254
+DEFAULT_CHUNK_OVERLAP = 32
 MIN_DESCRIPTION_LENGTH = 5
 
 DEFAULT_BATCH_SIZE = 800
+# payload-only updates are sent at least this often, so e.g. privacy flips land quickly
+PAYLOAD_FLUSH_SECONDS = 5.0
+DEFAULT_MIN_BATCH_SIZE = 8
+# rough characters per token, used to estimate batch sizes before tokenizing
+CHARS_PER_TOKEN = 4
+
+DEFAULT_BENCHMARK_SAMPLE_SIZE = 2000
+DEFAULT_BENCHMARK_TOP_K = 10
+
+# execution topology, see topology.py
+DEFAULT_DENSE_WORKERS = 4
+DEFAULT_DENSE_BATCH_SIZE = 256
+DEFAULT_SPARSE_WORKERS = 1
+DEFAULT_SPARSE_BATCH_SIZE = 64
+DEFAULT_UPLOAD_WORKERS = 1
+DEFAULT_AUTOTUNE_SAMPLE_SIZE = 512
+# every sparse worker loads its own copy of the model, so autotune tries a few at most
+MAX_AUTOTUNE_SPARSE_WORKERS = 8
+# share of the available memory autotune lets the sparse model copies take
+AUTOTUNE_MEMORY_FRACTION = 0.5
 
-REQUIRED_ENV_VARS = [
+DEFAULT_PROFILE_DIR = "pepembed-profile"
+# 100 Hz keeps the sampling overhead around a percent
+DEFAULT_PROFILE_INTERVAL_S = 0.01
+
+AUDIT_STATUSES = ["missing", "orphaned", "stale", "never_landed"]
+# rows sorted in memory at a time when a source is not ordered by id
+DEFAULT_AUDIT_SORT_CHUNK_SIZE = 50000
+DEFAULT_AUDIT_SAMPLE_SIZE = 20
+
+POSTGRES_ENV_VARS = [
     "POSTGRES_HOST",
     "POSTGRES_DB",
     "POSTGRES_USER",
     "POSTGRES_PASSWORD",
     # "POSTGRES_PORT",
+]
+
+QDRANT_ENV_VARS = [
     "QDRANT_HOST",
     "QDRANT_API_KEY",
     # "HF_TOKEN",
 ]
+
+REQUIRED_ENV_VARS = POSTGRES_ENV_VARS + QDRANT_ENV_VARS
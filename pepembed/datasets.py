@@ -0,0 +1,173 @@
+"""Columnar intermediate datasets for the embedding pipeline.
+
+Stage outputs are written as directories of Parquet files, one file per batch,
+so each stage can be replayed from the output of the previous one:
+
+* mined dataset: ``id``, ``dense_text``, ``sparse_text``, ``payload``
+* encoded dataset: ``id``, ``dense``, ``sparse_indices``, ``sparse_values``, ``payload``,
+  ``vector_digest``
+
+``dense`` is a struct with one field per named dense vector of the collection;
+chunk multivectors are stored as lists of vectors.
+Sparse vectors are stored as two list columns, which Arrow keeps as a shared
+offsets buffer plus flat index/value buffers, i.e. a CSR matrix.
+"""
+
+import os
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, List, Optional, Union
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .const import DEFAULT_BATCH_SIZE, DENSE_VECTOR_NAME, PKG_NAME
+
+_LOGGER = getLogger(PKG_NAME)
+
+PAYLOAD_TYPE = pa.struct(
+    [
+        ("description", pa.string()),
+        ("registry", pa.string()),
+        ("private", pa.bool_()),
+        ("name", pa.string()),
+    ]
+)
+
+MINED_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("dense_text", pa.string()),
+        ("sparse_text", pa.string()),
+        ("payload", PAYLOAD_TYPE),
+    ]
+)
+
+
+def encoded_schema(
+    dense_vectors: Optional[List[str]] = None, multivectors: Optional[List[str]] = None
+) -> pa.Schema:
+    """Build the schema of an encoded dataset.
+
+    Args:
+        dense_vectors: Names of the dense vectors. Defaults to the single "dense" vector.
+        multivectors: Names of the dense multivectors, e.g. "dense_chunks".
+
+    Returns:
+        The Arrow schema.
+    """
+    dense_vectors = dense_vectors or [DENSE_VECTOR_NAME]
+    dense_fields = [(name, pa.list_(pa.float32())) for name in dense_vectors] + [
+        (name, pa.list_(pa.list_(pa.float32()))) for name in multivectors or []
+    ]
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            (
+                "dense",
+                pa.struct(dense_fields),
+            ),
+            ("sparse_indices", pa.list_(pa.int32())),
+            ("sparse_values", pa.list_(pa.float32())),
+            ("payload", PAYLOAD_TYPE),
+            # digest of the mined texts, so uploads can record it in the tracking file
+            ("vector_digest", pa.string()),
+        ]
+    )
+
+
+class DatasetWriter:
+    """Writes batches of records into a directory of Parquet files."""
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        schema: pa.Schema,
+        overwrite: bool = False,
+    ):
+        """
+        Initialize the dataset writer.
+
+        Args:
+            path: Directory to write the dataset into. Created if missing.
+            schema: Arrow schema of the records.
+            overwrite: Replace the dataset already written into the directory.
+                Without it, a non-empty directory is refused, as readers of the
+                directory would see the old and the new records.
+
+        Raises:
+            FileExistsError: If the directory is not empty and overwrite is False.
+        """
+        self.path = Path(path)
+        self.schema = schema
+        if self.path.is_dir() and any(self.path.iterdir()):
+            if not overwrite:
+                raise FileExistsError(
+                    f"Dataset directory {self.path} is not empty."
+                    f" Use a new directory, or overwrite the dataset in it."
+                )
+            _LOGGER.info(f"Overwriting the dataset in {self.path}.")
+            for part in self.path.glob("part-*.parquet"):
+                part.unlink()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._part = 0
+        self.rows_written = 0
+
+    def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Write one batch of records as a new Parquet file.
+
+        Args:
+            records: List of records matching the writer schema
+        """
+        if not records:
+            return
+        table = pa.Table.from_pylist(records, schema=self.schema)
+        pq.write_table(table, self.path / f"part-{self._part:05d}.parquet")
+        self._part += 1
+        self.rows_written += len(records)
+
+
+def read_dataset(
+    path: Union[str, os.PathLike], batch_size: int = DEFAULT_BATCH_SIZE
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """Stream records from a Parquet dataset in batches.
+
+    Args:
+        path: Directory (or single file) holding the dataset.
+        batch_size: Maximum number of records per yielded batch.
+
+    Yields:
+        Lists of records as dictionaries.
+    """
+    dataset = ds.dataset(str(path), format="parquet")
+    for record_batch in dataset.to_batches(batch_size=batch_size):
+        if record_batch.num_rows:
+            yield record_batch.to_pylist()
+
+
+def read_ids(path: Union[str, os.PathLike], ids: Iterable[int]) -> List[Dict[str, Any]]:
+    """Read the records with the given ids from a Parquet dataset.
+
+    Args:
+        path: Directory (or single file) holding the dataset.
+        ids: Ids of the records to read.
+
+    Returns:
+        The records found, as dictionaries.
+    """
+    dataset = ds.dataset(str(path), format="parquet")
+    return dataset.to_table(filter=ds.field("id").isin(list(ids))).to_pylist()
+
+
+def count_rows(path: Union[str, os.PathLike]) -> int:
+    """Count the records in a Parquet dataset without loading it.
+
+    Args:
+        path: Directory (or single file) holding the dataset.
+
+    Returns:
+        Number of records in the dataset.
+    """
+    return ds.dataset(str(path), format="parquet").count_rows()
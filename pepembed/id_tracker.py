@@ -4,21 +4,33 @@ This module was generated by AI, and provides functionality to track which proje
 
 import os
 from pathlib import Path
-from typing import Any, List, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .const import TRACKING_COMPACT_RATIO
 
 
 class IDTracker:
-    """Tracks which project IDs have been processed."""
+    """Tracks which project IDs have been processed.
+
+    Each line of the tracking file is either a bare ID, or an ID with the
+    digests of the texts its vectors were encoded from and of its payload,
+    separated by tabs. Later lines override earlier ones, until `compact`
+    rewrites the file without them.
+    """
 
-    def __init__(self, tracking_file: str = "processed.txt"):
+    def __init__(self, tracking_file: str = "processed.txt", read_only: bool = False):
         """
         Initialize the ID tracker.
 
         Args:
             tracking_file: Path to the file where processed IDs are stored
+            read_only: Keep newly processed IDs in memory only, leaving the file as is
         """
         self.tracking_file = Path(tracking_file)
+        self.read_only = read_only
         self.processed_ids: Set[int] = set()
+        self.digests: Dict[int, Tuple[str, str]] = {}
+        self._lines = 0
         self._load_processed_ids()
 
     def _load_processed_ids(self) -> None:
@@ -28,11 +40,16 @@ class IDTracker:
                 for line in f:
                     line = line.strip()
                     if line:
+                        parts = line.split("\t")
                         try:
-                            self.processed_ids.add(int(line))
+                            project_id = int(parts[0])
                         except ValueError:
                             # Skip invalid lines
                             continue
+                        self.processed_ids.add(project_id)
+                        self._lines += 1
+                        if len(parts) == 3:
+                            self.digests[project_id] = (parts[1], parts[2])
 
     def is_processed(self, project_id: int) -> bool:
         """
@@ -46,6 +63,18 @@ class IDTracker:
         """
         return project_id in self.processed_ids
 
+    def get_digests(self, project_id: int) -> Optional[Tuple[str, str]]:
+        """
+        Get the digests a project was last processed with.
+
+        Args:
+            project_id: The project ID to look up
+
+        Returns:
+            The vector and payload digests, or None if unknown
+        """
+        return self.digests.get(project_id)
+
     def filter_unprocessed(self, projects: List[Any]) -> List[Any]:
         """
         Filter out already processed projects.
@@ -70,19 +99,94 @@ class IDTracker:
             self.processed_ids.add(project_id)
             self._append_to_file(project_id)
 
-    def mark_batch_processed(self, project_ids: List[int]) -> None:
+    def mark_batch_processed(
+        self,
+        project_ids: List[int],
+        digests: Optional[Dict[int, Tuple[str, str]]] = None,
+    ) -> None:
         """
         Mark multiple project IDs as processed and save to file.
 
         Args:
             project_ids: List of project IDs to mark as processed
+            digests: Optional vector and payload digests keyed by project ID
         """
-        new_ids = [pid for pid in project_ids if pid not in self.processed_ids]
+        digests = digests or {}
+        new_ids = [
+            pid
+            for pid in project_ids
+            if pid not in self.processed_ids
+            or (pid in digests and digests[pid] != self.digests.get(pid))
+        ]
         if new_ids:
             self.processed_ids.update(new_ids)
-            with open(self.tracking_file, "a") as f:
-                for pid in new_ids:
-                    f.write(f"{pid}\n")
+            for pid in new_ids:
+                if pid in digests:
+                    self.digests[pid] = digests[pid]
+            if not self.read_only:
+                with open(self.tracking_file, "a") as f:
+                    for pid in new_ids:
+                        f.write(self._line(pid))
+                self._lines += len(new_ids)
+
+    def unmark_batch(self, project_ids: List[int]) -> None:
+        """
+        Forget multiple processed project IDs, so they are processed again.
+
+        Args:
+            project_ids: List of project IDs to forget
+        """
+        removed = self.processed_ids.intersection(project_ids)
+        if removed:
+            self.processed_ids.difference_update(removed)
+            for pid in removed:
+                self.digests.pop(pid, None)
+            self._rewrite_file()
+
+    def _line(self, project_id: int) -> str:
+        """
+        Format the tracking file line of a project ID.
+
+        Args:
+            project_id: The project ID
+
+        Returns:
+            The line, with the digests if known
+        """
+        if project_id in self.digests:
+            vector_digest, payload_digest = self.digests[project_id]
+            return f"{project_id}\t{vector_digest}\t{payload_digest}\n"
+        return f"{project_id}\n"
+
+    def _rewrite_file(self) -> None:
+        """Rewrite the tracking file from the processed IDs in memory."""
+        if self.read_only:
+            return
+        tmp_file = self.tracking_file.with_name(self.tracking_file.name + ".tmp")
+        with open(tmp_file, "w") as f:
+            for pid in sorted(self.processed_ids):
+                f.write(self._line(pid))
+        os.replace(tmp_file, self.tracking_file)
+        self._lines = len(self.processed_ids)
+
+    def compact(self, max_superseded: float = TRACKING_COMPACT_RATIO) -> bool:
+        """
+        Rewrite the tracking file without superseded lines, if there are many.
+
+        Every changed project appends a line, so without compaction the file
+        grows with every run.
+
+        Args:
+            max_superseded: Superseded lines tolerated, relative to the number of IDs
+
+        Returns:
+            True if the file was rewritten, False otherwise
+        """
+        superseded = self._lines - len(self.processed_ids)
+        if self.read_only or superseded <= max_superseded * len(self.processed_ids):
+            return False
+        self._rewrite_file()
+        return True
 
     def _append_to_file(self, project_id: int) -> None:
         """
@@ -91,8 +195,11 @@ class IDTracker:
         Args:
             project_id: The project ID to append
         """
+        if self.read_only:
+            return
         with open(self.tracking_file, "a") as f:
             f.write(f"{project_id}\n")
+        self._lines += 1
 
     def get_stats(self) -> dict:
         """
@@ -103,6 +210,8 @@ class IDTracker:
         """
         return {
             "total_processed": len(self.processed_ids),
+            "with_digests": len(self.digests),
             "tracking_file": str(self.tracking_file),
+            "read_only": self.read_only,
             "file_exists": self.tracking_file.exists(),
         }
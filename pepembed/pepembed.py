@@ -1,36 +1,739 @@
 # %%
 import sys
+import time
+from functools import partial
+from itertools import count
 from logging import getLogger
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 from dotenv import load_dotenv
-from pepdbagent.db_utils import Projects
 from qdrant_client.http import models
 from qdrant_client.http.models import PointStruct
-from sqlalchemy import and_, select
-from sqlalchemy.orm import Session
 from tqdm import tqdm
 
-from .connections import get_db_agent, get_dense_model, get_qdrant, get_sparse_model
+from .batching import AdaptiveBatcher
+from .chunking import TextChunker, flatten_chunks, mean_pool
+from .connections import (
+    CollectionSink,
+    VectorSink,
+    dense_vector_params,
+    get_dense_model,
+    get_sink,
+    get_sparse_model,
+    get_tokenizer,
+    multivector_params,
+)
 from .const import (
+    CHUNK_MODES,
     DEFAULT_BATCH_SIZE,
+    DEFAULT_CHUNK_MAX_TOKENS,
+    DEFAULT_CHUNK_MODE,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_SINK,
+    DEFAULT_SOURCE,
+    DEFAULT_TRACKING_FILE,
     DENSE_ENCODER_MODEL,
+    DENSE_VECTOR_NAME,
+    PAYLOAD_FLUSH_SECONDS,
     PKG_NAME,
+    POSTGRES_ENV_VARS,
     QDRANT_DEFAULT_COLLECTION,
-    REQUIRED_ENV_VARS,
+    QDRANT_ENV_VARS,
     SPARSE_ENCODER_MODEL,
+    SPARSE_VECTOR_NAME,
+    TEXT_PAYLOAD_FIELDS,
+)
+from .datasets import (
+    MINED_SCHEMA,
+    DatasetWriter,
+    count_rows,
+    encoded_schema,
+    read_dataset,
 )
 from .id_tracker import IDTracker
+from .profiling import get_profiler, span
+from .sources import ProjectSource, get_source
+from .sparse import SparseCompactor, sparse_tensor_to_lists
+from .topology import (
+    DEFAULT_TOPOLOGY,
+    Topology,
+    apply_topology,
+    dense_parallel,
+    dense_threads,
+    start_sparse_pool,
+    stop_sparse_pool,
+)
 from .utils import (
-    batch_generator,
     check_env_variable,
+    chunk_vector_name,
+    dense_vector_name,
+    iter_batches,
     markdown_to_text,
     mine_metadata_from_dict,
+    payload_digest,
+    payload_text_digest,
+    vector_digest,
 )
 
 _LOGGER = getLogger(name=PKG_NAME)
 _LOGGER.setLevel("INFO")
 
 
+def _check_env(required_vars: List[str]) -> None:
+    """Exit if any of the required environment variables is missing.
+
+    Args:
+        required_vars: Names of the environment variables to check.
+    """
+    if not all([check_env_variable(var) for var in required_vars]):
+        _LOGGER.error("Some of required environment variables are not set. Exiting...")
+        sys.exit(1)
+
+
+def _source_env_vars(source_type: str) -> List[str]:
+    """Environment variables needed by the given source type."""
+    return POSTGRES_ENV_VARS if source_type == "postgres" else []
+
+
+def iter_unprocessed(
+    source: ProjectSource,
+    id_tracker: Optional[IDTracker],
+    skip_processed: bool = True,
+) -> Iterator[Any]:
+    """Stream the not yet processed projects from a source.
+
+    Args:
+        source: Source of the projects.
+        id_tracker: Tracker used to filter out already processed projects. Only
+            needed if skip_processed is True.
+        skip_processed: Filter out processed projects. If False, all projects are
+            yielded, e.g. to look for changes.
+
+    Yields:
+        Project rows.
+    """
+    _LOGGER.info("Fetching PEPs from source.")
+    total = source.count()
+    if total is not None:
+        _LOGGER.info(f"Found {total} PEPs in source.")
+
+    skipped = 0
+    for p in tqdm(source, total=total, unit="PEP"):
+        if skip_processed and id_tracker.is_processed(p.id):
+            skipped += 1
+            continue
+        yield p
+    if skip_processed:
+        _LOGGER.info(f"Skipped {skipped} already processed PEPs.")
+
+
+def build_payload(project: Any, description: Optional[str] = None) -> Dict[str, Any]:
+    """Build the point payload of a project.
+
+    Args:
+        project: Project row with namespace, name, tag, description and private.
+        description: The description already converted to plain text, if available.
+
+    Returns:
+        The payload. Its description is also the text of the sparse vector.
+    """
+    if description is None:
+        description = markdown_to_text(project.description)
+    return {
+        "description": f"{project.name}. {description}",
+        "registry": f"{project.namespace}/{project.name}:{project.tag}",
+        "private": project.private,
+        "name": project.name,
+    }
+
+
+def mine_projects(projects: List[Any]) -> List[Dict[str, Any]]:
+    """Mine the texts to embed and the payload from a batch of projects.
+
+    Args:
+        projects: Project rows with namespace, name, tag, config, id, description and private.
+
+    Returns:
+        Mined records with id, dense_text, sparse_text and payload.
+    """
+    records = []
+    for p in projects:
+        try:
+            description = markdown_to_text(p.description)
+            dense_text = mine_metadata_from_dict(
+                p.config, name=p.name, description=description
+            )
+            payload = build_payload(p, description)
+            records.append(
+                {
+                    "id": p.id,
+                    "dense_text": dense_text,
+                    "sparse_text": payload["description"],
+                    "payload": payload,
+                }
+            )
+        except Exception as e:
+            _LOGGER.error(f"Error processing PEP {p.namespace}/{p.name}:{p.tag}: {e}")
+            continue
+    return records
+
+
+def iter_mined(projects: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    """Mine a stream of projects one at a time.
+
+    Args:
+        projects: Project rows.
+
+    Yields:
+        Mined records.
+    """
+    for p in projects:
+        yield from mine_projects([p])
+
+
+def record_digests(record: Dict[str, Any]) -> Tuple[str, str]:
+    """Digests of what the vectors and the payload of a mined record are built from.
+
+    Args:
+        record: Mined record.
+
+    Returns:
+        The vector digest and the payload digest.
+    """
+    return (
+        vector_digest(record["dense_text"], record["sparse_text"]),
+        payload_digest(record["payload"]),
+    )
+
+
+class PayloadUpdater:
+    """Batches payload-only updates of points that are already indexed.
+
+    Before a batch is sent, the points are looked up in the sink. Records whose
+    point is missing, e.g. tracked ids that never landed, are handed back to be
+    encoded instead, as a payload cannot be set on a point that does not exist.
+    So are records whose point holds another name or description, e.g. ones
+    processed before digests were tracked and re-worded since, as their vectors
+    are encoded from both.
+    """
+
+    def __init__(
+        self,
+        sink: CollectionSink,
+        id_tracker: IDTracker,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_delay_s: float = PAYLOAD_FLUSH_SECONDS,
+    ):
+        """
+        Initialize the payload updater.
+
+        Args:
+            sink: Destination of the points
+            id_tracker: Tracker updated with the new digests once a batch is sent
+            batch_size: Maximum number of payloads per request
+            max_delay_s: Maximum time a queued payload waits before it is sent
+        """
+        self.sink = sink
+        self.id_tracker = id_tracker
+        self.batch_size = batch_size
+        self.max_delay_s = max_delay_s
+        self.records: Dict[int, Dict[str, Any]] = {}
+        self.digests: Dict[int, Tuple[str, str]] = {}
+        self.first_queued = 0.0
+        self.updated = 0
+        self.not_found = 0
+        self.reworded = 0
+
+    def add(
+        self, record: Dict[str, Any], digests: Tuple[str, str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Queue the payload of a mined record.
+
+        Args:
+            record: Mined record whose payload changed
+            digests: Vector and payload digests of the record
+
+        Returns:
+            Records to encode because their point is missing, if a batch was sent
+        """
+        if not self.records:
+            self.first_queued = time.monotonic()
+        self.records[record["id"]] = record
+        self.digests[record["id"]] = digests
+        return self.flush_due()
+
+    def flush_due(self) -> List[Dict[str, Any]]:
+        """
+        Send the queued payloads if the batch is full or has waited too long.
+
+        Returns:
+            Records to encode because their point is missing, if a batch was sent
+        """
+        if len(self.records) >= self.batch_size or (
+            self.records and time.monotonic() - self.first_queued >= self.max_delay_s
+        ):
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        Send all queued payloads.
+
+        Returns:
+            Records to encode because their point is missing or re-worded
+        """
+        if not self.records:
+            return []
+        with span("get_payloads", points=len(self.records)):
+            stored = self.sink.get_payloads(list(self.records), TEXT_PAYLOAD_FIELDS)
+        payloads, to_encode = {}, []
+        for pid, record in self.records.items():
+            if pid not in stored:
+                self.not_found += 1
+                to_encode.append(record)
+            elif payload_text_digest(stored[pid]) != payload_text_digest(
+                record["payload"]
+            ):
+                self.reworded += 1
+                to_encode.append(record)
+            else:
+                payloads[pid] = record["payload"]
+        if payloads:
+            with span("overwrite_payloads", points=len(payloads)):
+                self.sink.overwrite_payloads(payloads)
+            self.id_tracker.mark_batch_processed(
+                list(payloads), {pid: self.digests[pid] for pid in payloads}
+            )
+        self.updated += len(payloads)
+        self.records, self.digests = {}, {}
+        return to_encode
+
+
+def iter_changed(
+    records: Iterable[Dict[str, Any]],
+    id_tracker: IDTracker,
+    payload_updater: PayloadUpdater,
+    stats: Dict[str, int],
+) -> Iterator[Dict[str, Any]]:
+    """Route mined records by what changed since they were last processed.
+
+    New records and records whose texts changed are yielded to be encoded.
+    Records whose payload alone changed are sent to the payload updater.
+    Records processed before digests were tracked are sent there as well, and
+    get their payload refreshed once if their point still holds the same name
+    and description. Records the payload updater finds no point for, or a
+    re-worded one, are yielded to be encoded as well.
+
+    Args:
+        records: Stream of mined records.
+        id_tracker: Tracker of the processed projects and their digests.
+        payload_updater: Receives the payload-only changes.
+        stats: Counts of new, changed, payload-only and unchanged records, updated in place.
+
+    Yields:
+        Mined records to encode.
+    """
+    for record in records:
+        digests = record_digests(record)
+        known = id_tracker.get_digests(record["id"])
+        if not id_tracker.is_processed(record["id"]):
+            stats["new"] += 1
+            yield record
+        elif known is not None and known[0] != digests[0]:
+            stats["changed"] += 1
+            yield record
+        elif known is None or known[1] != digests[1]:
+            stats["payload_only"] += 1
+            yield from payload_updater.add(record, digests)
+        else:
+            stats["unchanged"] += 1
+            yield from payload_updater.flush_due()
+    yield from payload_updater.flush()
+
+
+def dense_model_names(
+    hf_model_dense: str, extra_dense_models: Optional[List[str]] = None
+) -> Dict[str, str]:
+    """Name the vectors of the primary and any additional dense models.
+
+    Args:
+        hf_model_dense: The HuggingFace model stored in the "dense" vector.
+        extra_dense_models: Additional HuggingFace models, each stored in its own named vector.
+
+    Returns:
+        Model names keyed by vector name.
+    """
+    model_names = {DENSE_VECTOR_NAME: hf_model_dense}
+    for model_name in extra_dense_models or []:
+        model_names[dense_vector_name(model_name)] = model_name
+    return model_names
+
+
+def load_dense_encoders(
+    hf_model_dense: str,
+    extra_dense_models: Optional[List[str]] = None,
+    topology: Topology = DEFAULT_TOPOLOGY,
+) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """Load the primary and any additional dense models.
+
+    Args:
+        hf_model_dense: The HuggingFace model stored in the "dense" vector.
+        extra_dense_models: Additional HuggingFace models, each stored in its own named vector.
+        topology: Execution topology, for the ONNX Runtime threads of in-process encoding.
+
+    Returns:
+        Dense encoders and their embedding dimensions, both keyed by vector name.
+    """
+    model_names = dense_model_names(hf_model_dense, extra_dense_models)
+
+    encoders = {
+        name: get_dense_model(model, threads=dense_threads(topology))
+        for name, model in model_names.items()
+    }
+    dimensions = {
+        name: int(encoders[name].get_embedding_size(model))
+        for name, model in model_names.items()
+    }
+    return encoders, dimensions
+
+
+def extra_vectors_config(
+    dimensions: Dict[str, int], multivectors: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Collection config of the dense vectors besides the primary one.
+
+    Args:
+        dimensions: Embedding dimensions keyed by vector name.
+        multivectors: Names of the vectors holding chunk multivectors.
+
+    Returns:
+        Vector parameters keyed by vector name.
+    """
+    multivectors = multivectors or []
+    return {
+        name: (
+            multivector_params(dim)
+            if name in multivectors
+            else dense_vector_params(dim)
+        )
+        for name, dim in dimensions.items()
+        if name != DENSE_VECTOR_NAME
+    }
+
+
+def chunk_vector_names(vector_names: Iterable[str], chunk_mode: str) -> List[str]:
+    """Names of the chunk multivectors of the chunking mode.
+
+    Args:
+        vector_names: Names of the dense vectors.
+        chunk_mode: One of "none", "pool" or "multivector".
+
+    Returns:
+        The names of the multivectors, empty unless chunks are kept.
+    """
+    if chunk_mode != "multivector":
+        return []
+    return [chunk_vector_name(name) for name in vector_names]
+
+
+def chunk_vectors(
+    dimensions: Dict[str, int], chunk_mode: str
+) -> Tuple[Dict[str, int], List[str]]:
+    """Add the chunk multivectors of the chunking mode to the dense vectors.
+
+    Args:
+        dimensions: Embedding dimensions keyed by dense vector name.
+        chunk_mode: One of "none", "pool" or "multivector".
+
+    Returns:
+        Embedding dimensions of all vectors, and the names of the multivectors.
+    """
+    multivectors = dict(
+        zip(chunk_vector_names(dimensions, chunk_mode), dimensions.values())
+    )
+    return {**dimensions, **multivectors}, list(multivectors)
+
+
+def get_chunker(
+    chunk_mode: str,
+    hf_model_dense: str,
+    chunk_max_tokens: int = DEFAULT_CHUNK_MAX_TOKENS,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> Optional[TextChunker]:
+    """Get the chunker for the given chunking mode.
+
+    Args:
+        chunk_mode: One of "none", "pool" or "multivector".
+        hf_model_dense: The dense model whose tokenizer bounds the chunks.
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+
+    Returns:
+        The chunker, or None if chunking is disabled.
+    """
+    if chunk_mode not in CHUNK_MODES:
+        raise ValueError(
+            f"Unknown chunking mode '{chunk_mode}', expected one of: {', '.join(CHUNK_MODES)}"
+        )
+    if chunk_mode == "none":
+        return None
+    return TextChunker(
+        get_tokenizer(hf_model_dense),
+        max_tokens=chunk_max_tokens,
+        overlap=chunk_overlap,
+    )
+
+
+def encode_records(
+    records: List[Dict[str, Any]],
+    dense_encoders: Dict[str, Any],
+    sparse_encoder,
+    chunker: Optional[TextChunker] = None,
+    multivector: bool = False,
+    topology: Topology = DEFAULT_TOPOLOGY,
+    sparse_pool: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Encode a batch of mined records with the dense and sparse models.
+
+    Args:
+        records: Mined records, as returned by `mine_projects`.
+        dense_encoders: Dense text embedding models keyed by vector name.
+        sparse_encoder: Sparse encoder model.
+        chunker: If given, long dense texts are split into chunks whose embeddings
+            are mean pooled into the dense vector.
+        multivector: Also keep the chunk embeddings, as "<vector name>_chunks".
+        topology: Execution topology, for the encoder workers and batch sizes.
+        sparse_pool: Sparse encoder worker processes, see `start_sparse_pool`.
+
+    Returns:
+        Encoded records with id, dense, sparse_indices, sparse_values, payload and
+        the digest of the texts the vectors were encoded from.
+    """
+    if not records:
+        return []
+
+    dense_texts = [r["dense_text"] for r in records]
+    dense = [{} for _ in records]
+    if chunker is None:
+        # Batch encode all dense texts at once, once per model
+        for name, encoder in dense_encoders.items():
+            with span("encode_dense", vector=name, texts=len(dense_texts)):
+                for vectors, embedding in zip(
+                    dense,
+                    encoder.embed(
+                        dense_texts,
+                        batch_size=topology.dense_batch_size,
+                        parallel=dense_parallel(topology),
+                    ),
+                ):
+                    vectors[name] = embedding.tolist()
+    else:
+        # Batch encode the chunks of all texts at once, then regroup them per record
+        with span("chunk", texts=len(dense_texts)):
+            flat_chunks, offsets = flatten_chunks(chunker.chunk_batch(dense_texts))
+        _LOGGER.debug(f"Split {len(records)} texts into {len(flat_chunks)} chunks.")
+        for name, encoder in dense_encoders.items():
+            with span("encode_dense", vector=name, texts=len(flat_chunks)):
+                embeddings = np.array(
+                    list(
+                        encoder.embed(
+                            flat_chunks,
+                            batch_size=topology.dense_batch_size,
+                            parallel=dense_parallel(topology),
+                        )
+                    )
+                )
+            for j, vectors in enumerate(dense):
+                chunk_embeddings = embeddings[offsets[j] : offsets[j + 1]]
+                vectors[name] = mean_pool(chunk_embeddings).tolist()
+                if multivector:
+                    vectors[chunk_vector_name(name)] = chunk_embeddings.tolist()
+
+    # Batch encode all sparse texts at once
+    with span("encode_sparse", texts=len(records)):
+        sparse_results = sparse_encoder.encode(
+            [r["sparse_text"] for r in records],
+            batch_size=topology.sparse_batch_size,
+            convert_to_tensor=False,
+            pool=sparse_pool,
+        )
+
+    encoded = []
+    for record, vectors, sparse in zip(records, dense, sparse_results):
+        sparse_indices, sparse_values = sparse_tensor_to_lists(sparse)
+        encoded.append(
+            {
+                "id": record["id"],
+                "dense": vectors,
+                "sparse_indices": sparse_indices,
+                "sparse_values": sparse_values,
+                "payload": record["payload"],
+                "vector_digest": vector_digest(
+                    record["dense_text"], record["sparse_text"]
+                ),
+            }
+        )
+    return encoded
+
+
+def records_to_points(records: List[Dict[str, Any]]) -> List[PointStruct]:
+    """Convert encoded records into Qdrant points.
+
+    Args:
+        records: Encoded records, as returned by `encode_records`.
+
+    Returns:
+        List of Qdrant points.
+    """
+    return [
+        PointStruct(
+            id=r["id"],
+            vector={
+                **{name: list(vector) for name, vector in r["dense"].items()},
+                SPARSE_VECTOR_NAME: models.SparseVector(
+                    indices=r["sparse_indices"],
+                    values=r["sparse_values"],
+                ),
+            },
+            payload=r["payload"],
+        )
+        for r in records
+    ]
+
+
+def _sink_env_vars(sink_type: str) -> List[str]:
+    """Environment variables needed by the given sink type."""
+    return QDRANT_ENV_VARS if sink_type == "qdrant" else []
+
+
+def get_tracking_file(
+    sink_type: str, collection_name: str, sink_path: Optional[str] = None
+) -> str:
+    """Default tracking file of the processed projects of a collection.
+
+    Every collection is tracked in its own file, so projects indexed into one
+    collection are not skipped when indexing another, e.g. a local test run or
+    a new collection for an A/B comparison. Local collections are tracked in
+    their storage directory. The default remote collection keeps processed.txt.
+    Other remote collections fall back to processed.txt, which tracked every
+    collection before, as long as they have no file of their own.
+
+    Args:
+        sink_type: One of "qdrant", "local", "file" or "null".
+        collection_name: Name of the Qdrant collection.
+        sink_path: Storage directory of the "local" sink.
+
+    Returns:
+        Path of the tracking file.
+    """
+    if sink_type == "local":
+        return str(Path(sink_path) / f"processed-{collection_name}.txt")
+    if sink_type == "qdrant" and collection_name == QDRANT_DEFAULT_COLLECTION:
+        return DEFAULT_TRACKING_FILE
+    if sink_type == "qdrant":
+        tracking_file = f"processed-{collection_name}.txt"
+        if not Path(tracking_file).exists() and Path(DEFAULT_TRACKING_FILE).exists():
+            _LOGGER.warning(
+                f"{tracking_file} does not exist, using {DEFAULT_TRACKING_FILE}."
+                f" Rename it to {tracking_file} if it tracks {collection_name},"
+                f" or pass a tracking file if it tracks another collection."
+            )
+            return DEFAULT_TRACKING_FILE
+        return tracking_file
+    return f"processed-{sink_type}-{collection_name}.txt"
+
+
+def get_id_tracker(
+    sink: VectorSink,
+    sink_type: str,
+    collection_name: str = QDRANT_DEFAULT_COLLECTION,
+    sink_path: Optional[str] = None,
+    tracking_file: Optional[str] = None,
+) -> IDTracker:
+    """Open the tracker of processed projects for a sink.
+
+    Args:
+        sink: Destination of the points.
+        sink_type: Name of the sink type.
+        collection_name: Name of the Qdrant collection.
+        sink_path: Storage path of the "local" and "file" sinks.
+        tracking_file: Tracking file to use instead of the one of the collection,
+            see `get_tracking_file`.
+
+    Returns:
+        The tracker. It is read-only for sinks that do not index into a collection.
+    """
+    tracking_file = tracking_file or get_tracking_file(
+        sink_type, collection_name, sink_path
+    )
+    id_tracker = IDTracker(tracking_file, read_only=not sink.tracks_ids)
+    if id_tracker.read_only:
+        _LOGGER.info(
+            f"The {sink_type} sink does not index into a collection,"
+            f" processed ids are not recorded."
+        )
+    else:
+        _LOGGER.info(f"Tracking processed ids of {collection_name} in {tracking_file}.")
+    return id_tracker
+
+
+def get_compactor(
+    sparse_top_k: Optional[int] = None,
+    sparse_threshold: Optional[float] = None,
+    sparse_float16: bool = False,
+) -> Optional[SparseCompactor]:
+    """Get the sparse vector compactor, if any compaction is requested.
+
+    Args:
+        sparse_top_k: Keep only the strongest terms of each sparse vector.
+        sparse_threshold: Drop sparse weights not above this value.
+        sparse_float16: Round sparse weights to float16 precision.
+
+    Returns:
+        The compactor, or None if sparse vectors are uploaded as encoded.
+    """
+    if sparse_top_k is None and sparse_threshold is None and not sparse_float16:
+        return None
+    return SparseCompactor(
+        top_k=sparse_top_k, threshold=sparse_threshold, float16=sparse_float16
+    )
+
+
+def upsert_records(
+    sink: VectorSink,
+    records: List[Dict[str, Any]],
+    batch_index: int,
+    compactor: Optional[SparseCompactor] = None,
+    on_written: Optional[Callable[[], None]] = None,
+) -> bool:
+    """Upsert a batch of encoded records into the vector sink.
+
+    Args:
+        sink: Destination of the points.
+        records: Encoded records to upsert.
+        batch_index: Index of the batch, used for logging.
+        compactor: Optional compactor applied to the sparse vectors before upload.
+        on_written: Called once the points are written, see `VectorSink.upsert`.
+
+    Returns:
+        True if anything was upserted, False otherwise.
+    """
+    if compactor:
+        with span("compact_sparse"):
+            records = compactor.compact_records(records)
+    with span("to_points"):
+        points = records_to_points(records)
+    if len(points) == 0:
+        _LOGGER.info(f"No valid points to upsert in batch {batch_index}, skipping.")
+        return False
+    with span("sink_upsert", points=len(points)):
+        sink.upsert(points, on_written)
+    return True
+
+
 # %%
 def pepembed(
     batch_size: int = DEFAULT_BATCH_SIZE,
@@ -38,151 +741,417 @@ def pepembed(
     collection_name: str = QDRANT_DEFAULT_COLLECTION,
     hf_model_dense: str = DENSE_ENCODER_MODEL,
     hf_model_sparse: str = SPARSE_ENCODER_MODEL,
+    extra_dense_models: Optional[List[str]] = None,
+    chunk_mode: str = DEFAULT_CHUNK_MODE,
+    chunk_max_tokens: int = DEFAULT_CHUNK_MAX_TOKENS,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    token_budget: Optional[int] = None,
+    memory_budget_mb: Optional[float] = None,
+    target_batch_seconds: Optional[float] = None,
+    sparse_top_k: Optional[int] = None,
+    sparse_threshold: Optional[float] = None,
+    sparse_float16: bool = False,
+    detect_changes: bool = True,
+    mined_output: Optional[str] = None,
+    encoded_output: Optional[str] = None,
+    overwrite: bool = False,
+    sink_type: str = DEFAULT_SINK,
+    sink_path: Optional[str] = None,
+    tracking_file: Optional[str] = None,
+    source_type: str = DEFAULT_SOURCE,
+    source_path: Optional[str] = None,
+    profile_dir: Optional[str] = None,
+    topology: Optional[Topology] = None,
 ) -> None:
     """Main function to embed PEPs and store them in Qdrant.
 
     Args:
-        batch_size: The batch size for embedding.
+        batch_size: The maximum batch size for embedding.
         recreate_collection: Whether to recreate the Qdrant collection.
         collection_name: The name of the Qdrant collection.
         hf_model_dense: The HuggingFace model to use for dense embeddings.
         hf_model_sparse: The HuggingFace model to use for sparse embeddings.
+        extra_dense_models: Additional dense models encoded in the same pass, each
+            stored as its own named vector.
+        chunk_mode: "none", or split long dense texts into token-bounded chunks and
+            store their mean ("pool") or also the chunks themselves ("multivector").
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+        token_budget: Optional maximum estimated number of tokens per batch.
+        memory_budget_mb: Optional RSS budget; batches shrink when it is exceeded.
+        target_batch_seconds: Optional target processing time per batch.
+        sparse_top_k: Keep only the strongest terms of each uploaded sparse vector.
+        sparse_threshold: Drop uploaded sparse weights not above this value.
+        sparse_float16: Upload sparse weights at float16 precision and store them as float16.
+        detect_changes: Re-check processed PEPs: re-encode the ones whose texts changed,
+            and only overwrite the payload of the ones whose payload alone changed.
+        mined_output: Optional directory to persist the mined texts as Parquet.
+        encoded_output: Optional directory to persist the embeddings as Parquet.
+        overwrite: Replace the datasets already in the output directories.
+        sink_type: Destination of the points: "qdrant", "local", "file" or "null".
+        sink_path: Storage path for the "local" and "file" sinks.
+        tracking_file: File recording the processed projects. Defaults to the file
+            of the collection, see `get_tracking_file`.
+        source_type: Where projects come from: "postgres", "directory", "jsonl" or "parquet".
+        source_path: Location of the projects for the file based sources.
+        profile_dir: If set, profile the run and write a Chrome trace of the stages of
+            every batch and a collapsed-stack profile into this directory.
+        topology: Execution topology: encoder workers, threads, batch sizes and upload
+            concurrency. Defaults to `DEFAULT_TOPOLOGY`.
     """
     load_dotenv()
 
-    if not all([check_env_variable(var) for var in REQUIRED_ENV_VARS]):
-        _LOGGER.error("Some of required environment variables are not set. Exiting...")
-        sys.exit(1)
+    _check_env(_source_env_vars(source_type) + _sink_env_vars(sink_type))
 
-    _LOGGER.info("Connecting to database.")
-    agent = get_db_agent()
+    # refuse an existing dataset before loading the models and opening the sink
+    mined_writer = (
+        DatasetWriter(mined_output, MINED_SCHEMA, overwrite) if mined_output else None
+    )
+    vector_names = list(dense_model_names(hf_model_dense, extra_dense_models))
+    encoded_writer = (
+        DatasetWriter(
+            encoded_output,
+            encoded_schema(vector_names, chunk_vector_names(vector_names, chunk_mode)),
+            overwrite,
+        )
+        if encoded_output
+        else None
+    )
 
-    dense_encoder = get_dense_model(hf_model_dense)
-    sparse_encoder = get_sparse_model(hf_model_sparse)
+    topology = topology or DEFAULT_TOPOLOGY
+    apply_topology(topology)
 
-    embedding_dimensions = int(dense_encoder.get_embedding_size(hf_model_dense))
+    profiler = get_profiler(profile_dir)
+    profiler.start()
+    sparse_pool = None
+    sink = None
+    try:
+        dense_encoders, embedding_dimensions = load_dense_encoders(
+            hf_model_dense, extra_dense_models, topology
+        )
+        sparse_encoder = get_sparse_model(hf_model_sparse)
+        sparse_pool = start_sparse_pool(sparse_encoder, topology)
+        chunker = get_chunker(
+            chunk_mode, hf_model_dense, chunk_max_tokens, chunk_overlap
+        )
+        embedding_dimensions, multivectors = chunk_vectors(
+            embedding_dimensions, chunk_mode
+        )
 
-    _LOGGER.info("Connecting to qdrant.")
-    qdrant = get_qdrant(
-        collection_name=collection_name,
-        recreate_collection=recreate_collection,
-        embedding_dim=embedding_dimensions,
-    )
+        _LOGGER.info(f"Opening {sink_type} sink.")
+        sink = get_sink(
+            sink_type=sink_type,
+            collection_name=collection_name,
+            recreate_collection=recreate_collection,
+            embedding_dim=embedding_dimensions[DENSE_VECTOR_NAME],
+            path=sink_path,
+            extra_vectors=extra_vectors_config(embedding_dimensions, multivectors),
+            sparse_float16=sparse_float16,
+            upload_workers=topology.upload_workers,
+        )
+        compactor = get_compactor(sparse_top_k, sparse_threshold, sparse_float16)
+        if detect_changes and not isinstance(sink, CollectionSink):
+            _LOGGER.warning(
+                f"The {sink_type} sink does not index into a collection,"
+                f" not detecting changes."
+            )
+            detect_changes = False
 
-    # Initialize ID tracker
-    id_tracker = IDTracker()
-    tracker_stats = id_tracker.get_stats()
-    _LOGGER.info(
-        f"ID Tracker initialized: {tracker_stats['total_processed']} IDs already processed"
-    )
+        # Initialize ID tracker
+        id_tracker = get_id_tracker(
+            sink, sink_type, collection_name, sink_path, tracking_file
+        )
+        tracker_stats = id_tracker.get_stats()
+        _LOGGER.info(
+            f"ID Tracker initialized: {tracker_stats['total_processed']} IDs already processed"
+        )
+
+        source = get_source(source_type, source_path)
 
-    _LOGGER.info("Fetching PEPs from database.")
-
-    with Session(agent.pep_db_engine.engine) as session:
-        statement = select(
-            Projects.namespace,
-            Projects.name,
-            Projects.tag,
-            Projects.config,
-            Projects.id,
-            Projects.description,
-            Projects.private,
+        batcher = AdaptiveBatcher(
+            max_rows=batch_size,
+            token_budget=token_budget,
+            memory_budget_mb=memory_budget_mb,
+            target_latency_s=target_batch_seconds,
         )
-        # statement = statement.where(Projects.namespace == "geo").limit(10000)
-        projects = session.execute(statement).all()
 
-    _LOGGER.info(f"Found {len(projects)} PEPs from database.")
+        records = iter_mined(
+            iter_unprocessed(source, id_tracker, skip_processed=not detect_changes)
+        )
+        if detect_changes:
+            payload_updater = PayloadUpdater(sink, id_tracker, batch_size=batch_size)
+            change_stats = {"new": 0, "changed": 0, "payload_only": 0, "unchanged": 0}
+            records = iter_changed(records, id_tracker, payload_updater, change_stats)
 
-    # Filter out already processed projects
-    projects = id_tracker.filter_unprocessed(projects)
-    _LOGGER.info(f"After filtering: {len(projects)} PEPs to process.")
+        _LOGGER.info("Starting indexing process....")
+        # we need to work in batches since its much faster
+        batches = iter(batcher.batches(records))
+        for i in count():
+            # the source is read and mined lazily while the batch is filled
+            with span("fetch_and_mine", batch=i):
+                mined = next(batches, None)
+            if mined is None:
+                break
 
-    _LOGGER.info("Starting indexing process....")
-    # we need to work in batches since its much faster
-    for i, batch in enumerate(
-        tqdm(batch_generator(projects, batch_size), total=len(projects) // batch_size)
-    ):
-        # First pass: collect all texts and metadata from batch
-        batch_data = []
-        dense_texts = []
-        sparse_texts = []
-
-        for p in batch:
-            try:
-                description = markdown_to_text(p.description)
-                dense_text = mine_metadata_from_dict(
-                    p.config, name=p.name, description=description
-                )
-                sparse_text = f"{p.name}. {description}"
-                batch_info = {
-                    "id": p.id,
-                    "sparse_text": sparse_text,
-                    "namespace": p.namespace,
-                    "name": p.name,
-                    "tag": p.tag,
-                    "private": p.private,
-                }
+            start = time.perf_counter()
+            with span("batch", batch=i, rows=len(mined)):
+                if mined_writer:
+                    with span("write_mined"):
+                        mined_writer.write_batch(mined)
 
-                dense_texts.append(dense_text)
-                sparse_texts.append(sparse_text)
-                batch_data.append(batch_info)
-            except Exception as e:
-                _LOGGER.error(
-                    f"Error processing PEP {p.namespace}/{p.name}:{p.tag}: {e}"
+                with span("encode"):
+                    encoded = encode_records(
+                        mined,
+                        dense_encoders,
+                        sparse_encoder,
+                        chunker,
+                        bool(multivectors),
+                        topology,
+                        sparse_pool,
+                    )
+                if encoded_writer:
+                    with span("write_encoded"):
+                        encoded_writer.write_batch(encoded)
+
+                # Mark batch as processed after successful upsert
+                mark_processed = partial(
+                    id_tracker.mark_batch_processed,
+                    [r["id"] for r in encoded],
+                    {r["id"]: record_digests(r) for r in mined},
                 )
-                continue
+                with span("upsert"):
+                    upsert_records(sink, encoded, i, compactor, mark_processed)
+                batcher.observe(mined, time.perf_counter() - start)
 
-        # Batch encode all dense texts at once
-        dense_embeddings_list = list(dense_encoder.embed(dense_texts, parallel=4))
+        if detect_changes:
+            _LOGGER.info(
+                f"Changes: {change_stats}, payloads updated: {payload_updater.updated},"
+                f" missing points encoded: {payload_updater.not_found},"
+                f" re-worded points encoded: {payload_updater.reworded}"
+            )
+        _LOGGER.info(f"Batch sizes: {batcher.report()}")
+        if compactor:
+            _LOGGER.info(f"Sparse compaction: {compactor.report()}")
+    finally:
+        try:
+            if sink is not None:
+                # uploads still in flight are recorded, or fail the run
+                sink.close()
+        finally:
+            if sparse_pool is not None:
+                stop_sparse_pool(sparse_encoder, sparse_pool)
+            profiler.stop()
+    # drop the lines superseded by changed projects once the uploads are recorded
+    id_tracker.compact()
+    _LOGGER.info("Indexing process completed.")
 
-        # Batch encode all sparse texts at once
-        sparse_results = sparse_encoder.encode(
-            sparse_texts, batch_size=64, convert_to_tensor=False
-        )
 
-        # Second pass: create points from batch results
-        points = []
-        for data, dense, sparse in zip(
-            batch_data, dense_embeddings_list, sparse_results
-        ):
+def pepembed_mine(
+    output: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    source_type: str = DEFAULT_SOURCE,
+    source_path: Optional[str] = None,
+    skip_processed: bool = False,
+    tracking_file: str = DEFAULT_TRACKING_FILE,
+    overwrite: bool = False,
+) -> None:
+    """Mine texts from a project source and persist them without encoding.
+
+    Args:
+        output: Directory to write the mined Parquet dataset into.
+        batch_size: Number of projects per written file.
+        source_type: Where projects come from: "postgres", "directory", "jsonl" or "parquet".
+        source_path: Location of the projects for the file based sources.
+        skip_processed: Leave out projects already in the tracking file. Off by
+            default, so the dataset can be replayed into any collection.
+        tracking_file: Tracking file of the collection the dataset is mined for.
+        overwrite: Replace the dataset already in the output directory.
+    """
+    load_dotenv()
 
-            sparse_col = sparse.coalesce()
+    _check_env(_source_env_vars(source_type))
 
-            sparse_embeddings = models.SparseVector(
-                indices=sparse_col.indices().tolist()[0],
-                values=sparse_col.values().tolist(),
-            )
+    source = get_source(source_type, source_path)
+    writer = DatasetWriter(output, MINED_SCHEMA, overwrite)
+    projects = iter_unprocessed(
+        source,
+        IDTracker(tracking_file, read_only=True) if skip_processed else None,
+        skip_processed,
+    )
+    for batch in iter_batches(projects, batch_size):
+        writer.write_batch(mine_projects(batch))
+
+    _LOGGER.info(f"Mined {writer.rows_written} PEPs into {output}.")
+
+
+def pepembed_encode(
+    input_path: str,
+    output: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    hf_model_dense: str = DENSE_ENCODER_MODEL,
+    hf_model_sparse: str = SPARSE_ENCODER_MODEL,
+    extra_dense_models: Optional[List[str]] = None,
+    chunk_mode: str = DEFAULT_CHUNK_MODE,
+    chunk_max_tokens: int = DEFAULT_CHUNK_MAX_TOKENS,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    token_budget: Optional[int] = None,
+    memory_budget_mb: Optional[float] = None,
+    target_batch_seconds: Optional[float] = None,
+    topology: Optional[Topology] = None,
+    overwrite: bool = False,
+) -> None:
+    """Encode a mined dataset and persist the embeddings.
+
+    Args:
+        input_path: Directory with the mined Parquet dataset.
+        output: Directory to write the encoded Parquet dataset into.
+        batch_size: The maximum batch size for embedding.
+        hf_model_dense: The HuggingFace model to use for dense embeddings.
+        hf_model_sparse: The HuggingFace model to use for sparse embeddings.
+        extra_dense_models: Additional dense models encoded in the same pass.
+        chunk_mode: "none", or split long dense texts into token-bounded chunks and
+            store their mean ("pool") or also the chunks themselves ("multivector").
+        chunk_max_tokens: Maximum number of tokens per chunk.
+        chunk_overlap: Number of tokens shared by consecutive chunks.
+        token_budget: Optional maximum estimated number of tokens per batch.
+        memory_budget_mb: Optional RSS budget; batches shrink when it is exceeded.
+        target_batch_seconds: Optional target processing time per batch.
+        topology: Execution topology: encoder workers, threads and batch sizes.
+        overwrite: Replace the dataset already in the output directory.
+    """
+    # refuse an existing dataset before loading the models
+    vector_names = list(dense_model_names(hf_model_dense, extra_dense_models))
+    multivectors = chunk_vector_names(vector_names, chunk_mode)
+    writer = DatasetWriter(
+        output, encoded_schema(vector_names, multivectors), overwrite
+    )
+
+    topology = topology or DEFAULT_TOPOLOGY
+    apply_topology(topology)
+
+    dense_encoders, _ = load_dense_encoders(
+        hf_model_dense, extra_dense_models, topology
+    )
+    sparse_encoder = get_sparse_model(hf_model_sparse)
+    sparse_pool = start_sparse_pool(sparse_encoder, topology)
+    chunker = get_chunker(chunk_mode, hf_model_dense, chunk_max_tokens, chunk_overlap)
 
-            points.append(
-                PointStruct(
-                    id=data["id"],
-                    vector={
-                        "dense": list(dense),
-                        "sparse": sparse_embeddings,
-                    },
-                    payload={
-                        "description": data["sparse_text"],
-                        "registry": f"{data['namespace']}/{data['name']}:{data['tag']}",
-                        "private": data["private"],
-                        "name": data["name"],
-                    },
+    batcher = AdaptiveBatcher(
+        max_rows=batch_size,
+        token_budget=token_budget,
+        memory_budget_mb=memory_budget_mb,
+        target_latency_s=target_batch_seconds,
+    )
+    total = count_rows(input_path)
+    records = (r for batch in read_dataset(input_path, batch_size) for r in batch)
+    try:
+        for mined in tqdm(batcher.batches(records), total=total // batch_size):
+            start = time.perf_counter()
+            writer.write_batch(
+                encode_records(
+                    mined,
+                    dense_encoders,
+                    sparse_encoder,
+                    chunker,
+                    bool(multivectors),
+                    topology,
+                    sparse_pool,
                 )
             )
-        if len(points) == 0:
-            _LOGGER.info(f"No valid points to upsert in batch {i}, skipping.")
-            continue
-        operation_info = qdrant.upsert(
-            collection_name=collection_name,
-            points=points,
-            wait=False,
-        )
-        _LOGGER.info(f"Qdrant operation: {operation_info}")
+            batcher.observe(mined, time.perf_counter() - start)
+    finally:
+        stop_sparse_pool(sparse_encoder, sparse_pool)
 
-        # Mark batch as processed after successful upsert
-        processed_ids = [data["id"] for data in batch_data]
-        id_tracker.mark_batch_processed(processed_ids)
+    _LOGGER.info(f"Batch sizes: {batcher.report()}")
 
-    _LOGGER.info("Indexing process completed.")
+    _LOGGER.info(f"Encoded {writer.rows_written} PEPs into {output}.")
+
+
+def pepembed_upload(
+    input_path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    recreate_collection: bool = True,
+    collection_name: str = QDRANT_DEFAULT_COLLECTION,
+    sink_type: str = DEFAULT_SINK,
+    sink_path: Optional[str] = None,
+    tracking_file: Optional[str] = None,
+    sparse_top_k: Optional[int] = None,
+    sparse_threshold: Optional[float] = None,
+    sparse_float16: bool = False,
+    upload_workers: int = 1,
+) -> None:
+    """Upload an encoded dataset into Qdrant without re-encoding.
+
+    Args:
+        input_path: Directory with the encoded Parquet dataset.
+        batch_size: Number of points per upsert.
+        recreate_collection: Whether to recreate the Qdrant collection.
+        collection_name: The name of the Qdrant collection.
+        sink_type: Destination of the points: "qdrant", "local", "file" or "null".
+        sink_path: Storage path for the "local" and "file" sinks.
+        tracking_file: File recording the processed projects. Defaults to the file
+            of the collection, see `get_tracking_file`.
+        sparse_top_k: Keep only the strongest terms of each uploaded sparse vector.
+        sparse_threshold: Drop uploaded sparse weights not above this value.
+        sparse_float16: Upload sparse weights at float16 precision and store them as float16.
+        upload_workers: Number of upserts in flight at once against a remote Qdrant.
+    """
+    load_dotenv()
+
+    _check_env(_sink_env_vars(sink_type))
+
+    total = count_rows(input_path)
+    if total == 0:
+        _LOGGER.info(f"No records found in {input_path}.")
+        return
+
+    first_record = next(read_dataset(input_path, batch_size=1))[0]
+    # multivectors are stored as lists of chunk vectors
+    multivectors = [
+        name
+        for name, vector in first_record["dense"].items()
+        if vector and isinstance(vector[0], list)
+    ]
+    embedding_dimensions = {
+        name: len(vector[0]) if name in multivectors else len(vector)
+        for name, vector in first_record["dense"].items()
+    }
+    sink = get_sink(
+        sink_type=sink_type,
+        collection_name=collection_name,
+        recreate_collection=recreate_collection,
+        embedding_dim=embedding_dimensions[DENSE_VECTOR_NAME],
+        path=sink_path,
+        extra_vectors=extra_vectors_config(embedding_dimensions, multivectors),
+        sparse_float16=sparse_float16,
+        upload_workers=upload_workers,
+    )
+    compactor = get_compactor(sparse_top_k, sparse_threshold, sparse_float16)
+
+    id_tracker = get_id_tracker(
+        sink, sink_type, collection_name, sink_path, tracking_file
+    )
+    try:
+        for i, encoded in enumerate(
+            tqdm(read_dataset(input_path, batch_size), total=total // batch_size)
+        ):
+            # datasets encoded before digests were stored leave the ids without digests
+            mark_processed = partial(
+                id_tracker.mark_batch_processed,
+                [r["id"] for r in encoded],
+                {
+                    r["id"]: (r["vector_digest"], payload_digest(r["payload"]))
+                    for r in encoded
+                    if r.get("vector_digest")
+                },
+            )
+            upsert_records(sink, encoded, i, compactor, mark_processed)
+    finally:
+        sink.close()
+    id_tracker.compact()
+    if compactor:
+        _LOGGER.info(f"Sparse compaction: {compactor.report()}")
+    _LOGGER.info("Upload completed.")
 
 
 if __name__ == "__main__":
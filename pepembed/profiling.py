@@ -0,0 +1,200 @@
+"""Opt-in profiling of a pipeline run.
+
+Two artifacts are written at the end of a profiled run:
+
+- trace.json: spans of the pipeline stages of every batch, in the Chrome
+  trace event format (open in chrome://tracing or ui.perfetto.dev)
+- profile.folded: Python stacks sampled at a fixed interval from all threads,
+  in the collapsed-stack format read by flamegraph.pl and speedscope
+
+Stages open spans with the module level `span`, which does nothing unless a
+profiler is running. Work done in encoder subprocesses or native threads is
+attributed to the Python frame that waits for it.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from logging import getLogger
+from pathlib import Path
+from typing import Any, ContextManager, Dict, List, Optional
+
+from .const import DEFAULT_PROFILE_INTERVAL_S, PKG_NAME
+
+_LOGGER = getLogger(PKG_NAME)
+
+TRACE_FILE = "trace.json"
+FOLDED_FILE = "profile.folded"
+
+
+class NullProfiler:
+    """Profiler used when profiling is off; all spans are no-ops."""
+
+    def span(self, name: str, **args: Any) -> ContextManager:
+        """
+        Open a span.
+
+        Args:
+            name: Name of the span
+            args: Attributes shown with the span
+
+        Returns:
+            A context manager that does nothing
+        """
+        return nullcontext()
+
+    def start(self) -> None:
+        """Start profiling."""
+
+    def stop(self) -> None:
+        """Stop profiling and write the results."""
+
+
+_ACTIVE_PROFILER = NullProfiler()
+
+
+def span(name: str, **args: Any) -> ContextManager:
+    """Open a span on the running profiler, if any.
+
+    Args:
+        name: Name of the span, e.g. the pipeline stage.
+        args: Attributes shown with the span, e.g. the batch index.
+
+    Returns:
+        Context manager timing the enclosed block.
+    """
+    return _ACTIVE_PROFILER.span(name, **args)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class Profiler(NullProfiler):
+    """Records stage spans and samples the stacks of all threads."""
+
+    def __init__(
+        self,
+        output_dir: str,
+        interval_s: float = DEFAULT_PROFILE_INTERVAL_S,
+    ):
+        """
+        Initialize the profiler.
+
+        Args:
+            output_dir: Directory the trace and the collapsed stacks are written to
+            interval_s: Time between two stack samples, in seconds
+        """
+        self.output_dir = Path(output_dir)
+        self.interval_s = interval_s
+        self.events: List[Dict[str, Any]] = []
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._pid = os.getpid()
+        self._origin = time.perf_counter()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6
+
+    @contextmanager
+    def span(self, name: str, **args: Any):
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": self._now_us() - start,
+                    "pid": self._pid,
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def _sample(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        global _ACTIVE_PROFILER
+        _LOGGER.info(
+            f"Profiling, sampling stacks every {self.interval_s * 1000:.0f} ms."
+        )
+        self._origin = time.perf_counter()
+        self._stop.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, name=f"{PKG_NAME}-profiler", daemon=True
+        )
+        self._sampler.start()
+        _ACTIVE_PROFILER = self
+
+    def stop(self) -> None:
+        global _ACTIVE_PROFILER
+        _ACTIVE_PROFILER = NullProfiler()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.write()
+
+    def write(self) -> None:
+        """Write the trace and the collapsed stacks to the output directory."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        thread_names = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self._pid,
+                "tid": t.ident,
+                "args": {"name": t.name},
+            }
+            for t in threading.enumerate()
+        ]
+        with open(self.output_dir / TRACE_FILE, "w") as f:
+            json.dump(
+                {"traceEvents": thread_names + self.events, "displayTimeUnit": "ms"},
+                f,
+            )
+        with open(self.output_dir / FOLDED_FILE, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        _LOGGER.info(
+            f"Wrote {len(self.events)} spans and {self.samples} stack samples"
+            f" to {self.output_dir}."
+        )
+
+
+def get_profiler(output_dir: Optional[str] = None) -> NullProfiler:
+    """Get the profiler of a run.
+
+    Args:
+        output_dir: Directory to write the profile to. Profiling is off if not set.
+
+    Returns:
+        The profiler, a no-op one if profiling is off.
+    """
+    if not output_dir:
+        return NullProfiler()
+    return Profiler(output_dir)
@@ -0,0 +1,362 @@
+"""Sources of projects to embed.
+
+Every source yields rows with the same fields as the ``Projects`` select used
+against the PEPhub database: namespace, name, tag, config, id, description
+and private.
+"""
+
+import hashlib
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import peppy
+import pyarrow.dataset as ds
+from pepdbagent import PEPDatabaseAgent
+from pepdbagent.db_utils import Projects
+from sqlalchemy import func, null, select
+from sqlalchemy.orm import Session
+
+from .connections import get_db_agent
+from .const import (
+    DEFAULT_SOURCE,
+    DEFAULT_SOURCE_CHUNK_SIZE,
+    DEFAULT_TAG,
+    PKG_NAME,
+    SOURCE_TYPES,
+)
+from .utils import iter_batches
+
+_LOGGER = getLogger(PKG_NAME)
+
+PROJECT_FIELDS = ["namespace", "name", "tag", "config", "id", "description", "private"]
+
+ProjectRow = namedtuple("ProjectRow", PROJECT_FIELDS)
+
+
+def registry_id(namespace: str, name: str, tag: str = DEFAULT_TAG) -> int:
+    """Derive a stable point id from a registry path.
+
+    Args:
+        namespace: Project namespace.
+        name: Project name.
+        tag: Project tag.
+
+    Returns:
+        A positive integer id that fits in a signed 64 bit integer.
+    """
+    digest = hashlib.sha1(f"{namespace}/{name}:{tag}".encode()).hexdigest()
+    return int(digest[:15], 16)
+
+
+def _row_from_dict(record: Dict[str, Any]) -> ProjectRow:
+    """Build a project row from a dumped record.
+
+    Args:
+        record: Dictionary with the project fields. The config may be a JSON string.
+
+    Returns:
+        The project row.
+    """
+    config = record.get("config")
+    if isinstance(config, str):
+        config = json.loads(config)
+    tag = record.get("tag") or DEFAULT_TAG
+    project_id = record.get("id")
+    if project_id is None:
+        project_id = registry_id(record["namespace"], record["name"], tag)
+    return ProjectRow(
+        namespace=record["namespace"],
+        name=record["name"],
+        tag=tag,
+        config=config,
+        id=int(project_id),
+        description=record.get("description") or "",
+        private=bool(record.get("private", False)),
+    )
+
+
+class ProjectSource(ABC):
+    """Yields project rows to embed."""
+
+    # whether rows are yielded in ascending id order
+    sorted_by_id = False
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[Any]:
+        """
+        Yield the rows of the source.
+
+        Returns:
+            Project rows
+        """
+
+    def count(self) -> Optional[int]:
+        """
+        Number of rows the source will yield, if it can be known cheaply.
+
+        Returns:
+            Number of rows, or None if unknown
+        """
+        return None
+
+    def iter_without_config(self) -> Iterator[Any]:
+        """
+        Yield the rows, leaving out the config where the source can skip loading it.
+
+        Returns:
+            Rows whose config may be None, for callers that only need the payload fields
+        """
+        return iter(self)
+
+    def iter_by_ids(self, ids: Set[int]) -> Iterator[Any]:
+        """
+        Yield the rows with the given ids.
+
+        Args:
+            ids: Ids of the rows to yield
+
+        Returns:
+            The matching rows, in source order
+        """
+        return (row for row in self if row.id in ids)
+
+
+class PostgresSource(ProjectSource):
+    """Streams projects from the PEPhub database.
+
+    Rows are read in pages of ascending id, each page in its own short session,
+    so no transaction stays open on the database while the pipeline encodes.
+    """
+
+    sorted_by_id = True
+
+    def __init__(
+        self,
+        agent: Optional[PEPDatabaseAgent] = None,
+        chunk_size: int = DEFAULT_SOURCE_CHUNK_SIZE,
+    ):
+        """
+        Initialize the Postgres source.
+
+        Args:
+            agent: PEP database agent. Created from environment variables if not given
+            chunk_size: Number of rows fetched per page
+        """
+        self.agent = agent or get_db_agent()
+        self.chunk_size = chunk_size
+
+    def _select(self, with_config: bool = True):
+        statement = select(
+            Projects.namespace,
+            Projects.name,
+            Projects.tag,
+            Projects.config if with_config else null().label("config"),
+            Projects.id,
+            Projects.description,
+            Projects.private,
+        )
+        # statement = statement.where(Projects.namespace == "geo")
+        return statement
+
+    def _fetch(self, statement) -> List[Any]:
+        with Session(self.agent.pep_db_engine.engine) as session:
+            return session.execute(statement).all()
+
+    def _iter_pages(self, statement) -> Iterator[Any]:
+        last_id = None
+        while True:
+            # keyset pagination on the primary key, each page is an index range scan
+            page = statement.order_by(Projects.id).limit(self.chunk_size)
+            if last_id is not None:
+                page = page.where(Projects.id > last_id)
+            rows = self._fetch(page)
+            yield from rows
+            if len(rows) < self.chunk_size:
+                return
+            last_id = rows[-1].id
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._iter_pages(self._select())
+
+    def iter_without_config(self) -> Iterator[Any]:
+        # configs are by far the largest column
+        return self._iter_pages(self._select(with_config=False))
+
+    def iter_by_ids(self, ids: Set[int]) -> Iterator[Any]:
+        for chunk in iter_batches(sorted(ids), self.chunk_size):
+            yield from self._fetch(
+                self._select().where(Projects.id.in_(chunk)).order_by(Projects.id)
+            )
+
+    def count(self) -> Optional[int]:
+        with Session(self.agent.pep_db_engine.engine) as session:
+            return session.execute(select(func.count(Projects.id))).scalar_one()
+
+
+def _load_project(config_path: str, namespace: str) -> Optional[ProjectRow]:
+    """Load a single peppy project config into a project row.
+
+    Args:
+        config_path: Path to the project config file.
+        namespace: Namespace to assign to the project.
+
+    Returns:
+        The project row, or None if the config could not be loaded.
+    """
+    try:
+        project = peppy.Project(config_path)
+    except Exception as e:
+        _LOGGER.error(f"Error loading PEP {config_path}: {e}")
+        return None
+    if not project.name:
+        # the registry id is derived from the name, nameless projects would collide
+        _LOGGER.warning(f"Skipping PEP {config_path}: it has no name.")
+        return None
+    return ProjectRow(
+        namespace=namespace,
+        name=project.name,
+        tag=DEFAULT_TAG,
+        config=project.config,
+        id=registry_id(namespace, project.name),
+        description=project.description or "",
+        private=False,
+    )
+
+
+def _load_projects(configs: List[Tuple[str, str]]) -> List[Optional[ProjectRow]]:
+    """Load a chunk of peppy project configs, see `_load_project`.
+
+    Args:
+        configs: Pairs of config path and namespace.
+
+    Returns:
+        The project rows, None for the configs that could not be loaded.
+    """
+    return [_load_project(path, namespace) for path, namespace in configs]
+
+
+class DirectorySource(ProjectSource):
+    """Loads peppy project configs from a directory, in parallel.
+
+    Only a few chunks of configs per worker are loaded ahead of the consumer, so
+    memory stays bounded however large the directory is.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        namespace: Optional[str] = None,
+        workers: Optional[int] = None,
+    ):
+        """
+        Initialize the directory source.
+
+        Args:
+            path: Directory searched recursively for *.yaml / *.yml project configs
+            namespace: Namespace for all projects. Defaults to each config's parent directory name
+            workers: Number of processes loading configs. Defaults to the CPU count
+        """
+        self.path = Path(path)
+        self.namespace = namespace
+        self.workers = workers
+        self.config_files = sorted(
+            p for pattern in ("*.yaml", "*.yml") for p in self.path.rglob(pattern)
+        )
+
+    def __iter__(self) -> Iterator[ProjectRow]:
+        configs = [(str(p), self.namespace or p.parent.name) for p in self.config_files]
+        workers = self.workers or os.cpu_count() or 1
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk in iter_batches(configs, 16):
+                # keep two chunks per worker loading while the consumer is busy
+                if len(in_flight) >= 2 * workers:
+                    yield from filter(None, in_flight.popleft().result())
+                in_flight.append(executor.submit(_load_projects, chunk))
+            while in_flight:
+                yield from filter(None, in_flight.popleft().result())
+
+    def count(self) -> Optional[int]:
+        return len(self.config_files)
+
+
+class JSONLSource(ProjectSource):
+    """Reads projects from a JSON lines dump, one project per line."""
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        """
+        Initialize the JSON lines source.
+
+        Args:
+            path: Path to the JSON lines file
+        """
+        self.path = Path(path)
+
+    def __iter__(self) -> Iterator[ProjectRow]:
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield _row_from_dict(json.loads(line))
+
+
+class ParquetSource(ProjectSource):
+    """Reads projects from a Parquet dump, streaming record batches."""
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        chunk_size: int = DEFAULT_SOURCE_CHUNK_SIZE,
+    ):
+        """
+        Initialize the Parquet source.
+
+        Args:
+            path: Parquet file or directory of Parquet files
+            chunk_size: Number of rows read at a time
+        """
+        self.dataset = ds.dataset(str(path), format="parquet")
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[ProjectRow]:
+        for record_batch in self.dataset.to_batches(batch_size=self.chunk_size):
+            for record in record_batch.to_pylist():
+                yield _row_from_dict(record)
+
+    def count(self) -> Optional[int]:
+        return self.dataset.count_rows()
+
+
+def get_source(
+    source_type: str = DEFAULT_SOURCE,
+    path: Optional[str] = None,
+) -> ProjectSource:
+    """Get the source of projects to embed.
+
+    Args:
+        source_type: One of "postgres", "directory", "jsonl" or "parquet".
+        path: Location of the projects for the file based sources.
+
+    Returns:
+        The project source instance.
+    """
+    if source_type not in SOURCE_TYPES:
+        raise ValueError(
+            f"Unknown source type '{source_type}', expected one of: {', '.join(SOURCE_TYPES)}"
+        )
+    if source_type == "postgres":
+        _LOGGER.info("Connecting to database.")
+        return PostgresSource()
+    if not path:
+        raise ValueError(f"Source type '{source_type}' requires a path.")
+    if source_type == "directory":
+        return DirectorySource(path)
+    if source_type == "jsonl":
+        return JSONLSource(path)
+    return ParquetSource(path)
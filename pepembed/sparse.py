@@ -0,0 +1,141 @@
+"""Post-processing of sparse vectors before upload.
+
+SPLADE outputs often carry hundreds of non-zero terms per document. Pruning
+them to the strongest terms and storing the values as float16 shrinks the
+request payloads and Qdrant's in-RAM sparse index, without re-running the
+model: the full vectors stay in the encoded dataset and can be re-pruned.
+"""
+
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .const import PKG_NAME
+
+_LOGGER = getLogger(PKG_NAME)
+
+# bytes per stored term: a uint32 index plus the value
+INDEX_BYTES = 4
+FLOAT32_BYTES = 4
+FLOAT16_BYTES = 2
+
+
+def sparse_tensor_to_lists(tensor) -> Tuple[List[int], List[float]]:
+    """Convert a 1D torch sparse tensor from the sparse encoder to index/value lists.
+
+    Args:
+        tensor: Sparse COO tensor over the vocabulary.
+
+    Returns:
+        The term indices and their weights.
+    """
+    tensor = tensor.coalesce()
+    return tensor.indices().tolist()[0], tensor.values().tolist()
+
+
+def compact_sparse(
+    indices: List[int],
+    values: List[float],
+    top_k: Optional[int] = None,
+    threshold: Optional[float] = None,
+    float16: bool = False,
+) -> Tuple[List[int], List[float]]:
+    """Merge, prune and quantize a sparse vector.
+
+    Args:
+        indices: Term indices, possibly with duplicates.
+        values: Term weights.
+        top_k: Keep only the `top_k` largest weights.
+        threshold: Drop weights not above this value.
+        float16: Round the weights to float16 precision.
+
+    Returns:
+        The compacted indices, sorted ascending, and their weights.
+    """
+    if not indices:
+        return [], []
+
+    # merge duplicate indices by summing their weights
+    unique_indices, inverse = np.unique(np.asarray(indices), return_inverse=True)
+    merged = np.zeros(len(unique_indices), dtype=np.float64)
+    np.add.at(merged, inverse, np.asarray(values, dtype=np.float64))
+
+    keep = merged > (threshold if threshold is not None else 0.0)
+    unique_indices, merged = unique_indices[keep], merged[keep]
+
+    if top_k is not None and len(merged) > top_k:
+        strongest = np.sort(np.argpartition(-merged, top_k - 1)[:top_k])
+        unique_indices, merged = unique_indices[strongest], merged[strongest]
+
+    weights = merged.astype(np.float16 if float16 else np.float32)
+    return unique_indices.tolist(), weights.astype(np.float32).tolist()
+
+
+class SparseCompactor:
+    """Compacts the sparse vectors of encoded records and tracks the savings."""
+
+    def __init__(
+        self,
+        top_k: Optional[int] = None,
+        threshold: Optional[float] = None,
+        float16: bool = False,
+    ):
+        """
+        Initialize the sparse compactor.
+
+        Args:
+            top_k: Keep only the `top_k` largest weights of each vector
+            threshold: Drop weights not above this value
+            float16: Round the weights to float16 precision
+        """
+        self.top_k = top_k
+        self.threshold = threshold
+        self.float16 = float16
+        self.vectors = 0
+        self.terms_before = 0
+        self.terms_after = 0
+
+    def compact_records(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Compact the sparse vectors of a batch of encoded records.
+
+        Args:
+            records: Encoded records with sparse_indices and sparse_values
+
+        Returns:
+            Copies of the records with compacted sparse vectors
+        """
+        compacted = []
+        for r in records:
+            indices, values = compact_sparse(
+                r["sparse_indices"],
+                r["sparse_values"],
+                top_k=self.top_k,
+                threshold=self.threshold,
+                float16=self.float16,
+            )
+            self.vectors += 1
+            self.terms_before += len(r["sparse_indices"])
+            self.terms_after += len(indices)
+            compacted.append({**r, "sparse_indices": indices, "sparse_values": values})
+        return compacted
+
+    def report(self) -> Dict[str, float]:
+        """
+        Summarize the size reduction.
+
+        Returns:
+            Dictionary with statistics
+        """
+        value_bytes = FLOAT16_BYTES if self.float16 else FLOAT32_BYTES
+        bytes_before = self.terms_before * (INDEX_BYTES + FLOAT32_BYTES)
+        bytes_after = self.terms_after * (INDEX_BYTES + value_bytes)
+        return {
+            "vectors": self.vectors,
+            "terms_per_vector_before": self.terms_before / max(self.vectors, 1),
+            "terms_per_vector_after": self.terms_after / max(self.vectors, 1),
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "size_reduction": 1 - bytes_after / bytes_before if bytes_before else 0.0,
+        }
@@ -0,0 +1,472 @@
+"""Execution topology: how the encoders and the upload share the machine.
+
+All parallelism knobs live in one place instead of being hard-coded at the
+call sites. They are resolved from, in increasing priority: the defaults, a
+JSON file (`--topology` or TOPOLOGY_FILE), environment variables named after
+the fields in upper case (e.g. DENSE_WORKERS), and CLI options.
+
+`autotune` measures a sample of mined rows under several settings and writes
+the fastest ones to a JSON file that can be passed back with `--topology`.
+"""
+
+import json
+import math
+import os
+import time
+from collections import namedtuple
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from .batching import current_rss_mb
+from .benchmark import load_sample
+from .connections import get_dense_model, get_sparse_model
+from .const import (
+    AUTOTUNE_MEMORY_FRACTION,
+    DEFAULT_AUTOTUNE_SAMPLE_SIZE,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_DENSE_BATCH_SIZE,
+    DEFAULT_DENSE_WORKERS,
+    DEFAULT_SPARSE_BATCH_SIZE,
+    DEFAULT_SPARSE_WORKERS,
+    DEFAULT_UPLOAD_WORKERS,
+    DENSE_ENCODER_MODEL,
+    MAX_AUTOTUNE_SPARSE_WORKERS,
+    PKG_NAME,
+    SPARSE_ENCODER_MODEL,
+)
+from .utils import iter_batches
+
+_LOGGER = getLogger(PKG_NAME)
+
+TOPOLOGY_FIELDS = [
+    # processes fastembed spreads dense encoding over, 1 encodes in-process
+    "dense_workers",
+    "dense_batch_size",
+    # ONNX Runtime intra-op threads of in-process dense encoding, None lets ORT
+    # decide. fastembed runs its worker processes with one thread each, so this
+    # only applies with a single dense worker
+    "onnx_threads",
+    # processes sentence-transformers spreads sparse encoding over
+    "sparse_workers",
+    "sparse_batch_size",
+    # torch intra-op threads of each sparse worker, None lets torch use every core
+    "torch_threads",
+    # upserts in flight at once against a remote Qdrant
+    "upload_workers",
+]
+
+Topology = namedtuple(
+    "Topology",
+    TOPOLOGY_FIELDS,
+    defaults=[
+        DEFAULT_DENSE_WORKERS,
+        DEFAULT_DENSE_BATCH_SIZE,
+        None,
+        DEFAULT_SPARSE_WORKERS,
+        DEFAULT_SPARSE_BATCH_SIZE,
+        None,
+        DEFAULT_UPLOAD_WORKERS,
+    ],
+)
+
+DEFAULT_TOPOLOGY = Topology()
+
+
+def _own_cgroups() -> Dict[str, str]:
+    # "<hierarchy>:<controllers>:<path>" lines, the cgroup v2 one has no controllers
+    cgroups = {}
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                parts = line.strip().split(":", 2)
+                if len(parts) == 3:
+                    for controller in parts[1].split(","):
+                        cgroups[controller] = parts[2].lstrip("/")
+    except OSError:
+        pass
+    return cgroups
+
+
+def _read_quota(path: Path) -> Optional[Tuple[str, str]]:
+    try:
+        return tuple(path.read_text().split()[:2])
+    except (OSError, ValueError):
+        return None
+
+
+def cgroup_cpu_quota(cgroup_root: str = "/sys/fs/cgroup") -> Optional[float]:
+    """CPU quota of the cgroup of this process, e.g. the CPU limit of a container.
+
+    Reads cpu.max of cgroup v2, or cpu.cfs_quota_us and cpu.cfs_period_us of
+    cgroup v1, in the cgroup of the process or else at the root of the hierarchy.
+
+    Args:
+        cgroup_root: Mount point of the cgroup hierarchy.
+
+    Returns:
+        The quota in CPUs, or None if there is none.
+    """
+    root = Path(cgroup_root)
+    cgroups = _own_cgroups()
+    for directory in (root / cgroups.get("", ""), root):
+        quota = _read_quota(directory / "cpu.max")
+        if quota is not None:
+            if quota[0] == "max":
+                return None
+            return int(quota[0]) / int(quota[1])
+    for directory in (root / "cpu" / cgroups.get("cpu", ""), root / "cpu"):
+        quota = _read_quota(directory / "cpu.cfs_quota_us")
+        period = _read_quota(directory / "cpu.cfs_period_us")
+        if quota is not None and period is not None:
+            # -1 means no quota
+            if int(quota[0]) <= 0:
+                return None
+            return int(quota[0]) / int(period[0])
+    return None
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process may use, respecting affinity masks and cgroup CPU quotas.
+
+    A container limited to 4 CPUs on a larger host sees every host core in its
+    affinity mask, so the quota is taken into account as well.
+
+    Returns:
+        The CPU count.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def available_memory_mb() -> Optional[float]:
+    """Memory available to new processes without swapping, in MB.
+
+    Returns:
+        The available memory, or None where it cannot be read.
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _parse_setting(field: str, value: Any) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    value = int(value)
+    if value < 1:
+        raise ValueError(f"Topology setting {field} must be at least 1, got {value}.")
+    return value
+
+
+def load_topology(path: Optional[str] = None, **overrides: Optional[int]) -> Topology:
+    """Resolve the execution topology.
+
+    Args:
+        path: JSON file with topology settings. Defaults to TOPOLOGY_FILE if set.
+        overrides: Settings given on the command line; None values are ignored.
+
+    Returns:
+        The topology.
+    """
+    settings: Dict[str, Any] = DEFAULT_TOPOLOGY._asdict()
+
+    path = path or os.environ.get("TOPOLOGY_FILE")
+    if path:
+        with open(path, "r") as f:
+            file_settings = json.load(f)
+        unknown = set(file_settings) - set(TOPOLOGY_FIELDS)
+        if unknown:
+            raise ValueError(
+                f"Unknown topology settings in {path}: {', '.join(sorted(unknown))}"
+            )
+        settings.update(file_settings)
+
+    for field in TOPOLOGY_FIELDS:
+        if os.environ.get(field.upper()):
+            settings[field] = os.environ[field.upper()]
+        if overrides.get(field) is not None:
+            settings[field] = overrides[field]
+
+    return Topology(
+        **{field: _parse_setting(field, value) for field, value in settings.items()}
+    )
+
+
+def _set_torch_threads(threads: int) -> None:
+    torch.set_num_threads(threads)
+    # inherited by sparse worker processes started afterwards
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+
+def apply_topology(topology: Topology) -> None:
+    """Apply the process wide settings of a topology and warn about oversubscription.
+
+    Args:
+        topology: The topology.
+    """
+    if topology.torch_threads:
+        _set_torch_threads(topology.torch_threads)
+
+    cpus = available_cpus()
+    _LOGGER.info(f"Execution topology on {cpus} CPUs: {dict(topology._asdict())}")
+    if topology.onnx_threads and dense_parallel(topology):
+        _LOGGER.warning(
+            f"onnx_threads is ignored with {topology.dense_workers} dense workers."
+        )
+
+    if dense_parallel(topology):
+        dense_total = topology.dense_workers
+    else:
+        dense_total = topology.onnx_threads or cpus
+    # without a thread count, torch uses every core in each worker
+    sparse_total = (topology.sparse_workers or 1) * (topology.torch_threads or cpus)
+    # dense and sparse encoding run one after the other, so only each on its own counts
+    if max(dense_total, sparse_total) > cpus:
+        _LOGGER.warning(
+            f"Topology uses up to {max(dense_total, sparse_total)} threads on {cpus} CPUs."
+            f" Run `{PKG_NAME} autotune` to find settings for this machine."
+        )
+
+
+def dense_parallel(topology: Topology) -> Optional[int]:
+    """The `parallel` argument of fastembed for a topology.
+
+    Args:
+        topology: The topology.
+
+    Returns:
+        Number of worker processes, or None to encode in-process.
+    """
+    return topology.dense_workers if (topology.dense_workers or 1) > 1 else None
+
+
+def dense_threads(topology: Topology) -> Optional[int]:
+    """The `threads` argument of the fastembed model for a topology.
+
+    Args:
+        topology: The topology.
+
+    Returns:
+        ONNX Runtime threads of in-process encoding, or None when encoding in
+        worker processes.
+    """
+    return None if dense_parallel(topology) else topology.onnx_threads
+
+
+def start_sparse_pool(sparse_encoder, topology: Topology) -> Optional[Dict[str, Any]]:
+    """Start the sparse encoder worker processes of a topology.
+
+    Args:
+        sparse_encoder: Sparse encoder model.
+        topology: The topology.
+
+    Returns:
+        The process pool, or None to encode in-process.
+    """
+    if (topology.sparse_workers or 1) <= 1:
+        return None
+    _LOGGER.info(f"Starting {topology.sparse_workers} sparse encoder processes.")
+    return sparse_encoder.start_multi_process_pool(["cpu"] * topology.sparse_workers)
+
+
+def stop_sparse_pool(sparse_encoder, pool: Optional[Dict[str, Any]]) -> None:
+    """Stop the sparse encoder worker processes, if any.
+
+    Args:
+        sparse_encoder: Sparse encoder model.
+        pool: The process pool returned by `start_sparse_pool`.
+    """
+    if pool is not None:
+        sparse_encoder.stop_multi_process_pool(pool)
+
+
+def _counts(cpus: int) -> List[int]:
+    return sorted({n for n in (1, 2, 4, 8, cpus // 2, cpus) if 1 <= n <= cpus})
+
+
+def max_sparse_workers(model_mb: float, available_mb: Optional[float]) -> int:
+    """Most sparse workers autotune starts at once.
+
+    Args:
+        model_mb: Memory one copy of the sparse model takes.
+        available_mb: Memory available to new processes, None if unknown.
+
+    Returns:
+        The worker count, at least one.
+    """
+    if available_mb is None:
+        return MAX_AUTOTUNE_SPARSE_WORKERS
+    memory_workers = int(available_mb * AUTOTUNE_MEMORY_FRACTION / model_mb)
+    return max(1, min(MAX_AUTOTUNE_SPARSE_WORKERS, memory_workers))
+
+
+def _time_batches(encode, texts: List[str], batch_size: int) -> float:
+    # warm up on a small batch first, so lazy model initialization is not timed
+    encode(texts[: min(8, len(texts))])
+    start = time.perf_counter()
+    for batch in iter_batches(texts, batch_size):
+        encode(batch)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def _tune_dense(
+    hf_model_dense: str, texts: List[str], batch_size: int, cpus: int
+) -> Dict[str, Any]:
+    results = []
+    encoders = {}
+    # onnx_threads only applies to in-process encoding
+    grid = [(1, threads) for threads in _counts(cpus)]
+    grid += [(workers, None) for workers in _counts(cpus) if workers > 1]
+    for workers, threads in grid:
+        if threads not in encoders:
+            encoders[threads] = get_dense_model(hf_model_dense, threads=threads)
+        encoder = encoders[threads]
+        for dense_batch_size in (64, DEFAULT_DENSE_BATCH_SIZE):
+            topology = Topology(
+                dense_workers=workers,
+                onnx_threads=threads,
+                dense_batch_size=dense_batch_size,
+            )
+            docs_per_second = _time_batches(
+                lambda batch: list(
+                    encoder.embed(
+                        batch,
+                        batch_size=dense_batch_size,
+                        parallel=dense_parallel(topology),
+                    )
+                ),
+                texts,
+                batch_size,
+            )
+            _LOGGER.info(
+                f"Dense: {workers} workers x {threads or 1} threads, batch size"
+                f" {dense_batch_size}: {docs_per_second:.1f} docs/s"
+            )
+            results.append((docs_per_second, topology))
+    best = max(results, key=lambda r: r[0])[1]
+    return {
+        "dense_workers": best.dense_workers,
+        "onnx_threads": best.onnx_threads,
+        "dense_batch_size": best.dense_batch_size,
+    }
+
+
+def _tune_sparse(
+    hf_model_sparse: str, texts: List[str], batch_size: int, cpus: int
+) -> Dict[str, Any]:
+    rss_before = current_rss_mb()
+    sparse_encoder = get_sparse_model(hf_model_sparse)
+    model_mb = max(current_rss_mb() - rss_before, 1.0)
+    max_workers = max_sparse_workers(model_mb, available_memory_mb())
+    _LOGGER.info(
+        f"Sparse model takes {model_mb:.0f} MB, trying up to {max_workers} workers."
+    )
+    results = []
+    for workers in [w for w in _counts(cpus) if w <= max_workers]:
+        # split the CPUs between the workers, the worker processes inherit the
+        # thread count through OMP_NUM_THREADS
+        threads = max(1, cpus // workers)
+        topology = Topology(sparse_workers=workers, torch_threads=threads)
+        _set_torch_threads(threads)
+        pool = start_sparse_pool(sparse_encoder, topology)
+        try:
+            for sparse_batch_size in (16, 32, DEFAULT_SPARSE_BATCH_SIZE, 128):
+                docs_per_second = _time_batches(
+                    lambda batch: sparse_encoder.encode(
+                        batch,
+                        batch_size=sparse_batch_size,
+                        convert_to_tensor=False,
+                        pool=pool,
+                    ),
+                    texts,
+                    batch_size,
+                )
+                _LOGGER.info(
+                    f"Sparse: {workers} workers x {threads} threads, batch size"
+                    f" {sparse_batch_size}: {docs_per_second:.1f} docs/s"
+                )
+                results.append(
+                    (
+                        docs_per_second,
+                        topology._replace(sparse_batch_size=sparse_batch_size),
+                    )
+                )
+        finally:
+            stop_sparse_pool(sparse_encoder, pool)
+    best = max(results, key=lambda r: r[0])[1]
+    return {
+        "sparse_workers": best.sparse_workers,
+        "torch_threads": best.torch_threads,
+        "sparse_batch_size": best.sparse_batch_size,
+    }
+
+
+def autotune(
+    input_path: str,
+    output: str,
+    hf_model_dense: str = DENSE_ENCODER_MODEL,
+    hf_model_sparse: str = SPARSE_ENCODER_MODEL,
+    sample_size: int = DEFAULT_AUTOTUNE_SAMPLE_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Topology:
+    """Find the fastest encoder settings for this machine and write them to a file.
+
+    Dense and sparse encoding run one after the other, so each is tuned on its
+    own over the number of worker processes, the threads and the model batch
+    size. Dense threads are only tuned for a single in-process worker. Sparse
+    workers split the CPUs evenly, and their number is capped by the memory
+    their model copies take. The upload concurrency depends on the Qdrant
+    server rather than this machine and is kept as configured.
+
+    Args:
+        input_path: Directory with a mined Parquet dataset to sample rows from.
+        output: JSON file to write the topology to.
+        hf_model_dense: The HuggingFace model to use for dense embeddings.
+        hf_model_sparse: The HuggingFace model to use for sparse embeddings.
+        sample_size: Number of rows encoded per setting.
+        batch_size: Pipeline batch size the rows are encoded in.
+
+    Returns:
+        The fastest topology.
+    """
+    records = load_sample(input_path, sample_size)
+    if not records:
+        raise ValueError(f"No records found in {input_path}.")
+    cpus = available_cpus()
+    _LOGGER.info(f"Autotuning on {len(records)} rows and {cpus} CPUs.")
+
+    settings = load_topology()._asdict()
+    settings.update(
+        _tune_dense(
+            hf_model_dense, [r["dense_text"] for r in records], batch_size, cpus
+        )
+    )
+    settings.update(
+        _tune_sparse(
+            hf_model_sparse, [r["sparse_text"] for r in records], batch_size, cpus
+        )
+    )
+    topology = Topology(**settings)
+
+    with open(output, "w") as f:
+        json.dump(topology._asdict(), f, indent=2)
+    _LOGGER.info(f"Fastest topology written to {output}: {dict(topology._asdict())}")
+    return topology
@@ -1,11 +1,20 @@
+import hashlib
+import json
 import os
 import re
+from itertools import islice
 from logging import getLogger
-from typing import Any, Dict, Generator, List
+from typing import Any, Dict, Generator, Iterable, List
 
 import flatdict
 
-from .const import DEFAULT_KEYWORDS, PKG_NAME
+from .const import (
+    CHUNK_VECTOR_SUFFIX,
+    DEFAULT_KEYWORDS,
+    DENSE_VECTOR_NAME,
+    PKG_NAME,
+    TEXT_PAYLOAD_FIELDS,
+)
 
 _LOGGER = getLogger(PKG_NAME)
 
@@ -41,6 +50,21 @@ def batch_generator(iterable, batch_size) -> Generator[Any, Any, None]:
         yield iterable[ndx : min(ndx + batch_size, l)]
 
 
+def iter_batches(iterable: Iterable, batch_size: int) -> Generator[List, None, None]:
+    """Generate batches from an iterable of unknown length, e.g. a stream.
+
+    Args:
+        iterable: The iterable to batch.
+        batch_size: Size of each batch.
+
+    Yields:
+        Lists of up to the specified size from the iterable.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
 def markdown_to_text(md: str) -> str:
     """Convert markdown text to plain text.
 
@@ -102,6 +126,72 @@ def mine_metadata_from_dict(
     return desc.strip()
 
 
+def dense_vector_name(model_name: str) -> str:
+    """Name of the collection vector holding embeddings of an additional dense model.
+
+    Args:
+        model_name: HuggingFace name of the dense model, e.g. "BAAI/bge-small-en-v1.5".
+
+    Returns:
+        Vector name, e.g. "dense_bge_small_en_v1_5".
+    """
+    slug = re.sub(r"[^0-9a-zA-Z]+", "_", model_name.split("/")[-1]).strip("_")
+    return f"{DENSE_VECTOR_NAME}_{slug.lower()}"
+
+
+def chunk_vector_name(vector_name: str) -> str:
+    """Name of the multivector holding the chunk embeddings of a dense vector.
+
+    Args:
+        vector_name: Name of the pooled dense vector, e.g. "dense".
+
+    Returns:
+        Multivector name, e.g. "dense_chunks".
+    """
+    return f"{vector_name}{CHUNK_VECTOR_SUFFIX}"
+
+
+def payload_digest(payload: Dict[str, Any]) -> str:
+    """Digest of a point payload, stable across key order.
+
+    Args:
+        payload: The point payload.
+
+    Returns:
+        Hex digest of the payload.
+    """
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(serialized.encode()).hexdigest()[:16]
+
+
+def payload_text_digest(payload: Dict[str, Any]) -> str:
+    """Digest of the payload fields the vectors of a point are encoded from.
+
+    Unlike a privacy flip, a change of these fields is not a payload-only change.
+
+    Args:
+        payload: The point payload.
+
+    Returns:
+        Hex digest of the name and description.
+    """
+    return payload_digest({field: payload.get(field) for field in TEXT_PAYLOAD_FIELDS})
+
+
+def vector_digest(dense_text: str, sparse_text: str) -> str:
+    """Digest of the texts the vectors of a point are encoded from.
+
+    Args:
+        dense_text: Text of the dense vectors.
+        sparse_text: Text of the sparse vector.
+
+    Returns:
+        Hex digest of the texts.
+    """
+    serialized = f"{dense_text}\0{sparse_text}"
+    return hashlib.sha1(serialized.encode()).hexdigest()[:16]
+
+
 def check_env_variable(var_name: str) -> bool:
     """Check if an environment variable is set.
 
@@ -0,0 +1,57 @@
+from typing import Any, Dict
+
+import pytest
+from qdrant_client.http import models
+from qdrant_client.http.models import PointStruct
+
+from pepembed.connections import get_sink
+
+
+@pytest.fixture
+def make_point():
+    """Builds a point with fixed 4 dimensional vectors and the given payload."""
+
+    def make_point(point_id: int, payload: Dict[str, Any]) -> PointStruct:
+        return PointStruct(
+            id=point_id,
+            vector={
+                "dense": [1.0, 0.0, 0.0, 0.0],
+                "sparse": models.SparseVector(indices=[point_id], values=[1.0]),
+            },
+            payload=payload,
+        )
+
+    return make_point
+
+
+@pytest.fixture
+def local_path(tmp_path):
+    """Storage directory of the local Qdrant store of a test."""
+    return str(tmp_path / "qdrant")
+
+
+@pytest.fixture
+def open_local_sink(local_path):
+    """Opens collections of 4 dimensional points in the local store, closed after the test."""
+    sinks = []
+
+    def open_local_sink(collection_name: str = "test"):
+        sink = get_sink(
+            "local",
+            collection_name=collection_name,
+            recreate_collection=True,
+            embedding_dim=4,
+            path=local_path,
+        )
+        sinks.append(sink)
+        return sink
+
+    yield open_local_sink
+    for sink in sinks:
+        sink.close()
+
+
+@pytest.fixture
+def local_sink(open_local_sink):
+    """The "test" collection of the local store."""
+    return open_local_sink()
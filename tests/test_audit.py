@@ -0,0 +1,136 @@
+import json
+
+from pepembed.audit import (
+    AuditRepair,
+    AuditReport,
+    audit_collection,
+    external_sort,
+    merge_join,
+    pepembed_audit,
+)
+from pepembed.id_tracker import IDTracker
+from pepembed.pepembed import build_payload
+from pepembed.sources import JSONLSource
+from pepembed.utils import payload_digest
+
+
+def fake_encode(projects):
+    return [
+        {
+            "id": p.id,
+            "dense": {"dense": [0.0, 1.0, 0.0, 0.0]},
+            "sparse_indices": [2],
+            "sparse_values": [1.0],
+            "payload": build_payload(p),
+            "vector_digest": f"v{p.id}",
+        }
+        for p in projects
+    ]
+
+
+class TestAudit:
+    def test_merge_join(self):
+        assert list(external_sort([(3, "c"), (1, "a"), (2, "b")], chunk_size=2)) == [
+            (1, "a"),
+            (2, "b"),
+            (3, "c"),
+        ]
+        joined = list(merge_join([(1, "a"), (3, "c")], [(2, "x"), (3, "y")]))
+        assert joined == [(1, ["a", None]), (2, [None, "x"]), (3, ["c", "y"])]
+
+    def test_audit_and_repair(self, tmp_path, local_sink, make_point):
+        """Differences are found in a streaming diff and repaired in batches."""
+        dump = tmp_path / "dump.jsonl"
+        with open(dump, "w") as f:
+            for i in (3, 1, 4, 2):
+                project = {"namespace": "geo", "name": f"GSE{i}", "id": i}
+                f.write(json.dumps({**project, "description": f"project {i}"}) + "\n")
+        source = JSONLSource(dump)
+        projects = {p.id: p for p in source}
+
+        local_sink.upsert(
+            [
+                make_point(1, build_payload(projects[1])),
+                make_point(2, {**build_payload(projects[2]), "private": True}),
+                make_point(9, build_payload(projects[1])),
+                # re-worded since it was encoded
+                make_point(4, {**build_payload(projects[4]), "description": "old"}),
+            ]
+        )
+        id_tracker = IDTracker(str(tmp_path / "processed.txt"))
+        id_tracker.mark_batch_processed([1, 2, 3, 4, 7, 9], {2: ("v2", "old")})
+
+        report = AuditReport()
+        repair = AuditRepair(
+            local_sink, id_tracker, source, lambda: fake_encode, batch_size=2
+        )
+        audit_collection(
+            source,
+            local_sink,
+            id_tracker,
+            report,
+            repair,
+            batch_size=2,
+            sort_chunk_size=2,
+        )
+        summary = report.summary()
+        assert summary["checked"] == 6
+        assert {s: summary[s] for s in ("missing", "orphaned", "stale")} == {
+            "missing": 1,
+            "orphaned": 1,
+            "stale": 2,
+        }
+        assert summary["samples"]["never_landed"] == [3, 7]
+        assert repair.repaired == {
+            "payloads": 1,
+            "deleted": 1,
+            "upserted": 2,
+            "untracked": 2,
+        }
+
+        assert local_sink.client.retrieve("test", [2])[0].payload["private"] is False
+        # a changed description is encoded again, not only written into the payload
+        [point] = local_sink.client.retrieve("test", [4], with_vectors=True)
+        assert point.payload == build_payload(projects[4])
+        assert point.vector["dense"] == [0.0, 1.0, 0.0, 0.0]
+        assert id_tracker.processed_ids == {1, 2, 3, 4}
+        id_tracker = IDTracker(str(tmp_path / "processed.txt"))
+        assert id_tracker.processed_ids == {1, 2, 3, 4}
+        # repaired and upserted ids are recorded with digests, the pipeline skips them
+        for point_id in (2, 3, 4):
+            assert id_tracker.get_digests(point_id) == (
+                f"v{point_id}",
+                payload_digest(build_payload(projects[point_id])),
+            )
+
+        # the deleted orphan is no longer tracked, so the next audit is clean
+        report = AuditReport()
+        audit_collection(source, local_sink, id_tracker, report)
+        assert sum(report.counts.values()) == 0
+
+    def test_audit_tracking_file(
+        self, tmp_path, monkeypatch, local_path, local_sink, make_point
+    ):
+        """Only the ids tracked for the audited collection are checked."""
+        monkeypatch.chdir(tmp_path)
+        dump = tmp_path / "dump.jsonl"
+        dump.write_text(json.dumps({"namespace": "geo", "name": "GSE1", "id": 1}))
+        # processed ids of the production collection
+        (tmp_path / "processed.txt").write_text("1\n7\n")
+        project = next(iter(JSONLSource(dump)))
+        local_sink.upsert([make_point(1, build_payload(project))])
+        IDTracker(f"{local_path}/processed-test.txt").mark_batch_processed([1, 8])
+        # the audit opens the store itself
+        local_sink.close()
+
+        summary = pepembed_audit(
+            "test",
+            "local",
+            local_path,
+            source_type="jsonl",
+            source_path=str(dump),
+            repair=True,
+        )
+        assert summary["samples"]["never_landed"] == [8]
+        assert IDTracker(f"{local_path}/processed-test.txt").processed_ids == {1}
+        assert (tmp_path / "processed.txt").read_text() == "1\n7\n"
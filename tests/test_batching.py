@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pepembed.batching
+from pepembed.batching import AdaptiveBatcher, current_rss_mb, estimate_tokens
+
+
+def make_records(n: int, chars: int):
+    return [{"dense_text": "x" * chars, "sparse_text": ""} for _ in range(n)]
+
+
+class TestAdaptiveBatcher:
+    def test_token_budget(self):
+        """Batches close at the token budget before reaching the row limit."""
+        records = make_records(10, 39)
+        assert estimate_tokens(records[0]) == 10
+
+        batcher = AdaptiveBatcher(max_rows=8, token_budget=30, min_rows=1)
+        assert [len(b) for b in batcher.batches(records)] == [3, 3, 3, 1]
+
+        batcher = AdaptiveBatcher(max_rows=4, min_rows=1)
+        assert [len(b) for b in batcher.batches(records)] == [4, 4, 2]
+
+    def test_memory_budget(self, monkeypatch):
+        """Limits halve while RSS is over budget and grow back once it drops."""
+        rss = {"mb": 2000.0}
+        monkeypatch.setattr(pepembed.batching, "current_rss_mb", lambda: rss["mb"])
+        batcher = AdaptiveBatcher(max_rows=64, memory_budget_mb=1000, min_rows=4)
+
+        sizes = []
+        for batch in batcher.batches(make_records(200, 4)):
+            sizes.append(len(batch))
+            if len(sizes) == 3:
+                rss["mb"] = 100.0
+            batcher.observe(batch, latency_s=0.1)
+        assert sizes[:5] == [64, 32, 16, 20, 25]
+
+        report = batcher.report()
+        assert report["batches"] == len(sizes)
+        assert report["rows_max"] == 64
+        assert report["rss_mb_peak"] == 2000.0
+
+    @pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+    def test_rss_of_children(self):
+        """Memory held by worker processes counts against the budget."""
+        before = current_rss_mb()
+        child = subprocess.Popen(
+            [sys.executable, "-c", "x = b'x' * 200 * 1024**2; print(); input()"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        try:
+            child.stdout.readline()
+            assert current_rss_mb() - before > 150
+        finally:
+            child.communicate(b"\n")
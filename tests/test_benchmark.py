@@ -0,0 +1,98 @@
+import json
+
+import numpy as np
+
+import pepembed.benchmark
+from pepembed.benchmark import (
+    benchmark_models,
+    known_item_documents,
+    known_item_queries,
+    load_sample,
+    read_queries,
+    relevant_ids,
+)
+from pepembed.datasets import MINED_SCHEMA, DatasetWriter
+from pepembed.pepembed import mine_projects
+from pepembed.sources import ProjectRow
+
+
+def make_project(project_id: int, description: str, config=None):
+    return ProjectRow(
+        namespace="geo",
+        name=f"GSE{project_id}",
+        tag="default",
+        config=config or {"experiment_metadata": {"series_title": "liver rna-seq"}},
+        id=project_id,
+        description=description,
+        private=False,
+    )
+
+
+class TestBenchmark:
+    def test_known_items(self):
+        """Known-item queries are never contained in their metadata-only documents."""
+        description = "Single cell sequencing of mouse liver. Second sentence."
+        records = mine_projects(
+            [
+                make_project(1, description),
+                make_project(2, "too short"),
+                make_project(3, description, config={"name": "no keywords"}),
+            ]
+        )
+
+        queries = known_item_queries(records)
+        assert queries == [{"query": description, "relevant": [1]}]
+
+        documents = known_item_documents(records)
+        assert [d["dense_text"] for d in documents] == ["liver rna-seq"] * 2 + [""]
+        assert records[0]["dense_text"].endswith("Metadata: liver rna-seq")
+
+    def test_judged_sample(self, tmp_path):
+        """Relevant documents are always sampled, queries without any are skipped."""
+        queries_path = tmp_path / "queries.jsonl"
+        queries_path.write_text(
+            "\n".join(
+                json.dumps(q)
+                for q in [
+                    {"query": "liver", "relevant": [8, 42]},
+                    {"query": "unjudged", "relevant": []},
+                ]
+            )
+        )
+        queries = read_queries(str(queries_path))
+        assert [q["query"] for q in queries] == ["liver"]
+
+        writer = DatasetWriter(tmp_path / "mined", MINED_SCHEMA)
+        for start in (0, 5):
+            writer.write_batch(
+                mine_projects(
+                    [make_project(i, "description") for i in range(start, start + 5)]
+                )
+            )
+        sample = load_sample(str(tmp_path / "mined"), 3, relevant_ids(queries))
+        assert [r["id"] for r in sample] == [8, 0, 1]
+
+    def test_judged_models(self, tmp_path, monkeypatch):
+        """Models are compared on judged queries whose documents are past the sample."""
+
+        class StubDenseModel:
+            def embed(self, texts):
+                for text in texts:
+                    yield np.array([1.0, 0.0] if "liver" in text else [0.0, 1.0])
+
+        monkeypatch.setattr(
+            pepembed.benchmark, "get_dense_model", lambda name: StubDenseModel()
+        )
+        queries_path = tmp_path / "queries.jsonl"
+        queries_path.write_text(json.dumps({"query": "liver", "relevant": [8]}))
+        DatasetWriter(tmp_path / "mined", MINED_SCHEMA).write_batch(
+            mine_projects(
+                [make_project(i, "kidney", config={"name": "x"}) for i in range(8)]
+                + [make_project(8, "liver", config={"name": "x"})]
+            )
+        )
+
+        results = benchmark_models(
+            str(tmp_path / "mined"), ["stub"], 3, queries_path=str(queries_path)
+        )
+        assert results["stub"]["recall@1"] == 1.0
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from transformers import BertTokenizerFast
+
+from pepembed.chunking import TextChunker, flatten_chunks, mean_pool
+
+
+@pytest.fixture
+def tokenizer(tmp_path):
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    vocab += [f"w{i}" for i in range(20)]
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab))
+    return BertTokenizerFast(str(vocab_file))
+
+
+class TestChunking:
+    def test_chunk_batch(self, tokenizer):
+        """Long texts are split into overlapping windows, short ones are kept whole."""
+        chunker = TextChunker(tokenizer, max_tokens=4, overlap=1)
+        chunks = chunker.chunk_batch(["w1 w2 w3 w4 w5 w6 w7 w8 w9 w10", "w1 w2", ""])
+        assert chunks == [
+            ["w1 w2 w3 w4", "w4 w5 w6 w7", "w7 w8 w9 w10"],
+            ["w1 w2"],
+            [""],
+        ]
+
+        flat, offsets = flatten_chunks(chunks)
+        assert len(flat) == 5
+        assert offsets == [0, 3, 4, 5]
+
+        # texts no longer than a window in characters are not tokenized
+        assert TextChunker(None, max_tokens=8, overlap=1).chunk_batch(["w1 w2"]) == [
+            ["w1 w2"]
+        ]
+
+    def test_invalid_overlap(self, tokenizer):
+        with pytest.raises(ValueError):
+            TextChunker(tokenizer, max_tokens=4, overlap=4)
+
+    def test_mean_pool(self):
+        pooled = mean_pool(np.array([[1.0, 0.0], [0.0, 1.0]]))
+        assert np.allclose(pooled, [2**-0.5, 2**-0.5])
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from pepembed.connections import (
+    CollectionSink,
+    NullSink,
+    QdrantSink,
+    VectorSink,
+    get_sink,
+)
+
+
+class TestSinks:
+    def test_local_sink(self, local_sink, make_point):
+        """The local sink creates the collection on disk and stores points."""
+        assert isinstance(local_sink, QdrantSink)
+        assert isinstance(local_sink, CollectionSink)
+        local_sink.upsert([make_point(i, {"name": f"GSE{i}"}) for i in range(3)])
+        assert local_sink.client.count("test").count == 3
+
+    def test_concurrent_upserts(self, local_sink, make_point):
+        """Points are only reported written once their request succeeded."""
+        sink = QdrantSink(local_sink.client, "test", upload_workers=2)
+        written = []
+        sink.upsert([make_point(1, {})], lambda: written.append(1))
+        bad_point = make_point(2, {})
+        bad_point.vector["dense"] = [1.0]
+        sink.upsert([bad_point], lambda: written.append(2))
+        assert written == []
+        with pytest.raises(ValueError):
+            sink.close()
+        assert written == [1]
+
+    def test_file_and_null_sinks(self, tmp_path, make_point):
+        """The file sink writes one JSON line per point, the null sink counts them."""
+        points = [make_point(i, {"name": f"GSE{i}"}) for i in range(5)]
+        path = tmp_path / "points.jsonl"
+        sink = get_sink("file", path=str(path))
+        sink.upsert(points[:2])
+        sink.close()
+        lines = path.read_text().splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [0, 1]
+
+        null_sink = get_sink("null")
+        assert isinstance(null_sink, NullSink)
+        null_sink.upsert(points)
+        assert null_sink.points_received == 5
+        # neither has a collection to update or scroll
+        assert not isinstance(sink, CollectionSink)
+        assert not isinstance(null_sink, CollectionSink)
+        assert not hasattr(null_sink, "overwrite_payloads")
+
+    def test_abstract_sink(self):
+        with pytest.raises(TypeError):
+            VectorSink()
+
+    def test_invalid_sink(self):
+        with pytest.raises(ValueError):
+            get_sink("elasticsearch")
+        with pytest.raises(ValueError):
+            get_sink("local")
@@ -0,0 +1,85 @@
+import pytest
+
+import pepembed.pepembed
+from pepembed.datasets import (
+    MINED_SCHEMA,
+    DatasetWriter,
+    count_rows,
+    encoded_schema,
+    read_dataset,
+)
+
+PAYLOAD = {
+    "description": "GSE1. Some description",
+    "registry": "geo/GSE1:default",
+    "private": False,
+    "name": "GSE1",
+}
+
+
+class TestDatasets:
+    def test_mined_roundtrip(self, tmp_path):
+        """Mined records survive a write/read cycle across several files."""
+        records = [
+            {
+                "id": i,
+                "dense_text": f"Name: GSE{i}. Description: text. Metadata: cell",
+                "sparse_text": f"GSE{i}. text",
+                "payload": PAYLOAD,
+            }
+            for i in range(5)
+        ]
+        writer = DatasetWriter(tmp_path, MINED_SCHEMA)
+        writer.write_batch(records[:3])
+        writer.write_batch(records[3:])
+        writer.write_batch([])
+
+        assert count_rows(tmp_path) == 5
+        assert len(list(tmp_path.glob("part-*.parquet"))) == 2
+        read_back = [r for batch in read_dataset(tmp_path, 2) for r in batch]
+        assert read_back == records
+
+    def test_encoded_roundtrip(self, tmp_path):
+        """Encoded records keep their named dense and sparse vectors."""
+        record = {
+            "id": 7,
+            "dense": {"dense": [0.5, 0.25], "dense_bge_small_en_v1_5": [1.0, 0.0]},
+            "sparse_indices": [3, 10, 2047],
+            "sparse_values": [1.0, 0.5, 0.125],
+            "payload": PAYLOAD,
+            "vector_digest": "0123456789abcdef",
+        }
+        schema = encoded_schema(list(record["dense"]))
+        DatasetWriter(tmp_path, schema).write_batch([record])
+
+        [[read_back]] = list(read_dataset(tmp_path))
+        assert read_back == record
+
+    def test_existing_dataset(self, tmp_path):
+        """A directory holding a dataset is only written into when overwriting."""
+        record = {"id": 1, "dense_text": "a", "sparse_text": "a", "payload": PAYLOAD}
+        DatasetWriter(tmp_path, MINED_SCHEMA).write_batch([record, record])
+        with pytest.raises(FileExistsError):
+            DatasetWriter(tmp_path, MINED_SCHEMA)
+
+        DatasetWriter(tmp_path, MINED_SCHEMA, overwrite=True).write_batch([record])
+        assert count_rows(tmp_path) == 1
+
+    def test_existing_dataset_before_models(self, tmp_path, monkeypatch):
+        """A non-empty output directory fails the run before any model is loaded."""
+        record = {"id": 1, "dense_text": "a", "sparse_text": "a", "payload": PAYLOAD}
+        DatasetWriter(tmp_path / "mined", MINED_SCHEMA).write_batch([record])
+
+        def load_dense_encoders(*args, **kwargs):
+            raise AssertionError("models loaded")
+
+        monkeypatch.setattr(
+            pepembed.pepembed, "load_dense_encoders", load_dense_encoders
+        )
+        with pytest.raises(FileExistsError):
+            pepembed.pepembed.pepembed(
+                mined_output=str(tmp_path / "mined"),
+                sink_type="null",
+                source_type="jsonl",
+                source_path=str(tmp_path / "dump.jsonl"),
+            )
@@ -0,0 +1,140 @@
+from pepembed.id_tracker import IDTracker
+from pepembed.pepembed import (
+    PayloadUpdater,
+    get_id_tracker,
+    get_tracking_file,
+    iter_changed,
+    record_digests,
+)
+
+
+def make_record(project_id: int, name: str = "GSE1", private: bool = False):
+    return {
+        "id": project_id,
+        "dense_text": f"{name} rna-seq",
+        "sparse_text": f"{name}. rna-seq",
+        "payload": {"name": name, "private": private},
+    }
+
+
+class TestIDTracker:
+    def test_tracking_file(self, tmp_path, monkeypatch):
+        """Every collection is tracked in its own file."""
+        monkeypatch.chdir(tmp_path)
+        assert get_tracking_file("qdrant", "pephub") == "processed.txt"
+        assert get_tracking_file("qdrant", "pephub_ab") == "processed-pephub_ab.txt"
+        assert (
+            get_tracking_file("local", "pephub", "store")
+            == "store/processed-pephub.txt"
+        )
+        assert get_tracking_file("null", "pephub") != "processed.txt"
+
+    def test_legacy_tracking_file(self, tmp_path, monkeypatch):
+        """Remote collections keep using processed.txt until they have their own file."""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "processed.txt").write_text("1\n")
+        assert get_tracking_file("qdrant", "pephub_ab") == "processed.txt"
+        (tmp_path / "processed-pephub_ab.txt").write_text("2\n")
+        assert get_tracking_file("qdrant", "pephub_ab") == "processed-pephub_ab.txt"
+        assert (
+            get_tracking_file("local", "pephub_ab", "store")
+            == "store/processed-pephub_ab.txt"
+        )
+
+    def test_digests(self, tmp_path):
+        """Bare ids and ids with digests are both read back, later lines win."""
+        path = tmp_path / "processed.txt"
+        path.write_text("1\n2\tv\tp\n")
+        tracker = IDTracker(str(path))
+        assert tracker.processed_ids == {1, 2}
+        assert tracker.get_digests(1) is None
+
+        tracker.mark_batch_processed([1, 2], {1: ("v1", "p1"), 2: ("v", "p2")})
+        tracker = IDTracker(str(path))
+        assert tracker.get_digests(1) == ("v1", "p1")
+        assert tracker.get_digests(2) == ("v", "p2")
+
+    def test_compact(self, tmp_path):
+        """Superseded lines are dropped once there are enough of them."""
+        path = tmp_path / "processed.txt"
+        path.write_text("".join(f"{i}\n" for i in range(8)))
+        tracker = IDTracker(str(path))
+        tracker.mark_batch_processed([0], {0: ("v", "p")})
+        assert not tracker.compact()
+        assert len(path.read_text().splitlines()) == 9
+
+        tracker.mark_batch_processed([1, 2], {1: ("v", "p"), 2: ("v", "p")})
+        assert tracker.compact()
+        assert len(path.read_text().splitlines()) == 8
+        tracker = IDTracker(str(path))
+        assert tracker.processed_ids == set(range(8))
+        assert tracker.get_digests(2) == ("v", "p")
+
+    def test_read_only(self, tmp_path):
+        """A read-only tracker remembers new ids for the run without writing them."""
+        path = tmp_path / "processed.txt"
+        path.write_text("1\n")
+        tracker = IDTracker(str(path), read_only=True)
+        tracker.mark_batch_processed([2], {2: ("v", "p")})
+        tracker.unmark_batch([1])
+        assert tracker.processed_ids == {2}
+        assert path.read_text() == "1\n"
+
+    def test_iter_changed(self, tmp_path, local_sink, make_point):
+        """Only new, re-worded and missing records are encoded, payload changes are batched."""
+        local_sink.upsert(
+            [make_point(i, make_record(i)["payload"]) for i in (1, 2, 3, 6, 7)]
+        )
+        tracker = IDTracker(str(tmp_path / "processed.txt"))
+        # 4, 6 and 7 were processed before digests were tracked, 4 never landed
+        tracker.mark_batch_processed(
+            [1, 2, 3, 4, 6, 7],
+            {
+                1: record_digests(make_record(1)),
+                2: record_digests(make_record(2)),
+                3: record_digests(make_record(3)),
+            },
+        )
+        updater = PayloadUpdater(local_sink, tracker, batch_size=10)
+        stats = {"new": 0, "changed": 0, "payload_only": 0, "unchanged": 0}
+        records = [
+            make_record(1),
+            make_record(2, private=True),
+            make_record(3, name="GSE3"),
+            make_record(4),
+            make_record(5),
+            make_record(6),
+            # renamed since it was encoded
+            make_record(7, name="GSE7"),
+        ]
+        to_encode = list(iter_changed(records, tracker, updater, stats))
+
+        assert [r["id"] for r in to_encode] == [3, 5, 4, 7]
+        assert stats == {"new": 1, "changed": 1, "payload_only": 4, "unchanged": 1}
+        assert (updater.updated, updater.not_found, updater.reworded) == (2, 1, 1)
+        assert local_sink.client.retrieve("test", [2])[0].payload["private"] is True
+        assert tracker.get_digests(2) == record_digests(records[1])
+        assert tracker.get_digests(6) == record_digests(records[5])
+        assert tracker.get_digests(4) is None
+        assert tracker.get_digests(7) is None
+
+    def test_second_collection(self, local_path, open_local_sink):
+        """A new collection, e.g. for an A/B comparison, gets every record encoded."""
+        records = [make_record(1), make_record(2)]
+        sink = open_local_sink("pephub")
+        tracker = get_id_tracker(sink, "local", "pephub", local_path)
+        tracker.mark_batch_processed(
+            [1, 2], {r["id"]: record_digests(r) for r in records}
+        )
+        sink.close()
+
+        sink = open_local_sink("pephub_ab")
+        tracker = get_id_tracker(sink, "local", "pephub_ab", local_path)
+        updater = PayloadUpdater(sink, tracker, batch_size=10)
+        stats = {"new": 0, "changed": 0, "payload_only": 0, "unchanged": 0}
+        to_encode = list(iter_changed(records, tracker, updater, stats))
+
+        assert [r["id"] for r in to_encode] == [1, 2]
+        assert stats["new"] == 2
+        first = IDTracker(get_tracking_file("local", "pephub", local_path))
+        assert first.processed_ids == {1, 2}
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import torch
+
+import pepembed.pepembed
+from pepembed.id_tracker import IDTracker
+from pepembed.pepembed import build_payload, get_tracking_file
+from pepembed.sources import JSONLSource
+from pepembed.utils import payload_digest
+
+
+class StubDenseModel:
+    """Embeds texts into 4 dimensions, remembering what it was given."""
+
+    def __init__(self):
+        self.texts = []
+
+    def embed(self, texts, batch_size=None, parallel=None):
+        for text in texts:
+            self.texts.append(text)
+            yield np.array([1.0, len(text) % 7, 0.0, 0.0])
+
+
+class StubSparseModel:
+    """Encodes every text into a single vocabulary term."""
+
+    def __init__(self):
+        self.texts = []
+
+    def encode(self, texts, batch_size=None, convert_to_tensor=False, pool=None):
+        self.texts.extend(texts)
+        return [
+            torch.sparse_coo_tensor([[len(text)]], [1.0], (1000,)) for text in texts
+        ]
+
+
+def write_dump(path, projects):
+    path.write_text("\n".join(json.dumps(p) for p in projects) + "\n")
+
+
+class TestPipeline:
+    def test_rerun_with_changes(
+        self, tmp_path, monkeypatch, local_path, open_local_sink
+    ):
+        """A rerun overwrites a payload-only change and re-encodes a changed text."""
+        monkeypatch.chdir(tmp_path)
+        dense, sparse = StubDenseModel(), StubSparseModel()
+        monkeypatch.setattr(
+            pepembed.pepembed,
+            "load_dense_encoders",
+            lambda *args, **kwargs: ({"dense": dense}, {"dense": 4}),
+        )
+        monkeypatch.setattr(
+            pepembed.pepembed, "get_sparse_model", lambda *args, **kwargs: sparse
+        )
+        projects = [
+            {
+                "namespace": "geo",
+                "name": f"GSE{i}",
+                "id": i,
+                "config": {"experiment_metadata": {"series_title": f"study {i}"}},
+                "description": f"project {i}",
+            }
+            for i in (1, 2, 3)
+        ]
+        dump = tmp_path / "dump.jsonl"
+
+        def run():
+            dense.texts, sparse.texts = [], []
+            pepembed.pepembed.pepembed(
+                batch_size=2,
+                collection_name="test",
+                sink_type="local",
+                sink_path=local_path,
+                source_type="jsonl",
+                source_path=str(dump),
+            )
+
+        write_dump(dump, projects)
+        run()
+        assert len(dense.texts) == len(sparse.texts) == 3
+
+        projects[0]["private"] = True
+        projects[1]["description"] = "project 2, now with single-cell data"
+        write_dump(dump, projects)
+        run()
+        # only the changed description is encoded again
+        assert len(dense.texts) == len(sparse.texts) == 1
+        assert "single-cell" in dense.texts[0]
+
+        rows = {p.id: p for p in JSONLSource(dump)}
+        sink = open_local_sink("test")
+        assert sink.client.count("test").count == 3
+        points = {p.id: p for p in sink.client.retrieve("test", [1, 2, 3])}
+        assert points[1].payload == build_payload(rows[1])
+        assert points[1].payload["private"] is True
+        assert points[2].payload == build_payload(rows[2])
+
+        tracker = IDTracker(get_tracking_file("local", "test", local_path))
+        assert tracker.processed_ids == {1, 2, 3}
+        for point_id in (1, 2):
+            assert tracker.get_digests(point_id)[1] == payload_digest(
+                build_payload(rows[point_id])
+            )
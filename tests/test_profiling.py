@@ -0,0 +1,36 @@
+import json
+import time
+
+from pepembed.profiling import NullProfiler, Profiler, get_profiler, span
+
+
+def busy_wait(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfiling:
+    def test_profiler(self, tmp_path):
+        """Spans land in the Chrome trace and sampled stacks in the folded file."""
+        profiler = Profiler(str(tmp_path), interval_s=0.001)
+        profiler.start()
+        with span("batch", batch=0):
+            with span("encode"):
+                busy_wait(0.1)
+        profiler.stop()
+
+        events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+        spans = {e["name"]: e for e in events if e["ph"] == "X"}
+        assert set(spans) == {"batch", "encode"}
+        assert spans["batch"]["args"] == {"batch": 0}
+        assert spans["encode"]["dur"] <= spans["batch"]["dur"]
+
+        folded = (tmp_path / "profile.folded").read_text().splitlines()
+        assert any("busy_wait" in line for line in folded)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+
+    def test_disabled(self):
+        assert isinstance(get_profiler(None), NullProfiler)
+        with span("noop"):
+            pass
@@ -0,0 +1,97 @@
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from pepdbagent.db_utils import Projects
+from sqlalchemy import create_engine, event, insert
+
+from pepembed.sources import (
+    DirectorySource,
+    PostgresSource,
+    ProjectRow,
+    ProjectSource,
+    get_source,
+    registry_id,
+)
+
+
+class TestSources:
+    def test_abstract_source(self):
+        with pytest.raises(TypeError):
+            ProjectSource()
+
+    def test_jsonl_source(self, tmp_path):
+        """JSONL dumps yield rows with the Projects fields, filling in defaults."""
+        path = tmp_path / "dump.jsonl"
+        records = [
+            {
+                "namespace": "geo",
+                "name": "GSE1",
+                "tag": "default",
+                "config": {"experiment_metadata": {"series_title": "a"}},
+                "id": 1,
+                "description": "first",
+                "private": True,
+            },
+            {
+                "namespace": "geo",
+                "name": "GSE2",
+                "config": json.dumps({"name": "GSE2"}),
+            },
+        ]
+        path.write_text("\n".join(json.dumps(r) for r in records) + "\n")
+
+        rows = list(get_source("jsonl", str(path)))
+        assert rows[0] == ProjectRow(**records[0])
+        assert rows[1].config == {"name": "GSE2"}
+        assert rows[1].tag == "default"
+        assert rows[1].id == registry_id("geo", "GSE2")
+        assert rows[1].private is False
+
+    def test_directory_source(self):
+        """PEP configs in a directory are loaded with stable ids."""
+        source = DirectorySource(
+            os.path.join(os.getcwd(), "tests/data/testconfigs"), namespace="geo"
+        )
+        rows = list(source)
+        assert source.count() == len(rows) == 1
+        assert rows[0].namespace == "geo"
+        assert rows[0].id == registry_id("geo", rows[0].name)
+        assert "experiment_metadata" in rows[0].config
+
+    def test_postgres_pages(self):
+        """The database is read in id order, one short query per page."""
+        engine = create_engine("sqlite://")
+        Projects.__table__.create(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                insert(Projects),
+                [
+                    {
+                        "id": i,
+                        "namespace": "geo",
+                        "name": f"GSE{i}",
+                        "tag": "default",
+                        "digest": str(i),
+                        "description": f"project {i}",
+                        "config": {"name": f"GSE{i}"},
+                        "private": False,
+                        "number_of_samples": 0,
+                        "submission_date": datetime(2024, 1, 1),
+                    }
+                    for i in (5, 3, 1, 4, 2)
+                ],
+            )
+        statements = []
+        event.listen(
+            engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+        )
+        agent = SimpleNamespace(pep_db_engine=SimpleNamespace(engine=engine))
+        source = PostgresSource(agent, chunk_size=2)
+
+        assert [row.id for row in source] == [1, 2, 3, 4, 5]
+        assert len(statements) == 3
+        assert [row.config for row in source.iter_without_config()] == [None] * 5
+        assert [row.id for row in source.iter_by_ids({4, 1, 9})] == [1, 4]
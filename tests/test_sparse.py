@@ -0,0 +1,35 @@
+import numpy as np
+
+from pepembed.sparse import SparseCompactor, compact_sparse
+
+
+class TestSparse:
+    def test_compact_sparse(self):
+        """Duplicates are merged, then weak and non-positive terms pruned."""
+        indices, values = compact_sparse(
+            [7, 3, 7, 1, 9], [0.5, 0.2, 0.5, 0.05, 0.0], top_k=2
+        )
+        assert indices == [3, 7]
+        assert np.allclose(values, [0.2, 1.0])
+
+        indices, _ = compact_sparse([1, 2, 3], [0.1, 0.3, 0.2], threshold=0.15)
+        assert indices == [2, 3]
+        assert compact_sparse([], []) == ([], [])
+
+    def test_float16(self):
+        _, values = compact_sparse([1], [0.1234567], float16=True)
+        assert values == [float(np.float16(0.1234567))]
+
+    def test_report(self):
+        compactor = SparseCompactor(top_k=2, float16=True)
+        records = [
+            {"id": 1, "sparse_indices": [1, 2, 3, 4], "sparse_values": [1.0] * 4}
+        ]
+        compacted = compactor.compact_records(records)
+        assert len(compacted[0]["sparse_indices"]) == 2
+        assert len(records[0]["sparse_indices"]) == 4
+
+        report = compactor.report()
+        assert report["bytes_before"] == 32
+        assert report["bytes_after"] == 12
+        assert report["size_reduction"] == 1 - 12 / 32
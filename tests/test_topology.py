@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import pepembed.topology
+from pepembed.topology import (
+    DEFAULT_TOPOLOGY,
+    apply_topology,
+    available_cpus,
+    cgroup_cpu_quota,
+    dense_parallel,
+    dense_threads,
+    load_topology,
+    max_sparse_workers,
+)
+
+
+class TestTopology:
+    def test_cgroup_quota(self, tmp_path, monkeypatch):
+        """CPU quotas of cgroup v2 and v1 limit the available CPUs."""
+        v2 = tmp_path / "v2"
+        v2.mkdir()
+        (v2 / "cpu.max").write_text("max 100000\n")
+        assert cgroup_cpu_quota(str(v2)) is None
+        (v2 / "cpu.max").write_text("250000 100000\n")
+        assert cgroup_cpu_quota(str(v2)) == 2.5
+
+        v1 = tmp_path / "v1" / "cpu"
+        v1.mkdir(parents=True)
+        (v1 / "cpu.cfs_quota_us").write_text("-1\n")
+        (v1 / "cpu.cfs_period_us").write_text("100000\n")
+        assert cgroup_cpu_quota(str(tmp_path / "v1")) is None
+        (v1 / "cpu.cfs_quota_us").write_text("100000\n")
+        assert cgroup_cpu_quota(str(tmp_path / "v1")) == 1.0
+
+        monkeypatch.setattr(pepembed.topology, "cgroup_cpu_quota", lambda: 0.5)
+        assert available_cpus() == 1
+
+    def test_precedence(self, tmp_path, monkeypatch):
+        """Settings come from the file, then environment variables, then CLI options."""
+        path = tmp_path / "topology.json"
+        path.write_text(
+            json.dumps({"dense_workers": 8, "sparse_workers": 2, "torch_threads": 4})
+        )
+        monkeypatch.setenv("SPARSE_WORKERS", "3")
+        monkeypatch.delenv("TOPOLOGY_FILE", raising=False)
+
+        topology = load_topology(str(path), torch_threads=1, upload_workers=None)
+        assert topology.dense_workers == 8
+        assert topology.sparse_workers == 3
+        assert topology.torch_threads == 1
+        assert topology.upload_workers == DEFAULT_TOPOLOGY.upload_workers
+
+        monkeypatch.setenv("TOPOLOGY_FILE", str(path))
+        assert load_topology().dense_workers == 8
+
+    def test_invalid(self, tmp_path):
+        path = tmp_path / "topology.json"
+        path.write_text(json.dumps({"gpu_workers": 2}))
+        with pytest.raises(ValueError):
+            load_topology(str(path))
+        with pytest.raises(ValueError):
+            load_topology(dense_workers=0)
+
+    def test_dense_parallel(self, caplog):
+        """ONNX Runtime threads only apply to in-process dense encoding."""
+        in_process = DEFAULT_TOPOLOGY._replace(dense_workers=1, onnx_threads=2)
+        assert dense_parallel(in_process) is None
+        assert dense_threads(in_process) == 2
+
+        workers = in_process._replace(dense_workers=4)
+        assert dense_parallel(workers) == 4
+        assert dense_threads(workers) is None
+        apply_topology(workers._replace(torch_threads=None))
+        assert "onnx_threads is ignored" in caplog.text
+
+    def test_oversubscription(self, caplog):
+        """Sparse workers without a thread count each use every core."""
+        topology = DEFAULT_TOPOLOGY._replace(
+            dense_workers=1, sparse_workers=2, torch_threads=None
+        )
+        apply_topology(topology)
+        assert f"up to {2 * available_cpus()} threads" in caplog.text
+
+    def test_max_sparse_workers(self):
+        """Autotune starts no more sparse model copies than memory allows."""
+        assert max_sparse_workers(500, None) == 8
+        assert max_sparse_workers(500, 64000) == 8
+        assert max_sparse_workers(500, 3000) == 3
+        assert max_sparse_workers(500, 100) == 1